@@ -0,0 +1,291 @@
+"""
+JSON API for home automation pollers (no Streamlit):
+
+    python api_server.py [--host 127.0.0.1] [--port 8502]
+
+    GET /power      instantaneous clearsky/weather power, sun position, shadow, home power (Shelly)
+    GET /daily      power curve of a day          (?date=YYYY-MM-DD&step=5min)
+    GET /energy     clearsky/weather energy of a day (?date=YYYY-MM-DD)
+    GET /forecast   daily energy and power curve of the next days
+
+Every endpoint takes the site as query parameters (lat, lon, alt, tz, tilt, azimuth, area, efficiency in %),
+defaulting to the values of config. Responses are cached per query and time bucket and carry an ETag:
+a poller sending If-None-Match gets 304 while the result does not change.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qsl
+import argparse
+import datetime
+import hashlib
+import json
+import logging
+import math
+import time
+
+import pandas as pd
+import requests
+
+from pvlib.location import Location
+
+from weather_checker import get_weather_data, build_weather_data
+from home_power_usage_checker import get_actual_home_power, get_latest_home_power, start_telemetry_collector
+from solar_calculation import get_sun_position, calculate_if_times_are_shadowed_with_shadow_profile, parse_shadow_profile
+from stage_graph import daily_stages
+from lru_cache import LRUCache
+
+from config import ITALY_TIMEZONE, STANDARD_LOCATION_LATITUDE, STANDARD_LOCATION_LONGITUDE, STANDARD_LOCATION_ALTITUDE
+from config import STANDARD_PANEL_TILT, STANDARD_PANEL_AZIMUTH, STANDARD_PANEL_AREA, STANDARD_PANEL_EFFICIENCY
+from config import STANDARD_STEP, TELEMETRY_COLLECTOR_ENABLED
+from config import API_HOST, API_PORT, API_CACHE_SIZE, API_POWER_BUCKET, API_WEATHER_BUCKET
+
+logger = logging.getLogger(__name__)
+
+SITE_PARAMETERS = {
+    'lat': STANDARD_LOCATION_LATITUDE, 'lon': STANDARD_LOCATION_LONGITUDE, 'alt': STANDARD_LOCATION_ALTITUDE,
+    'tilt': STANDARD_PANEL_TILT, 'azimuth': STANDARD_PANEL_AZIMUTH,
+    'area': STANDARD_PANEL_AREA, 'efficiency': STANDARD_PANEL_EFFICIENCY
+}
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+def _number(value, digits=1):
+    # NaN (meteo non disponibile) diventa null nel JSON
+    value = float(value)
+    return None if math.isnan(value) else round(value, digits)
+
+def _default_home_power():
+    # Campione del collector se recente, altrimenti richiesta diretta allo Shelly; se il dashboard
+    # raccoglie già i campioni, start_telemetry_collector restituisce una vista in sola lettura del suo store
+    latest_home_power = get_latest_home_power(start_telemetry_collector()) if TELEMETRY_COLLECTOR_ENABLED else None
+    return get_actual_home_power() if latest_home_power is None else latest_home_power
+
+#### --- Endpoints and response cache ---
+
+class SolarApi:
+    """
+    Computations of main.main() as JSON documents, independent of the HTTP layer.
+
+    - weather_client: object with get_current_weather/get_forecast (default: openweather_client)
+    - archive: WeatherArchive for the past days (default: weather_archive, False: none, e.g. with a stand-in weather_client)
+    - home_power: function returning (pv_power, network_power) as get_actual_home_power
+    - power_bucket, weather_bucket: seconds of the cache buckets of /power and of the other endpoints
+    """
+
+    def __init__(self, weather_client=None, home_power=None, cache_size=API_CACHE_SIZE,
+                 power_bucket=API_POWER_BUCKET, weather_bucket=API_WEATHER_BUCKET, archive=None):
+        self.weather_client = weather_client
+        self.archive = archive
+        self.home_power = _default_home_power if home_power is None else home_power
+        self.cache_size = cache_size
+        self.buckets = {'/power': power_bucket, '/daily': weather_bucket, '/energy': weather_bucket, '/forecast': weather_bucket}
+        self.endpoints = {'/power': self.power, '/daily': self.daily, '/energy': self.energy, '/forecast': self.forecast}
+
+        self._responses = LRUCache(cache_size)
+
+    @property
+    def hits(self):
+        return self._responses.hits
+
+    @property
+    def misses(self):
+        return self._responses.misses
+
+    def handle(self, path, query, if_none_match=None):
+        """
+        Response to GET path?query.
+
+        Returns: (status, headers, body bytes)
+        """
+
+        if path == '/health':
+            return 200, {'Content-Type': 'application/json'}, b'{"status": "ok"}'
+        if path not in self.endpoints:
+            return self._error(404, f"Unknown endpoint {path}")
+
+        # Chiave sulla query grezza: un hit non ricostruisce né il sito né i calcoli
+        now = time.time()
+        bucket_seconds = self.buckets[path]
+        bucket = int(now // bucket_seconds)
+        key = (path, tuple(sorted(parse_qsl(query))), bucket)
+
+        response = self._responses.get(key)
+        if response is None:
+            try:
+                document = self.endpoints[path](dict(parse_qsl(query)))
+            except ApiError as error:
+                return self._error(error.status, str(error))
+            body = json.dumps(document).encode()
+            response = (body, '"' + hashlib.sha1(body).hexdigest()[:20] + '"')
+
+            self._responses.put(key, response)
+
+        body, etag = response
+        headers = {'Content-Type': 'application/json', 'ETag': etag,
+                   'Cache-Control': f"max-age={max(1, int((bucket + 1) * bucket_seconds - now))}"}
+        if if_none_match is not None and etag in [tag.strip() for tag in if_none_match.split(',')]:
+            return 304, headers, b''
+        return 200, headers, body
+
+    def _error(self, status, message):
+        return status, {'Content-Type': 'application/json'}, json.dumps({'error': message}).encode()
+
+    # --- Shared inputs ---
+
+    def _site(self, query):
+        try:
+            values = {name: float(query.get(name, default)) for name, default in SITE_PARAMETERS.items()}
+        except ValueError:
+            raise ApiError(400, "Site parameters must be numbers")
+
+        location = Location(values['lat'], values['lon'], altitude=values['alt'], tz=query.get('tz', ITALY_TIMEZONE),
+                            name='LocationPerCalcolo')
+        shadow_profile = parse_shadow_profile()
+        panel = {'tilt': values['tilt'], 'azimuth': values['azimuth'],
+                 'area': values['area'], 'efficiency': values['efficiency'] / 100.0}
+        return location, panel, shadow_profile
+
+    def _date(self, query, location):
+        try:
+            return datetime.date.fromisoformat(query['date']) if 'date' in query else pd.Timestamp.now(tz=location.tz).date()
+        except ValueError:
+            raise ApiError(400, "date must be YYYY-MM-DD")
+
+    def _step(self, query):
+        step = query.get('step', STANDARD_STEP)
+        try:
+            if pd.Timedelta(step) < pd.Timedelta('1min'):
+                raise ApiError(400, "step must be at least 1min")
+        except ValueError:
+            raise ApiError(400, f"Invalid step {step}")
+        return step
+
+    def _weather_data(self, times, location):
+        try:
+            return get_weather_data(times, location.latitude, location.longitude, freq=STANDARD_STEP,
+                                    std_timezone=location.tz, weather_client=self.weather_client, archive=self.archive)
+        except (requests.RequestException, ValueError, KeyError, IndexError, TypeError) as error:
+            # Come nel dashboard: senza risposta meteo restano i soli valori clearsky
+            logger.warning("Weather fetch failed: %s", type(error).__name__)
+            return build_weather_data(times, None, None, std_timezone=location.tz)
+
+    def _daily_power(self, query, step=STANDARD_STEP):
+        # Stessi stadi in cache del dashboard (stage_graph): gli endpoint dello stesso giorno condividono i calcoli
+        location, panel, shadow_profile = self._site(query)
+        stage_inputs = {'date': self._date(query, location), 'location': location, 'step': step,
+                        'panel': panel, 'shadow_profile': shadow_profile}
+        times = daily_stages.run('times', stage_inputs)
+        stage_inputs['weather'] = self._weather_data(times, location)
+        return stage_inputs, daily_stages.run('plant_power', stage_inputs)
+
+    # --- Endpoints ---
+
+    def power(self, query):
+        stage_inputs, plant_power = self._daily_power({name: value for name, value in query.items() if name != 'date'})
+        location = stage_inputs['location']
+        now = pd.Timestamp.now(tz=location.tz).floor(STANDARD_STEP)
+
+        try:
+            home_pv_power, network_power = self.home_power()
+        except (requests.RequestException, ValueError, KeyError, IndexError, TypeError) as error:
+            logger.warning("Shelly fetch failed: %s", type(error).__name__)
+            home_pv_power, network_power = False, None
+
+        shadowed = calculate_if_times_are_shadowed_with_shadow_profile(
+            times=pd.DatetimeIndex([now]), location=location, shadow_profile=stage_inputs['shadow_profile'])['shadowed'].iloc[0]
+
+        return {
+            'datetime': now.isoformat(),
+            'sun': get_sun_position(now, location),
+            'shadowed': bool(shadowed),
+            'clearsky_power': _number(plant_power[('clearsky', 'total')].loc[now]),
+            'weather_power': _number(plant_power[('weather', 'total')].loc[now]),
+            'home_pv_power': None if home_pv_power is False else _number(home_pv_power),
+            'network_power': None if home_pv_power is False else _number(network_power)
+        }
+
+    def daily(self, query):
+        stage_inputs, plant_power = self._daily_power(query, step=self._step(query))
+        clearsky_power = plant_power[('clearsky', 'total')]
+        weather_power = plant_power[('weather', 'total')]
+        return {
+            'date': stage_inputs['date'].isoformat(),
+            'step': stage_inputs['step'],
+            'power': [{'datetime': timestamp.isoformat(), 'clearsky_power': _number(clearsky), 'weather_power': _number(weather)}
+                      for timestamp, clearsky, weather in zip(plant_power.index, clearsky_power.to_numpy(), weather_power.to_numpy())]
+        }
+
+    def energy(self, query):
+        stage_inputs, _ = self._daily_power(query)
+        clearsky_energy, weather_energy = daily_stages.run('daily_energy', stage_inputs)
+        weather_available = not stage_inputs['weather']['times_cloud_cover'].empty
+        return {
+            'date': stage_inputs['date'].isoformat(),
+            'clearsky_energy_kwh': _number(clearsky_energy),
+            'weather_energy_kwh': _number(weather_energy) if weather_available else None
+        }
+
+    def forecast(self, query):
+        stage_inputs, _ = self._daily_power({name: value for name, value in query.items() if name != 'date'})
+        forecast_data, daily_forecast_data = daily_stages.run('forecast', stage_inputs)
+        return {
+            'days': [{'date': day.data.isoformat(), 'clearsky_energy_kwh': _number(day.clearsky_energy),
+                      'weather_energy_kwh': _number(day.weather_energy)}
+                     for day in daily_forecast_data.itertuples()],
+            'power': [{'datetime': row.datetime.isoformat(), 'clearsky_power': _number(row.clearsky_production),
+                       'weather_power': _number(row.weather_production)}
+                      for row in forecast_data.itertuples()]
+        }
+
+#### --- HTTP layer (standard library) ---
+
+class ApiRequestHandler(BaseHTTPRequestHandler):
+    server_version = 'SolarPanelsAPI/1.0'
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        try:
+            status, headers, body = self.server.api.handle(url.path, url.query, self.headers.get('If-None-Match'))
+        except Exception:
+            logger.exception("Error handling %s", self.path)
+            status, headers, body = 500, {'Content-Type': 'application/json'}, b'{"error": "internal error"}'
+
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+def make_server(api=None, host=API_HOST, port=API_PORT):
+    """ThreadingHTTPServer serving api (default: SolarApi with the real OpenWeather and Shelly clients)."""
+    server = ThreadingHTTPServer((host, port), ApiRequestHandler)
+    server.daemon_threads = True
+    server.api = SolarApi() if api is None else api
+    return server
+
+#### Main function to run from command line ############
+
+def main():
+    parser = argparse.ArgumentParser(description="API JSON della produzione fotovoltaico (senza Streamlit)")
+    parser.add_argument('--host', default=API_HOST)
+    parser.add_argument('--port', type=int, default=API_PORT)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    server = make_server(host=args.host, port=args.port)
+    logger.info("Serving on http://%s:%s", *server.server_address[:2])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
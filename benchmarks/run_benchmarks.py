@@ -0,0 +1,265 @@
+"""
+Benchmark suite for the solar pipeline.
+
+    python benchmarks/run_benchmarks.py                    # run and compare with benchmarks/baseline.json
+    python benchmarks/run_benchmarks.py --save-baseline    # run and store the results as the new baseline
+    python benchmarks/run_benchmarks.py --only power --quick
+
+Each case is timed cold (geometry and horizon caches cleared before every repeat) and its peak
+Python/NumPy memory is measured with tracemalloc in a separate run. Weather uses the recorded
+OpenWeather response in benchmarks/openweather_response.json, no network is needed.
+"""
+import argparse
+import copy
+import datetime
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+
+import numpy as np
+import pandas as pd
+from pvlib.location import Location
+
+import solar_calculation
+from solar_calculation import calculate_power_output, calculate_if_times_are_shadowed_with_shadow_profile
+from solar_calculation import adjust_irradiance_for_clouds_and_shadow, calculate_energy_for_times
+from weather_checker import get_weather_data
+
+from config import ITALY_TIMEZONE, STANDARD_LOCATION_LATITUDE, STANDARD_LOCATION_LONGITUDE, STANDARD_LOCATION_ALTITUDE
+from config import STANDARD_PANEL_TILT, STANDARD_PANEL_AZIMUTH, STANDARD_PANEL_AREA, STANDARD_PANEL_EFFICIENCY
+
+BASELINE_PATH = os.path.join(BENCHMARKS_DIR, 'baseline.json')
+RECORDED_RESPONSE_PATH = os.path.join(BENCHMARKS_DIR, 'openweather_response.json')
+
+MAX_POINTS = 1_000_000          # cases above this size are skipped unless --full
+REGRESSION_THRESHOLD = 1.25     # time or memory ratio vs baseline flagged as regression
+
+# Sweeps around a base case of 1 day, 1 minute, 8 shadow points, 1 panel
+STEPS = ['1s', '10s', '1min', '5min', '15min']
+HORIZONS = [1, 7, 30, 365]      # days
+SHADOW_PROFILE_SIZES = [8, 360, 3600, 36000]
+PANEL_COUNTS = [1, 2, 4, 8]
+
+BASE_CASE = {'step': '1min', 'days': 1, 'shadow_points': 8, 'panels': 1}
+
+#### --- Local stand-in for OpenWeather ---
+
+class RecordedOpenWeatherClient:
+    """Serves the recorded responses, with forecast times moved to start from now."""
+
+    def __init__(self, path=RECORDED_RESPONSE_PATH):
+        with open(path) as response_file:
+            self.responses = json.load(response_file)
+
+    def get_current_weather(self, lat, lon, api_key=None):
+        return self.responses['current']
+
+    def get_forecast(self, lat, lon, api_key=None):
+        forecast = copy.deepcopy(self.responses['forecast'])
+        shift = int(time.time()) // 10800 * 10800 - forecast['list'][0]['dt']
+        for entry in forecast['list']:
+            entry['dt'] += shift
+        return forecast
+
+#### --- Inputs ---
+
+def make_location():
+    return Location(STANDARD_LOCATION_LATITUDE, STANDARD_LOCATION_LONGITUDE, altitude=STANDARD_LOCATION_ALTITUDE, tz=ITALY_TIMEZONE)
+
+def make_times(location, days, step):
+    start = pd.Timestamp.now(tz=location.tz).normalize()
+    return pd.date_range(start=start, end=start + pd.Timedelta(days=days), freq=step)
+
+def make_shadow_profile(points):
+    # Profilo sintetico: orizzonte urbano irregolare con il numero di punti richiesto
+    azimuths = np.linspace(0, 360, points)
+    elevations = 10 + 8 * np.sin(np.radians(azimuths) * 3) + 5 * (np.mod(azimuths, 45) < 10)
+    return pd.DataFrame({"Azimuth": azimuths, "Elevation": elevations})
+
+def make_panels(count):
+    panels = [{'name': f'array_{number}',
+               'tilt': STANDARD_PANEL_TILT + 5 * number,
+               'azimuth': (STANDARD_PANEL_AZIMUTH + 360 * number / count) % 360,
+               'area': STANDARD_PANEL_AREA,
+               'efficiency': STANDARD_PANEL_EFFICIENCY / 100.0} for number in range(count)]
+    return panels[0] if count == 1 else panels
+
+def make_weather_data(times, cloud_cover=50.0):
+    return {'times_cloud_cover': pd.DataFrame({'cloud_cover': cloud_cover}, index=times), 'actual_weather': []}
+
+#### --- Cases ---
+
+def get_cases():
+    """Returns the list of (name, parameters) of the sweeps, without duplicates."""
+    sweeps = ([{'step': step} for step in STEPS]
+              + [{'days': days} for days in HORIZONS]
+              + [{'shadow_points': points} for points in SHADOW_PROFILE_SIZES]
+              + [{'panels': panels} for panels in PANEL_COUNTS])
+
+    cases = {}
+    for benchmark in BENCHMARKS:
+        for sweep in sweeps:
+            parameters = dict(BASE_CASE, **sweep)
+            name = f"{benchmark}[step={parameters['step']},days={parameters['days']},shadow={parameters['shadow_points']},panels={parameters['panels']}]"
+            cases[name] = (benchmark, parameters)
+    return cases
+
+def setup_power_output(parameters):
+    location = make_location()
+    times = make_times(location, parameters['days'], parameters['step'])
+    arguments = (times, location, make_panels(parameters['panels']), make_shadow_profile(parameters['shadow_points']), make_weather_data(times))
+    return len(times), lambda: calculate_power_output(*arguments)
+
+def setup_shadow(parameters):
+    location = make_location()
+    times = make_times(location, parameters['days'], parameters['step'])
+    shadow_profile = make_shadow_profile(parameters['shadow_points'])
+    return len(times), lambda: calculate_if_times_are_shadowed_with_shadow_profile(times, location, shadow_profile)
+
+def setup_adjust_irradiance(parameters):
+    location = make_location()
+    times = make_times(location, parameters['days'], parameters['step'])
+    shadow_profile = make_shadow_profile(parameters['shadow_points'])
+    cloud_cover = pd.Series(50.0, index=times)
+
+    def run():
+        # Come in calculate_power_output, posizione solare e clearsky fanno parte della misura
+        solar_pos = location.get_solarposition(times)
+        clearsky = location.get_clearsky(times, solar_position=solar_pos)
+        return adjust_irradiance_for_clouds_and_shadow(times, location, clearsky, cloud_cover, solar_pos['apparent_zenith'], shadow_profile)
+    return len(times), run
+
+def setup_weather(parameters):
+    location = make_location()
+    times = make_times(location, parameters['days'], parameters['step'])
+    client = RecordedOpenWeatherClient()
+    # Senza archivio: la misura non deve dipendere dal contenuto di .cache né includere I/O SQLite
+    return len(times), lambda: get_weather_data(times, freq=parameters['step'], std_timezone=location.tz,
+                                                weather_client=client, archive=False)
+
+def setup_energy(parameters):
+    location = make_location()
+    times = make_times(location, parameters['days'], parameters['step'])
+    power_data = pd.Series(np.random.default_rng(0).uniform(0, 1000, len(times)), index=times)
+    return len(times), lambda: calculate_energy_for_times(times, parameters['step'], power_data)
+
+BENCHMARKS = {
+    'calculate_power_output': setup_power_output,
+    'calculate_if_times_are_shadowed_with_shadow_profile': setup_shadow,
+    'adjust_irradiance_for_clouds_and_shadow': setup_adjust_irradiance,
+    'get_weather_data': setup_weather,
+    'calculate_energy_for_times': setup_energy
+}
+
+# Parametri che non influenzano ciascun benchmark (i casi corrispondenti sono doppioni)
+IGNORED_PARAMETERS = {
+    'calculate_if_times_are_shadowed_with_shadow_profile': {'panels'},
+    'adjust_irradiance_for_clouds_and_shadow': {'panels'},
+    'get_weather_data': {'panels', 'shadow_points'},
+    'calculate_energy_for_times': {'panels', 'shadow_points'}
+}
+
+#### --- Measurement ---
+
+def clear_caches():
+    solar_calculation.solar_geometry_cache.clear()
+    solar_calculation._horizon_cache.clear()
+
+def measure(run, repeats):
+    timings = []
+    for _ in range(repeats):
+        clear_caches()
+        start = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start)
+
+    clear_caches()
+    tracemalloc.start()
+    run()
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {'time_s': min(timings), 'peak_memory_mb': peak_memory / 2**20}
+
+def run_benchmarks(only=None, repeats=3, full=False):
+    results = {}
+    seen = set()
+    for name, (benchmark, parameters) in get_cases().items():
+        if only and not any(pattern in name for pattern in only):
+            continue
+
+        relevant = tuple((key, value) for key, value in sorted(parameters.items()) if key not in IGNORED_PARAMETERS.get(benchmark, ()))
+        if (benchmark, relevant) in seen:
+            continue
+        seen.add((benchmark, relevant))
+
+        points = int(parameters['days'] * pd.Timedelta('1D') / pd.Timedelta(parameters['step'])) * max(parameters['panels'], 1)
+        if points > MAX_POINTS and not full:
+            print(f"{name:<110} skipped ({points} points, use --full)")
+            continue
+
+        size, run = BENCHMARKS[benchmark](parameters)
+        result = measure(run, repeats)
+        result['points'] = size
+        results[name] = result
+        print(f"{name:<110} {result['time_s'] * 1000:10.1f} ms {result['peak_memory_mb']:10.1f} MB")
+
+    return results
+
+def compare_with_baseline(results, baseline, threshold=REGRESSION_THRESHOLD):
+    regressions = []
+    print(f"\n{'case':<110} {'time':>8} {'memory':>8}")
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        time_ratio = result['time_s'] / max(baseline[name]['time_s'], 1e-9)
+        memory_ratio = result['peak_memory_mb'] / max(baseline[name]['peak_memory_mb'], 1e-9)
+        flag = ' REGRESSION' if time_ratio > threshold or memory_ratio > threshold else ''
+        print(f"{name:<110} {time_ratio:7.2f}x {memory_ratio:7.2f}x{flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+#### Main function to run the suite from command line ############
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark della pipeline di calcolo")
+    parser.add_argument('--only', nargs='*', help="esegue solo i casi il cui nome contiene uno di questi testi")
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--quick', action='store_true', help="una sola ripetizione")
+    parser.add_argument('--full', action='store_true', help=f"include i casi con più di {MAX_POINTS} punti")
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD)
+    args = parser.parse_args()
+
+    results = run_benchmarks(only=args.only, repeats=1 if args.quick else args.repeats, full=args.full)
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as baseline_file:
+                baseline = json.load(baseline_file)
+        baseline.update(results)
+        baseline['_meta'] = {'saved': datetime.datetime.now().isoformat(timespec='seconds'), 'python': sys.version.split()[0]}
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(baseline, baseline_file, indent=1, sort_keys=True)
+        print(f"\nBaseline salvata in {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"\nNessuna baseline in {args.baseline}: eseguire con --save-baseline")
+        return 0
+
+    with open(args.baseline) as baseline_file:
+        baseline = json.load(baseline_file)
+    regressions = compare_with_baseline(results, baseline, threshold=args.threshold)
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,100 @@
+import pandas as pd
+import numpy as np
+
+from config import CHART_MAX_POINTS, CHART_DOWNSAMPLING
+
+#### --- Shape preserving downsampling of one series ---
+
+def lttb_indices(x, y, max_points):
+    """
+    Largest-Triangle-Three-Buckets: indices of max_points samples that keep the visual shape of (x, y).
+    First and last samples are always kept; NaN values must be removed by the caller.
+    """
+
+    length = len(y)
+    if length <= max_points or max_points < 3:
+        return np.arange(length)
+
+    # Bucket interni (primo e ultimo punto esclusi), uno per punto scelto
+    edges = (np.arange(max_points - 1) * (length - 2) / (max_points - 2)).astype(int) + 1
+    edges[-1] = length - 1
+
+    selected = np.empty(max_points, dtype=int)
+    selected[0], selected[-1] = 0, length - 1
+    previous = 0
+    for bucket in range(max_points - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        if bucket + 2 < len(edges):
+            next_x, next_y = x[end:edges[bucket + 2]].mean(), y[end:edges[bucket + 2]].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+
+        # Punto del bucket che forma il triangolo più grande con il punto precedente e la media del successivo
+        areas = np.abs((x[previous] - next_x) * (y[start:end] - y[previous])
+                       - (x[previous] - x[start:end]) * (next_y - y[previous]))
+        previous = start + int(np.argmax(areas))
+        selected[bucket + 1] = previous
+
+    return selected
+
+def minmax_indices(y, max_points):
+    """Indices of the minimum and maximum of max_points / 2 equal buckets, in order (first and last kept)."""
+
+    length = len(y)
+    if length <= max_points or max_points < 4:
+        return np.arange(length)
+
+    buckets = max_points // 2
+    edges = np.linspace(0, length, buckets + 1).astype(int)
+    bucket_of = np.repeat(np.arange(buckets), np.diff(edges))
+
+    minimum = np.minimum.reduceat(y, edges[:-1])[bucket_of] == y
+    maximum = np.maximum.reduceat(y, edges[:-1])[bucket_of] == y
+    first_minimum = np.flatnonzero(minimum)[np.unique(bucket_of[minimum], return_index=True)[1]]
+    first_maximum = np.flatnonzero(maximum)[np.unique(bucket_of[maximum], return_index=True)[1]]
+
+    return np.unique(np.concatenate([[0, length - 1], first_minimum, first_maximum]))
+
+#### --- Downsampling of the chart data ---
+
+def downsample_frame(frame, columns, x=None, max_points=CHART_MAX_POINTS, method=CHART_DOWNSAMPLING):
+    """
+    Rows of frame to plot for the given columns, at most max_points per column.
+
+    The indices chosen for each column are merged, so all the columns keep a shared x.
+    NaN runs are preserved as gaps (their first and last rows are kept).
+
+    - frame: DataFrame with a DatetimeIndex or with a datetime column x
+    - columns: columns to plot
+    - x: name of the datetime column (default: the index)
+    - max_points: point budget per column
+    - method: 'lttb' or 'minmax'
+
+    Returns: DataFrame with the selected rows, in order
+    """
+
+    if len(frame) <= max_points:
+        return frame
+
+    x_values = frame.index if x is None else pd.DatetimeIndex(frame[x])
+    x_values = x_values.as_unit('ns').asi8.astype(float) / 1e9
+
+    selected = [np.array([0, len(frame) - 1])]
+    for column in columns:
+        y = frame[column].to_numpy(dtype=float)
+        valid = ~np.isnan(y)
+        valid_rows = np.flatnonzero(valid)
+        if len(valid_rows) == 0:
+            continue
+
+        if method == 'minmax':
+            chosen = minmax_indices(y[valid], max_points)
+        else:
+            chosen = lttb_indices(x_values[valid], y[valid], max_points)
+        selected.append(valid_rows[chosen])
+
+        # Bordi delle sequenze di NaN, così il grafico mostra i buchi
+        changes = np.flatnonzero(np.diff(valid.astype(np.int8)))
+        selected.append(np.concatenate([changes, changes + 1]))
+
+    return frame.iloc[np.unique(np.concatenate(selected))]
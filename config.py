@@ -1,11 +1,79 @@
-from streamlit import secrets
+import functools
+import os
 
-# OpenWeather API
-OPENWEATHER_API_KEY = secrets['om_api_key']
+# Secrets (API keys) are resolved lazily, on first use, from:
+# 1. environment variables SOLARPANELS_<NAME> (e.g. SOLARPANELS_OM_API_KEY)
+# 2. the TOML file in SOLARPANELS_CONFIG, or the first of CONFIG_FILES that exists
+# 3. Streamlit secrets (imported only at this point)
+SECRETS_ENV_PREFIX = 'SOLARPANELS_'
+CONFIG_FILE_ENV = 'SOLARPANELS_CONFIG'
+CONFIG_FILES = ['solarpanels.toml', '.streamlit/secrets.toml']
+
+_SECRET_NAMES = {
+    'OPENWEATHER_API_KEY': 'om_api_key',        # OpenWeather API
+    'SHELLY_API_KEY': 'shelly_api_key',         # Shelly API
+    'SHELLY_DEVICE_ID': 'shelly_device_id'
+}
+
+class MissingSecretError(KeyError):
+    pass
+
+@functools.lru_cache(maxsize=None)
+def _read_config_file():
+    import tomllib
+
+    paths = [os.environ[CONFIG_FILE_ENV]] if CONFIG_FILE_ENV in os.environ else CONFIG_FILES
+    for path in paths:
+        if os.path.exists(path):
+            with open(path, 'rb') as config_file:
+                return tomllib.load(config_file)
+    return {}
+
+@functools.lru_cache(maxsize=None)
+def get_secret(name):
+    env_name = SECRETS_ENV_PREFIX + name.upper()
+    if env_name in os.environ:
+        return os.environ[env_name]
+
+    config_file = _read_config_file()
+    if name in config_file:
+        return config_file[name]
+
+    try:
+        from streamlit import secrets
+        return secrets[name]
+    except (ImportError, KeyError, FileNotFoundError) as error:
+        raise MissingSecretError(f"Secret '{name}' not found: set {env_name}, add it to a TOML config file or to Streamlit secrets") from error
+
+def __getattr__(name):
+    # config.OPENWEATHER_API_KEY & co. restano disponibili, ma risolti solo quando servono
+    if name in _SECRET_NAMES:
+        return get_secret(_SECRET_NAMES[name])
+    raise AttributeError(f"module 'config' has no attribute '{name}'")
 
 # Shelly API
-SHELLY_API_KEY = secrets['shelly_api_key']
-SHELLY_DEVICE_ID = secrets['shelly_device_id']
+SHELLY_TIMEOUT = 5                      # seconds, per request
+SHELLY_RATE_LIMIT = 1.0                 # requests per second for the whole process (Shelly cloud limit)
+SHELLY_MAX_STALE = 60                   # seconds, last good reading served when rate limited or failing
+FETCH_MAX_WAIT = 0.5                    # seconds waiting for a request token before serving the last good value
+
+# Shelly telemetry collector
+TELEMETRY_COLLECTOR_ENABLED = True
+SHELLY_POLL_INTERVAL = 10               # seconds between samples
+SHELLY_MAX_BACKOFF = 300                # seconds, max wait after repeated failures
+TELEMETRY_STORE_PATH = '.cache/telemetry/shelly.npy'
+TELEMETRY_CAPACITY = 7*24*360           # samples kept (one week at 10 s)
+
+# OpenWeather client
+OPENWEATHER_TIMEOUT = 5                 # seconds, per request
+OPENWEATHER_CURRENT_TTL = 10*60         # seconds, current weather validity
+OPENWEATHER_FORECAST_CADENCE = 3*3600   # seconds, forecast is issued every 3 hours
+OPENWEATHER_MAX_STALE = 6*3600          # seconds, max age of an expired entry served while revalidating
+WEATHER_CACHE_COORD_DECIMALS = 2        # lat/lon rounding for cache keys (~1 km)
+WEATHER_CACHE_DIR = None                # e.g. '.cache/weather' to keep responses across restarts
+OPENWEATHER_RATE_LIMIT = 1.0            # requests per second for the whole process (free plan: 60/min)
+OPENWEATHER_BURST = 4
+WEATHER_ARCHIVE_PATH = '.cache/weather/archive.sqlite'   # every fetched observation/forecast, serves past days (None = off)
 
 # Timezone
 ITALY_TIMEZONE = 'Europe/Rome' # 'Europe/Rome' gestisce il cambio fuso orario diversamente da 'CET'
@@ -27,3 +95,63 @@ STANDARD_PANEL_EFFICIENCY = 21.2*85/100 # total plant efficiency = Panel ef. * p
 
 # Frequency for daily time serie
 STANDARD_STEP = '1min'
+
+# Solar position algorithm: 'nrel_numpy' (SPA), 'nrel_numba' (SPA compiled, requires numba), 'ephemeris' (lighter)
+# pvlib switches SPA between numba and NumPy for the whole process: use one of the two nrel_* modes per process
+# python solar_position_report.py compares their accuracy and speed
+SOLAR_POSITION_METHOD = 'nrel_numpy'
+
+# Daylight-only evaluation: the irradiance chain runs only on the samples between sunrise and sunset
+DAYLIGHT_ONLY = True
+DAYLIGHT_COARSE_STEP = '10min'          # resolution of the coarse pass that finds the daylight windows
+
+# Horizon profile from a local elevation raster (see horizon_dem)
+DEM_FILE = None                         # e.g. 'dati/dtm.flt' (ESRI float grid), default of the sidebar DEM field
+DEM_HORIZON_AZIMUTHS = 360              # directions of the profile
+DEM_MAX_DISTANCE = 20000                # m, length of the rays
+DEM_OBSERVER_HEIGHT = 2.0               # m, panels above the raster surface at the site
+DEM_HORIZON_CACHE_DIR = '.cache/horizon'
+
+# Multi-day forecast
+FORECAST_STEP = '15min'
+FORECAST_DAYS = 4
+
+# Multi-site batch computation
+FLEET_STEP = '15min'
+FLEET_PROCESS_WORKERS = 0               # 0 = location groups computed in the current process
+
+# 12 months simulation
+ANNUAL_STEP = '1min'
+MONTHLY_DASHBOARD_STEP = '15min'        # monthly totals in the dashboard: coarse step, computed on every panel change
+ANNUAL_SOLAR_POSITION_METHOD = 'nrel_numpy'   # also used by the orientation optimizer and the multi-site batch
+ANNUAL_PROCESS_WORKERS = 0              # 0 = months computed in the current process
+STANDARD_MONTHLY_CLOUD_COVER = "55, 52, 52, 55, 52, 42, 30, 33, 40, 52, 60, 57" # % medio mensile (Gen-Dic), climatologia approssimata Milano
+
+# Streaming energy integration (long ranges in chunks, see energy_stream)
+STREAM_STEP = '1s'
+STREAM_CHUNK_SIZE = 86400               # samples per chunk (one day at 1 s)
+
+# Orientation optimizer
+OPTIMIZER_STEP = '1h'
+OPTIMIZER_TILT_STEP = 1                 # degrees
+OPTIMIZER_AZIMUTH_STEP = 1              # degrees
+
+# Appliance load shifting (see load_scheduler)
+STANDARD_APPLIANCES = "Lavatrice, 120, 2000, 08:00, 20:00; Lavastoviglie, 150, 1800, 09:00, 23:00; Asciugatrice, 90, 2500, 10:00, 18:00"   # nome, durata (min), potenza (W), dalle, alle
+SCHEDULER_STEP = '1min'
+SCHEDULER_DEFAULT_HOUSE_LOAD = 300      # W, used when the Shelly data is not available
+
+# JSON API server (see api_server)
+API_HOST = '127.0.0.1'
+API_PORT = 8502
+API_CACHE_SIZE = 256                    # cached responses (query x time bucket)
+API_POWER_BUCKET = 60                   # seconds, /power responses are recomputed once per bucket
+API_WEATHER_BUCKET = OPENWEATHER_CURRENT_TTL   # seconds, /daily, /energy and /forecast
+
+# Performance tracing
+PERF_PANEL_ENABLED = False              # default of the sidebar "Performance" panel checkbox
+PERF_PROMETHEUS_FILE = None             # e.g. '.cache/solarpanels.prom' for the node_exporter textfile collector
+
+# Charts
+CHART_MAX_POINTS = 1000                 # point budget per series, the data in the visible window is downsampled to it
+CHART_DOWNSAMPLING = 'lttb'             # 'lttb' (shape preserving) or 'minmax' (keeps peaks of each bucket)
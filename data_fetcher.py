@@ -0,0 +1,87 @@
+from concurrent.futures import ThreadPoolExecutor, Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+import contextvars
+import logging
+import time
+
+import requests
+
+from weather_checker import openweather_client, build_weather_data, get_weather_history
+from home_power_usage_checker import get_actual_home_power, get_latest_home_power
+from perf_trace import trace_stage, traced
+
+from config import OPENWEATHER_TIMEOUT, SHELLY_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+# Pool condiviso tra i rerun: le richieste di rete rilasciano il GIL
+fetch_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='fetch')
+
+#### --- Start all network requests concurrently ---
+
+def _submit_traced(stage, function, *args):
+    # Ogni richiesta gira in una copia del contesto, così le sue fasi finiscono nella traccia del rerun;
+    # client e coordinatori registrano hit/miss sulla fase della chiamata (annotate_stage)
+    return fetch_executor.submit(contextvars.copy_context().run, traced, stage, function, *args)
+
+def start_external_data_fetch(selected_location, openweather_api_key=None, telemetry_store=None):
+    """
+    Submits the current weather, forecast and Shelly requests to the fetch pool.
+    The caller can run local computations (e.g. solar geometry) while they are in flight.
+    With a telemetry_store holding a recent sample, the Shelly request is not made.
+
+    Returns: Dictionary of futures with keys 'actual_weather', 'forecast', 'home_power'
+    """
+
+    lat, lon = selected_location.latitude, selected_location.longitude
+
+    latest_home_power = get_latest_home_power(telemetry_store)
+    if latest_home_power is None:
+        home_power = _submit_traced('shelly_fetch', get_actual_home_power)
+    else:
+        with trace_stage('shelly_fetch', source='telemetry', cache_hits=1):
+            home_power = Future()
+            home_power.set_result(latest_home_power)
+
+    return {
+        'actual_weather': _submit_traced('weather_fetch', openweather_client.get_current_weather, lat, lon, openweather_api_key),
+        'forecast': _submit_traced('forecast_fetch', openweather_client.get_forecast, lat, lon, openweather_api_key),
+        'home_power': home_power,
+        'started_at': time.monotonic()
+    }
+
+#### --- Collect results, degrading gracefully on failure ---
+
+def _result_or_default(pending_fetch, name, timeout, default):
+    # Il timeout è contato dall'avvio della richiesta, non dalla chiamata a collect
+    remaining = max(0.0, pending_fetch['started_at'] + timeout - time.monotonic())
+    try:
+        return pending_fetch[name].result(timeout=remaining)
+    except FutureTimeoutError:
+        logger.warning("Fetch '%s' timed out after %s s", name, timeout)
+    except (requests.RequestException, ValueError, KeyError, IndexError, TypeError) as error:
+        logger.warning("Fetch '%s' failed: %s", name, type(error).__name__)
+    return default
+
+def collect_external_data(pending_fetch, times, selected_location, freq="1min",
+                          weather_timeout=OPENWEATHER_TIMEOUT, shelly_timeout=SHELLY_TIMEOUT):
+    """
+    Waits for the requests started by start_external_data_fetch, each within its own timeout.
+    A failed or late weather response is left out of the weather data, a failed Shelly request
+    returns (False, None) as get_actual_home_power does when the device is not reachable.
+    The times before now are filled from the weather archive.
+
+    Returns: (weather_data, (home_pv_power, network_pv_power))
+    """
+
+    actual_response = _result_or_default(pending_fetch, 'actual_weather', weather_timeout, None)
+    forecast_response = _result_or_default(pending_fetch, 'forecast', weather_timeout, None)
+    home_power = _result_or_default(pending_fetch, 'home_power', shelly_timeout, (False, None))
+
+    # Gli orari già passati vengono dall'archivio meteo locale
+    history_points = get_weather_history(times, selected_location.latitude, selected_location.longitude,
+                                         std_timezone=selected_location.tz)
+    weather_data = build_weather_data(times, actual_response, forecast_response,
+                                      freq=freq, std_timezone=selected_location.tz, history_points=history_points)
+
+    return weather_data, home_power
@@ -0,0 +1,121 @@
+import pandas as pd
+import numpy as np
+
+from solar_calculation import SolarGeometryCache, calculate_power_output_for_scenarios, localize_timestamp
+
+from config import STREAM_STEP, STREAM_CHUNK_SIZE, ANNUAL_SOLAR_POSITION_METHOD
+
+#### --- Time index in chunks ---
+
+def iter_time_chunks(start, end, step, tz, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Generator of consecutive DatetimeIndex chunks covering [start, end) with frequency step,
+    the same timestamps as pd.date_range(start, end, freq=step, inclusive='left') without building it.
+
+    - start, end: dates or timestamps (naive ones are taken in tz)
+    - step: fixed frequency ('1s', '1min', '15min', ...)
+    - tz: timezone of the chunks
+    - chunk_size: samples per chunk
+    """
+
+    start_ns = localize_timestamp(start, tz).as_unit('ns').value
+    end_ns = localize_timestamp(end, tz).as_unit('ns').value
+    step_ns = pd.Timedelta(step).value
+    if step_ns <= 0:
+        raise ValueError(f"Invalid step: {step}")
+
+    chunk_ns = step_ns * chunk_size
+    for chunk_start in range(start_ns, end_ns, chunk_ns):
+        epochs = np.arange(chunk_start, min(chunk_start + chunk_ns, end_ns), step_ns, dtype=np.int64)
+        yield pd.DatetimeIndex(epochs.view('datetime64[ns]')).tz_localize('UTC').tz_convert(tz)
+
+#### --- On the fly energy accumulation ---
+
+class EnergyAccumulator:
+    """
+    Energy totals (and optional per-period totals) of power chunks, without keeping the power series.
+
+    - step: frequency of the power samples
+    - aggregate: None, 'D' (local day) or 'M' (local month)
+    """
+
+    def __init__(self, step, aggregate=None):
+        if aggregate not in (None, 'D', 'M'):
+            raise ValueError(f"Invalid aggregate: {aggregate}")
+        self.step_hours = pd.Timedelta(step).total_seconds() / 3600
+        self.aggregate = aggregate
+        self.samples = 0
+        self._totals = None
+        self._periods = []
+
+    def add(self, power):
+        """power: DataFrame (times x scenarios) or Series in W"""
+
+        if isinstance(power, pd.Series):
+            power = power.to_frame()
+        energy = power * (self.step_hours / 1000)  # kWh per campione
+
+        totals = energy.sum()
+        self._totals = totals if self._totals is None else self._totals + totals
+        self.samples += len(power)
+
+        if self.aggregate:
+            # Periodo sull'ora locale; un giorno a cavallo di due chunk viene riunito in aggregates()
+            periods = power.index.tz_localize(None).to_period(self.aggregate)
+            self._periods.append(energy.groupby(periods).sum())
+
+    def totals(self):
+        """Energy (kWh) of each scenario"""
+        return pd.Series(dtype=float) if self._totals is None else self._totals.copy()
+
+    def aggregates(self):
+        """Energy (kWh) of each scenario per period, None without aggregate"""
+
+        if not self.aggregate:
+            return None
+        if not self._periods:
+            return pd.DataFrame()
+
+        # Compatta i risultati parziali, così la memoria cresce solo con il numero di periodi
+        self._periods = [pd.concat(self._periods).groupby(level=0).sum()]
+        return self._periods[0].copy()
+
+#### --- Streaming integration over long ranges ---
+
+def _scenarios_for_chunk(cloud_cover_scenarios, times):
+    if callable(cloud_cover_scenarios):
+        return cloud_cover_scenarios(times)
+    return pd.DataFrame(dict(cloud_cover_scenarios), index=times)
+
+def integrate_energy(start, end, location, panel, shadow_profile, cloud_cover_scenarios=None,
+                     step=STREAM_STEP, aggregate=None, chunk_size=STREAM_CHUNK_SIZE,
+                     solar_position_method=ANNUAL_SOLAR_POSITION_METHOD):
+    """
+    Energy over [start, end) walking the range in chunks through the power pipeline:
+    memory depends on chunk_size, not on the length of the range or on step.
+
+    - start, end: dates or timestamps (naive ones are taken in the location timezone)
+    - location, panel, shadow_profile: as for calculate_plant_power_output
+    - cloud_cover_scenarios: dictionary scenario -> constant cloud cover (%), or function(times) returning
+      the cloud cover DataFrame (times x scenarios) of a chunk. Default {'clearsky': 0}
+    - step: frequency of the power samples
+    - aggregate: None, 'D' or 'M' for the energy per local day or month
+    - chunk_size: samples per chunk
+    - solar_position_method: one of solar_calculation.SOLAR_POSITION_METHODS
+
+    Returns: (Series with the energy of each scenario in kWh, DataFrame per period or None)
+    """
+
+    cloud_cover_scenarios = {'clearsky': 0.0} if cloud_cover_scenarios is None else cloud_cover_scenarios
+    accumulator = EnergyAccumulator(step, aggregate=aggregate)
+
+    # Cache locale: i chunk non si ripetono e non devono svuotare la cache del dashboard
+    geometry_cache = SolarGeometryCache(maxsize=3, method=solar_position_method)
+
+    for times in iter_time_chunks(start, end, step, location.tz, chunk_size=chunk_size):
+        power = calculate_power_output_for_scenarios(times, location, panel, shadow_profile,
+                                                     _scenarios_for_chunk(cloud_cover_scenarios, times),
+                                                     geometry_cache=geometry_cache)
+        accumulator.add(power)
+
+    return accumulator.totals(), accumulator.aggregates()
@@ -0,0 +1,180 @@
+from concurrent.futures import Future
+import logging
+import threading
+import time
+
+import requests
+
+from perf_trace import annotate_stage
+
+logger = logging.getLogger(__name__)
+
+class RateLimitedError(requests.RequestException):
+    """No request token within the wait limit and no recent value to serve instead."""
+
+#### --- Token bucket ---
+
+class TokenBucket:
+    """
+    Process-wide rate limit: rate tokens per second, at most capacity accumulated.
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _take(self):
+        # Ritorna 0 se il token è preso, altrimenti i secondi da attendere per il prossimo
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self, timeout=None):
+        """Takes one token, waiting up to timeout seconds (None = no limit). Returns False on timeout."""
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self._take()
+            if wait == 0:
+                return True
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining < wait:
+                    return False
+            time.sleep(wait)
+
+#### --- Single-flight fetch coordinator ---
+
+class FetchCoordinator:
+    """
+    Process-wide coordinator of the requests to one provider, shared by all the Streamlit sessions.
+
+    - Identical requests (same key) in flight at the same time make one call: the waiters share its result or error.
+    - Calls take a token from the provider's TokenBucket.
+    - Under backpressure (no token within max_wait) or on a failed/invalid response, the last good value
+      of the key is served if younger than max_stale.
+
+    - name: provider name for the logs
+    - rate, burst: token bucket of the provider (requests per second, burst size)
+    - max_wait: seconds a call waits for a token when a last good value can be served instead
+    - timeout: seconds a call waits for a token when there is no value to serve
+    - max_stale: max age (s) of the last good value
+    - is_valid: function telling if a result is good (default: any result)
+    """
+
+    def __init__(self, name, rate, burst=1, max_wait=0.0, timeout=10.0, max_stale=60.0, is_valid=None):
+        self.name = name
+        self.bucket = TokenBucket(rate, burst)
+        self.max_wait = max_wait
+        self.timeout = timeout
+        self.max_stale = max_stale
+        self.is_valid = (lambda result: True) if is_valid is None else is_valid
+
+        self._in_flight = {}
+        self._last_good = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0
+        self.stale_served = 0
+        self.fetches = 0
+
+    # Contatori totali nel formato delle cache: hit = risposta senza chiamata al provider
+    @property
+    def hits(self):
+        return self.coalesced + self.stale_served
+
+    @property
+    def misses(self):
+        return self.fetches
+
+    def call(self, key, function, *args, allow_stale=True, **kwargs):
+        """
+        Result of function(*args, **kwargs) for key, coalesced with identical in-flight calls.
+        With allow_stale=False the last good value is never served (e.g. for a collector storing the samples):
+        such a caller still joins a flight in progress, but makes its own call if the flight served a stale value.
+        """
+
+        while True:
+            with self._lock:
+                future = self._in_flight.get(key)
+                leader = future is None
+                if leader:
+                    future = self._in_flight[key] = Future()
+
+            if leader:
+                break
+
+            # Il volo è condiviso da chi accetta e chi rifiuta valori vecchi: ognuno decide sul risultato
+            try:
+                result, fresh = future.result()
+            except (requests.RequestException, ValueError):
+                # Il leader poteva non accettare l'ultimo valore buono, chi lo accetta lo usa al posto dell'errore
+                last_good = self._last_good_value(key) if allow_stale else None
+                if last_good is None:
+                    raise
+                return self._serve_stale(key, last_good, "shared call failed")[0]
+            if fresh or allow_stale:
+                # Hit/miss registrati sulla fase della chiamata (perf_trace), non come differenza dei contatori condivisi
+                with self._lock:
+                    self.coalesced += 1
+                annotate_stage(cache_hits=1)
+                return result
+
+        # Il volo è rimosso prima di pubblicare l'esito: chi lo rifiuta trova la chiave libera
+        try:
+            result, fresh = self._fetch(key, function, args, kwargs, allow_stale)
+        except BaseException as error:
+            with self._lock:
+                del self._in_flight[key]
+            future.set_exception(error)
+            raise
+        with self._lock:
+            del self._in_flight[key]
+        future.set_result((result, fresh))
+        return result
+
+    def _last_good_value(self, key):
+        with self._lock:
+            last_good = self._last_good.get(key)
+        if last_good is None or time.monotonic() - last_good[0] > self.max_stale:
+            return None
+        return last_good
+
+    def _serve_stale(self, key, last_good, reason):
+        with self._lock:
+            self.stale_served += 1
+        annotate_stage(cache_hits=1)
+        logger.info("%s %s: serving the value of %.0f s ago (%s)", self.name, key, time.monotonic() - last_good[0], reason)
+        return last_good[1], False
+
+    def _fetch(self, key, function, args, kwargs, allow_stale):
+        # Ritorna (risultato, fresh): fresh è False se è servito l'ultimo valore buono
+        last_good = self._last_good_value(key) if allow_stale else None
+        if not self.bucket.acquire(self.max_wait if last_good is not None else self.timeout):
+            if last_good is not None:
+                return self._serve_stale(key, last_good, "rate limited")
+            raise RateLimitedError(f"{self.name}: no request token within {self.timeout} s")
+
+        with self._lock:
+            self.fetches += 1
+        annotate_stage(cache_misses=1)
+        try:
+            result = function(*args, **kwargs)
+        except (requests.RequestException, ValueError) as error:
+            if last_good is not None:
+                return self._serve_stale(key, last_good, type(error).__name__)
+            raise
+
+        if not self.is_valid(result):
+            return (result, True) if last_good is None else self._serve_stale(key, last_good, "invalid response")
+
+        with self._lock:
+            self._last_good[key] = (time.monotonic(), result)
+        return result, True
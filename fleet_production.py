@@ -0,0 +1,175 @@
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import pandas as pd
+import numpy as np
+
+from pvlib.location import Location
+
+from solar_calculation import SolarGeometryCache, calculate_plant_power_output, get_plant_arrays, localize_timestamp
+
+from config import FLEET_STEP, FLEET_PROCESS_WORKERS, ANNUAL_SOLAR_POSITION_METHOD
+
+SITE_COLUMNS = ['site_id', 'latitude', 'longitude', 'altitude', 'tz']
+PANEL_COLUMNS = ['tilt', 'azimuth', 'area', 'efficiency']
+
+# Orizzonte piatto per i siti senza profilo d'ombra
+FLAT_HORIZON = pd.DataFrame({"Azimuth": [0.0, 360.0], "Elevation": [0.0, 0.0]})
+
+#### --- Sites table ---
+
+def _site_panels(site):
+    # 'panels' (lista di falde) ha la precedenza sulle colonne della falda singola
+    panels = site.get('panels')
+    if isinstance(panels, (list, dict)):
+        return get_plant_arrays(panels)
+    return get_plant_arrays({column: float(site[column]) for column in PANEL_COLUMNS})
+
+def _site_shadow_profile(site):
+    shadow_profile = site.get('shadow_profile')
+    return shadow_profile if isinstance(shadow_profile, pd.DataFrame) else FLAT_HORIZON
+
+def _site_cloud_cover(site):
+    cloud_cover = site.get('cloud_cover')
+    return None if cloud_cover is None or pd.isna(cloud_cover) else float(cloud_cover)
+
+#### --- Sites sharing one timezone (runs in the worker processes) ---
+
+def _location_group_power(location_key, sites, times, solar_position_method):
+    """
+    Clearsky and weather power (W) of the sites at one location, as arrays (times x sites):
+    solar position, clear sky and transposition are computed once for all their arrays,
+    each distinct cloud cover level is a scenario column.
+    """
+
+    latitude, longitude, altitude, tz = location_key
+    location = Location(latitude, longitude, altitude=altitude, tz=tz)
+
+    panels = []
+    site_of_array = []
+    for site_index, site in enumerate(sites):
+        shadow_profile = _site_shadow_profile(site)
+        for panel in _site_panels(site):
+            panels.append(dict(panel, name=f"{len(panels)}", shadow_profile=panel.get('shadow_profile', shadow_profile)))
+            site_of_array.append(site_index)
+    array_names = [panel['name'] for panel in panels]
+
+    # Scenari per valore esatto di copertura: nomi per posizione, non per formattazione del valore
+    site_cloud_covers = [_site_cloud_cover(site) for site in sites]
+    scenario_names = {cloud_cover: f'cloud_{index}' for index, cloud_cover in
+                      enumerate(sorted({cloud_cover for cloud_cover in site_cloud_covers if cloud_cover is not None}))}
+    cloud_cover_scenarios = pd.DataFrame({'clearsky': 0.0, **{name: cloud_cover for cloud_cover, name in scenario_names.items()}},
+                                         index=times)
+
+    power = calculate_plant_power_output(times, location, panels, None, cloud_cover_scenarios,
+                                         geometry_cache=SolarGeometryCache(maxsize=3, method=solar_position_method))
+
+    # Somma delle falde di ogni sito con un prodotto per la matrice falde x siti (NaN come 0, come sum)
+    membership = np.zeros((len(panels), len(sites)))
+    membership[np.arange(len(panels)), site_of_array] = 1.0
+
+    def sites_power(scenario):
+        return np.nan_to_num(power[scenario][array_names].to_numpy(dtype=float)) @ membership
+
+    clearsky = sites_power('clearsky')
+    weather = np.full_like(clearsky, np.nan)
+    for cloud_cover, name in scenario_names.items():
+        columns = [index for index, site_cloud_cover in enumerate(site_cloud_covers) if site_cloud_cover == cloud_cover]
+        weather[:, columns] = sites_power(name)[:, columns]
+    return clearsky, weather
+
+def _timezone_batch_production(tz, location_groups, start, end, step, solar_position_method):
+    """
+    Power of the location groups of one timezone in long format. The time index (and its UTC
+    and local date views) is built once for the batch and shared by all its sites.
+    """
+
+    times = pd.date_range(start=localize_timestamp(start, tz), end=localize_timestamp(end, tz), freq=step, inclusive='left')
+
+    site_ids = []
+    clearsky, weather = [], []
+    for location_key, sites in location_groups:
+        group_clearsky, group_weather = _location_group_power(location_key, sites, times, solar_position_method)
+        site_ids += [site['site_id'] for site in sites]
+        clearsky.append(group_clearsky)
+        weather.append(group_weather)
+
+    # Formato lungo: un blocco di righe per sito, gli orari ripetuti per posizione
+    time_positions = np.tile(np.arange(len(times)), len(site_ids))
+    return pd.DataFrame({
+        'site_id': np.repeat(np.array(site_ids, dtype=object), len(times)),
+        'datetime': times.tz_convert('UTC')[time_positions],
+        'date': np.asarray(times.date)[time_positions],
+        'clearsky_power': np.hstack(clearsky).T.ravel(),
+        'weather_power': np.hstack(weather).T.ravel()
+    })
+
+#### --- Batch API ---
+
+def calculate_sites_production(sites, start, end, step=FLEET_STEP, max_workers=FLEET_PROCESS_WORKERS,
+                               solar_position_method=ANNUAL_SOLAR_POSITION_METHOD):
+    """
+    Power of many sites over the same time range, in long format.
+
+    Sites at the same location (latitude, longitude, altitude, tz) are computed in one pass sharing
+    solar position, clear sky and transposition. The time range is taken in the timezone of each site:
+    the time index is built once per timezone batch and shared by its sites; the batches are distributed
+    over a process pool. Rows are grouped by site, sites ordered by timezone and location.
+
+    - sites: DataFrame with 'site_id', 'latitude', 'longitude', 'altitude', 'tz' and either
+      'tilt', 'azimuth', 'area', 'efficiency' (single plane, efficiency as fraction) or 'panels' (list of arrays).
+      Optional 'shadow_profile' (DataFrame Azimuth/Elevation, default flat horizon) and
+      'cloud_cover' (%, constant over the range, used for 'weather_power')
+    - start, end: time range (end excluded), dates or timestamps
+    - step: frequency of the time index
+    - max_workers: number of processes (0 = computed in the current process)
+    - solar_position_method: one of solar_calculation.SOLAR_POSITION_METHODS
+
+    Returns: DataFrame with columns 'site_id', 'datetime' (UTC), 'date' (local date of the site),
+             'clearsky_power', 'weather_power' (W)
+    """
+
+    missing_columns = [column for column in SITE_COLUMNS if column not in sites.columns]
+    if 'panels' not in sites.columns:
+        missing_columns += [column for column in PANEL_COLUMNS if column not in sites.columns]
+    if missing_columns:
+        raise ValueError(f"Missing site columns: {', '.join(missing_columns)}")
+
+    # Siti raggruppati per fuso orario, poi per posizione
+    timezones = {}
+    for site in sites.to_dict('records'):
+        location_key = (float(site['latitude']), float(site['longitude']), float(site['altitude']), str(site['tz']))
+        timezones.setdefault(location_key[3], {}).setdefault(location_key, []).append(site)
+
+    # Un lotto per fuso orario; con il pool ogni fuso è diviso in lotti per distribuire il lavoro
+    batches = []
+    for tz, groups in timezones.items():
+        groups = list(groups.items())
+        batch_count = min(len(groups), 4 * max_workers) if max_workers else 1
+        batches += [(tz, groups[index::batch_count]) for index in range(batch_count)]
+
+    arguments = ([tz for tz, _ in batches], [groups for _, groups in batches],
+                 repeat(start), repeat(end), repeat(step), repeat(solar_position_method))
+    if max_workers:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(_timezone_batch_production, *arguments))
+    else:
+        results = list(map(_timezone_batch_production, *arguments))
+
+    if not results:
+        return pd.DataFrame(columns=['site_id', 'datetime', 'date', 'clearsky_power', 'weather_power'])
+    return pd.concat(results, ignore_index=True)
+
+def calculate_sites_daily_energy(sites_production, step=FLEET_STEP):
+    """
+    Daily energy (kWh) of each site from the output of calculate_sites_production.
+
+    Returns: DataFrame with columns 'site_id', 'data', 'clearsky_energy', 'weather_energy'
+    """
+
+    step_hours = pd.Timedelta(step).total_seconds() / 3600
+    daily_energy = (sites_production.groupby(['site_id', 'date'], sort=False)[['clearsky_power', 'weather_power']]
+                    .sum(min_count=1) * step_hours / 1000)
+    daily_energy.index.names = ['site_id', 'data']
+    daily_energy.columns = ['clearsky_energy', 'weather_energy']
+    return daily_energy.round(2).reset_index()
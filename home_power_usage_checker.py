@@ -1,19 +1,57 @@
-from config import SHELLY_API_KEY, SHELLY_DEVICE_ID
+import config
+from config import SHELLY_TIMEOUT
+from config import SHELLY_POLL_INTERVAL, SHELLY_MAX_BACKOFF, TELEMETRY_STORE_PATH, TELEMETRY_CAPACITY
+from config import SHELLY_RATE_LIMIT, SHELLY_MAX_STALE, FETCH_MAX_WAIT
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import fcntl
+except ImportError:  # Windows: nessun lock tra processi, ogni processo ha il suo collector
+    fcntl = None
+
+from perf_trace import annotate_stage
+from fetch_coordinator import FetchCoordinator
+
+logger = logging.getLogger(__name__)
+
+# Sessione condivisa: riusa la connessione TLS tra una richiesta e l'altra
+shelly_session = requests.Session()
+shelly_session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=4))
+
+# Unico per processo: sessioni, collector e API condividono le letture entro il limite del cloud Shelly
+shelly_coordinator = FetchCoordinator('Shelly', SHELLY_RATE_LIMIT, max_wait=FETCH_MAX_WAIT, timeout=SHELLY_TIMEOUT,
+                                      max_stale=SHELLY_MAX_STALE, is_valid=lambda home_power: home_power[0] is not False)
 
 #### --- Retrive shelly device actual power for PV panels and network---
 
-def get_actual_home_power():
+def get_actual_home_power(allow_stale=True):
+    """
+    (pv_power, network_power) from the Shelly cloud, (False, status code) on failure.
+    Concurrent calls share one request; when rate limited or failing, the last good reading
+    (younger than SHELLY_MAX_STALE) is returned unless allow_stale is False.
+    """
+    return shelly_coordinator.call('device_status', _fetch_home_power, allow_stale=allow_stale)
+
+def _fetch_home_power():
     
     # Replace with your actual auth_key and device_id
-    auth_key = SHELLY_API_KEY
-    device_id = SHELLY_DEVICE_ID
+    auth_key = config.SHELLY_API_KEY
+    device_id = config.SHELLY_DEVICE_ID
 
     # Construct the API URL
     api_url = f'https://shelly-50-eu.shelly.cloud/device/status?auth_key={auth_key}&id={device_id}'
 
     # Make the GET request
-    response = requests.get(api_url)
+    response = shelly_session.get(api_url, timeout=SHELLY_TIMEOUT)
+    annotate_stage(payload_bytes=len(response.content))
 
     # Check if the request was successful
     if response.status_code == 200:
@@ -29,4 +67,162 @@ def get_actual_home_power():
         
     else:
         # print(f'Failed to retrieve data: {response.status_code}')
-        return False, response.status_code  ## if data is not retrived, power_output_f = False
\ No newline at end of file
+        return False, response.status_code  ## if data is not retrived, power_output_f = False
+
+#### --- On-disk ring buffer of telemetry samples ---
+
+TELEMETRY_DTYPE = np.dtype([('timestamp', 'f8'), ('pv_power', 'f4'), ('network_power', 'f4')])
+
+class TelemetryStore:
+    """
+    Fixed-size ring buffer of (timestamp, pv_power, network_power) samples in a memory-mapped .npy file.
+    The newest samples overwrite the oldest ones; empty slots have timestamp 0.
+
+    - read_only: view of a store written by another process (see start_telemetry_collector):
+                 the write position is read again from the file at every read
+    """
+
+    def __init__(self, path=TELEMETRY_STORE_PATH, capacity=TELEMETRY_CAPACITY, read_only=False):
+        self.path = path
+        self.read_only = read_only
+        self._lock = threading.Lock()
+
+        if read_only:
+            self._samples = np.lib.format.open_memmap(path, mode='r')
+        elif os.path.exists(path):
+            self._samples = np.lib.format.open_memmap(path, mode='r+')
+        else:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            self._samples = np.lib.format.open_memmap(path, mode='w+', dtype=TELEMETRY_DTYPE, shape=(capacity,))
+
+        self.capacity = len(self._samples)
+        self._load_position()
+
+    def _load_position(self):
+        # Posizione di scrittura: dopo il campione più recente
+        timestamps = self._samples['timestamp']
+        self._count = int(np.count_nonzero(timestamps))
+        self._position = (int(np.argmax(timestamps)) + 1) % self.capacity if self._count else 0
+
+    def append(self, timestamp, pv_power, network_power):
+        with self._lock:
+            self._samples[self._position] = (timestamp, pv_power, network_power)
+            self._position = (self._position + 1) % self.capacity
+            self._count = min(self._count + 1, self.capacity)
+
+    def flush(self):
+        with self._lock:
+            self._samples.flush()
+
+    def latest(self):
+        """Returns the newest sample as a dictionary, None if the store is empty."""
+        with self._lock:
+            if self.read_only:
+                self._load_position()
+            if not self._count:
+                return None
+            sample = self._samples[(self._position - 1) % self.capacity]
+        return {'timestamp': float(sample['timestamp']),
+                'pv_power': float(sample['pv_power']),
+                'network_power': float(sample['network_power'])}
+
+    def history(self, since=None, tz=None):
+        """
+        Returns the samples newer than since (epoch seconds) as a DataFrame with
+        'pv_power' and 'network_power' columns, indexed by datetime (in tz if given).
+        """
+        with self._lock:
+            if self.read_only:
+                self._load_position()
+            samples = np.roll(self._samples, -self._position)
+        samples = samples[samples['timestamp'] > (0 if since is None else since)]
+
+        index = pd.to_datetime(samples['timestamp'], unit='s', utc=True)
+        if tz is not None:
+            index = index.tz_convert(tz)
+        return pd.DataFrame({'pv_power': samples['pv_power'], 'network_power': samples['network_power']},
+                            index=pd.DatetimeIndex(index, name='datetime'))
+
+#### --- Background collector ---
+
+class ShellyTelemetryCollector(threading.Thread):
+    """
+    Polls get_actual_home_power every poll_interval seconds and appends the samples to the store.
+    After a failure the wait doubles, up to max_backoff, and goes back to poll_interval on the next success.
+    """
+
+    def __init__(self, store, poll_interval=SHELLY_POLL_INTERVAL, max_backoff=SHELLY_MAX_BACKOFF):
+        super().__init__(name='shelly-collector', daemon=True)
+        self.store = store
+        self.poll_interval = poll_interval
+        self.max_backoff = max_backoff
+        self._stop_event = threading.Event()
+
+    def run(self):
+        delay = self.poll_interval
+        while not self._stop_event.is_set():
+            try:
+                # Solo letture nuove: un valore ripetuto finirebbe nello storico come nuovo campione
+                pv_power, network_power = get_actual_home_power(allow_stale=False)
+                if pv_power is False:
+                    raise ValueError(f"Shelly status {network_power}")
+                self.store.append(time.time(), pv_power, network_power)
+                delay = self.poll_interval
+            except (requests.RequestException, ValueError, TypeError, KeyError, IndexError) as error:
+                delay = min(delay * 2, self.max_backoff)
+                logger.warning("Shelly poll failed (%s), next attempt in %s s", type(error).__name__, delay)
+            self._stop_event.wait(delay)
+        self.store.flush()
+
+    def stop(self):
+        self._stop_event.set()
+
+_collector = None
+_collector_lock = threading.Lock()
+_store_locks = {}
+_read_only_stores = {}
+
+def _acquire_store_lock(path):
+    # Un solo processo scrive il ring buffer: lock esclusivo sul file .lock, rilasciato dal sistema all'uscita
+    if fcntl is None or path in _store_locks:
+        return True
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    lock_file = open(path + '.lock', 'a')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return False
+    _store_locks[path] = lock_file
+    return True
+
+def start_telemetry_collector(path=TELEMETRY_STORE_PATH, poll_interval=SHELLY_POLL_INTERVAL):
+    """
+    Starts the collector once (Streamlit reruns call it every time) and returns its store.
+    The collector is exclusive across processes (lock file next to the store): when another process
+    (e.g. the dashboard and the API server) already collects into path, a read-only view of its store
+    is returned, None if the store does not exist yet. The lock is tried again at every call.
+    """
+    global _collector
+    with _collector_lock:
+        if _collector is not None and _collector.is_alive():
+            return _collector.store
+
+        if not _acquire_store_lock(path):
+            if path not in _read_only_stores and os.path.exists(path):
+                _read_only_stores[path] = TelemetryStore(path, read_only=True)
+            return _read_only_stores.get(path)
+
+        _collector = ShellyTelemetryCollector(TelemetryStore(path), poll_interval=poll_interval)
+        _collector.start()
+        return _collector.store
+
+def get_latest_home_power(store, max_age=2 * SHELLY_POLL_INTERVAL):
+    """
+    Latest (pv_power, network_power) from the store, as returned by get_actual_home_power.
+    Returns None when there is no sample younger than max_age seconds.
+    """
+    sample = store.latest() if store is not None else None
+    if sample is None or time.time() - sample['timestamp'] > max_age:
+        return None
+    return sample['pv_power'], sample['network_power']
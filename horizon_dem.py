@@ -0,0 +1,195 @@
+"""
+Horizon profile of a site from a local elevation raster (DEM, or DSM with building heights):
+
+    python horizon_dem.py --dem dtm.flt [--lat 45.5 --lon 9.19] [--height 2] [--output orizzonte.csv]
+
+The raster is an ESRI float grid (.flt with its .hdr, e.g. 'gdal_translate -of EHdr -ot Float32'),
+in geographic coordinates (degrees) or, with --projected, in a metric projection. The .flt is memory-mapped:
+only the cells crossed by the rays are read.
+"""
+import argparse
+import hashlib
+import os
+
+import pandas as pd
+import numpy as np
+
+from lru_cache import LRUCache
+
+from config import STANDARD_LOCATION_LATITUDE, STANDARD_LOCATION_LONGITUDE
+from config import DEM_HORIZON_AZIMUTHS, DEM_MAX_DISTANCE, DEM_OBSERVER_HEIGHT, DEM_HORIZON_CACHE_DIR
+
+EARTH_RADIUS = 6371000.0        # m
+REFRACTION_COEFFICIENT = 0.13   # rifrazione atmosferica standard
+METERS_PER_DEGREE = 111320.0
+RAY_STEP_GROWTH = 0.005         # oltre la zona vicina il passo cresce con la distanza (frazione della distanza)
+DEM_RASTER_CACHE_SIZE = 4
+DEM_HORIZON_CACHE_SIZE = 64
+
+#### --- Memory-mapped ESRI float grid ---
+
+class DemRaster:
+    """
+    ESRI float grid (.flt + .hdr) memory-mapped with numpy.
+
+    - path: .flt file (the header is the .hdr file with the same name)
+    - projected: False for a grid in degrees (lon/lat), True for a metric grid (site given in grid coordinates)
+    """
+
+    def __init__(self, path, projected=False):
+        self.path = path
+        self.projected = projected
+
+        header = {}
+        with open(os.path.splitext(path)[0] + '.hdr') as header_file:
+            for line in header_file:
+                parts = line.split()
+                if len(parts) >= 2:
+                    header[parts[0].lower()] = parts[1]
+
+        self.ncols = int(header['ncols'])
+        self.nrows = int(header['nrows'])
+        self.cellsize = float(header['cellsize'])
+        # Il riferimento può essere l'angolo o il centro della cella in basso a sinistra
+        self.xll = float(header['xllcorner']) if 'xllcorner' in header else float(header['xllcenter']) - self.cellsize / 2
+        self.yll = float(header['yllcorner']) if 'yllcorner' in header else float(header['yllcenter']) - self.cellsize / 2
+        self.nodata = float(header.get('nodata_value', header.get('nodata', -9999)))
+
+        byte_order = '>' if header.get('byteorder', 'lsbfirst').lower() == 'msbfirst' else '<'
+        self.data = np.memmap(path, dtype=np.dtype(byte_order + 'f4'), mode='r', shape=(self.nrows, self.ncols))
+
+    def sample(self, x, y):
+        """Elevation (m) at the grid coordinates x, y (nearest cell); NaN outside the grid or on nodata cells."""
+
+        # Riga 0 = bordo nord della griglia
+        rows = np.floor((self.yll + self.nrows * self.cellsize - y) / self.cellsize).astype(np.int64)
+        cols = np.floor((x - self.xll) / self.cellsize).astype(np.int64)
+        inside = (rows >= 0) & (rows < self.nrows) & (cols >= 0) & (cols < self.ncols)
+
+        elevation = np.full(np.shape(x), np.nan)
+        elevation[inside] = self.data[rows[inside], cols[inside]]
+        elevation[elevation == self.nodata] = np.nan
+        return elevation
+
+    def meters_per_unit(self, latitude):
+        """Size (m) of one grid unit along x and y at the given latitude."""
+        if self.projected:
+            return 1.0, 1.0
+        return METERS_PER_DEGREE * np.cos(np.radians(latitude)), METERS_PER_DEGREE
+
+_raster_cache = LRUCache(DEM_RASTER_CACHE_SIZE)
+_horizon_cache = LRUCache(DEM_HORIZON_CACHE_SIZE)
+
+def open_dem(path, projected=False):
+    """DemRaster for path, opened once per file version (the memory map is shared)."""
+    key = (os.path.abspath(path), os.path.getmtime(path), projected)
+    return _raster_cache.get_or_compute(key, lambda: DemRaster(path, projected=projected))
+
+#### --- Vectorized ray marching ---
+
+def _ray_distances(cell_size, min_distance, max_distance):
+    # Passo pari alla cella vicino al sito, poi crescente con la distanza (stessa risoluzione angolare)
+    near_limit = min(max_distance, cell_size / RAY_STEP_GROWTH)
+    near = np.arange(min_distance, near_limit, cell_size)
+    if near_limit >= max_distance:
+        return near
+    steps = int(np.ceil(np.log(max_distance / near_limit) / np.log1p(RAY_STEP_GROWTH)))
+    return np.concatenate([near, near_limit * (1 + RAY_STEP_GROWTH) ** np.arange(steps + 1)])
+
+def compute_horizon_profile(dem, latitude, longitude, observer_height=DEM_OBSERVER_HEIGHT,
+                            azimuths=DEM_HORIZON_AZIMUTHS, max_distance=DEM_MAX_DISTANCE, min_distance=None):
+    """
+    Horizon elevation seen from the site in every direction, marching all the rays at once over the raster.
+    Earth curvature and standard refraction are included.
+
+    - dem: DemRaster
+    - latitude, longitude: site (grid coordinates y, x for a projected raster)
+    - observer_height: height of the panels above the raster surface at the site (m)
+    - azimuths: number of directions (evenly spaced, 0° = North, clockwise)
+    - max_distance: length of the rays (m)
+    - min_distance: first sample along the rays (m), default two cells (skips the site's own roof)
+
+    Returns: DataFrame with columns ['Azimuth', 'Elevation'] (degrees), as read_horizon_file
+    """
+
+    meters_x, meters_y = dem.meters_per_unit(latitude)
+    cell_size = dem.cellsize * min(meters_x, meters_y)
+    min_distance = 2 * cell_size if min_distance is None else min_distance
+
+    site_elevation = dem.sample(np.array([longitude]), np.array([latitude]))[0]
+    if np.isnan(site_elevation):
+        raise ValueError(f"Site ({latitude}, {longitude}) is outside the elevation raster {dem.path}")
+    observer_elevation = site_elevation + observer_height
+
+    azimuth_values = np.arange(azimuths) * 360.0 / azimuths
+    distances = _ray_distances(cell_size, min_distance, max_distance)
+
+    # Punti dei raggi (azimut x distanza) in coordinate della griglia
+    east = np.sin(np.radians(azimuth_values))[:, None] * distances[None, :]
+    north = np.cos(np.radians(azimuth_values))[:, None] * distances[None, :]
+    elevation = dem.sample(longitude + east / meters_x, latitude + north / meters_y)
+
+    # Abbassamento apparente del terreno lontano per curvatura terrestre, ridotto dalla rifrazione
+    drop = distances ** 2 * (1 - REFRACTION_COEFFICIENT) / (2 * EARTH_RADIUS)
+    angles = np.degrees(np.arctan2(elevation - drop[None, :] - observer_elevation, distances[None, :]))
+
+    # Fuori dalla griglia il raggio non vede ostacoli
+    horizon = np.where(np.isnan(angles), -90.0, angles).max(axis=1)
+
+    return pd.DataFrame({"Azimuth": azimuth_values, "Elevation": np.round(horizon, 2)})
+
+#### --- Horizon profile per site, cached in memory and on disk ---
+
+def _horizon_cache_path(cache_dir, key):
+    return os.path.join(cache_dir, f"horizon_{hashlib.sha1(repr(key).encode()).hexdigest()[:16]}.csv")
+
+def get_dem_horizon_profile(dem_path, latitude, longitude, observer_height=DEM_OBSERVER_HEIGHT,
+                            azimuths=DEM_HORIZON_AZIMUTHS, max_distance=DEM_MAX_DISTANCE,
+                            projected=False, cache_dir=DEM_HORIZON_CACHE_DIR):
+    """
+    Horizon profile of a site from the raster at dem_path (see compute_horizon_profile), cached per site
+    and raster version; with cache_dir the profiles are also kept on disk as CSV (Azimuth, Elevation).
+    The result can be passed as shadow_profile to calculate_if_times_are_shadowed_with_shadow_profile.
+    """
+
+    key = (os.path.abspath(dem_path), os.path.getmtime(dem_path), projected,
+           round(latitude, 6), round(longitude, 6), observer_height, azimuths, max_distance)
+
+    def compute():
+        cache_path = _horizon_cache_path(cache_dir, key) if cache_dir else None
+        if cache_path and os.path.exists(cache_path):
+            return pd.read_csv(cache_path)
+
+        shadow_profile = compute_horizon_profile(open_dem(dem_path, projected=projected), latitude, longitude,
+                                                 observer_height=observer_height, azimuths=azimuths, max_distance=max_distance)
+        if cache_path:
+            os.makedirs(cache_dir, exist_ok=True)
+            shadow_profile.to_csv(cache_path + '.tmp', index=False)
+            os.replace(cache_path + '.tmp', cache_path)
+        return shadow_profile
+
+    return _horizon_cache.get_or_compute(key, compute)
+
+#### Main function to run from command line ############
+
+def main():
+    parser = argparse.ArgumentParser(description="Profilo d'orizzonte di un sito da un modello digitale del terreno locale")
+    parser.add_argument('--dem', required=True, help="griglia ESRI float (.flt con .hdr)")
+    parser.add_argument('--lat', type=float, default=STANDARD_LOCATION_LATITUDE)
+    parser.add_argument('--lon', type=float, default=STANDARD_LOCATION_LONGITUDE)
+    parser.add_argument('--height', type=float, default=DEM_OBSERVER_HEIGHT, help="altezza dei pannelli sul terreno (m)")
+    parser.add_argument('--azimuths', type=int, default=DEM_HORIZON_AZIMUTHS)
+    parser.add_argument('--max-distance', type=float, default=DEM_MAX_DISTANCE, help="m")
+    parser.add_argument('--projected', action='store_true', help="griglia metrica: --lat/--lon sono y/x della griglia")
+    parser.add_argument('--output', help="file CSV del profilo (default: stampa)")
+    args = parser.parse_args()
+
+    shadow_profile = get_dem_horizon_profile(args.dem, args.lat, args.lon, observer_height=args.height,
+                                             azimuths=args.azimuths, max_distance=args.max_distance, projected=args.projected)
+    if args.output:
+        shadow_profile.to_csv(args.output, index=False)
+    else:
+        print(shadow_profile.to_string(index=False))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+import datetime
+
+import pandas as pd
+import numpy as np
+
+from config import STANDARD_APPLIANCES, SCHEDULER_STEP, SCHEDULER_DEFAULT_HOUSE_LOAD
+
+APPLIANCE_COLUMNS = ['name', 'duration', 'power', 'window_start', 'window_end']
+
+#### --- Appliance profiles ---
+
+def parse_appliances(appliances=STANDARD_APPLIANCES):
+    """
+    Appliance profiles from 'name, duration (min), power (W), from HH:MM, to HH:MM' entries separated by ';'.
+
+    Returns: DataFrame with columns 'name', 'duration', 'power', 'window_start', 'window_end' (datetime.time)
+    """
+
+    rows = []
+    for entry in filter(None, (entry.strip() for entry in appliances.split(';'))):
+        name, duration, power, window_start, window_end = (value.strip() for value in entry.split(','))
+        rows.append({'name': name, 'duration': int(duration), 'power': float(power),
+                     'window_start': datetime.time.fromisoformat(window_start),
+                     'window_end': datetime.time.fromisoformat(window_end)})
+    return pd.DataFrame(rows, columns=APPLIANCE_COLUMNS)
+
+def get_house_load(home_pv_power, network_power, default=SCHEDULER_DEFAULT_HOUSE_LOAD):
+    """Current house load (W) from get_actual_home_power, default when the Shelly data is not available."""
+    if home_pv_power is False or home_pv_power is None or network_power is None:
+        return default
+    return float(network_power if home_pv_power < 0 else home_pv_power + network_power)
+
+#### --- Sliding window scheduler ---
+
+def _minutes_of_day(time_of_day):
+    return time_of_day.hour * 60 + time_of_day.minute
+
+def schedule_appliances(pv_power, house_load, appliances, now=None, step=SCHEDULER_STEP):
+    """
+    Start times of the deferrable appliances that maximize the self-consumed PV energy.
+
+    The PV power is resampled on step; the surplus over the house load is shared greedily, larger
+    appliances first. For each appliance the self-consumed energy of every possible start is a
+    difference of cumulative sums of min(surplus, power), and the allowed starts (whole run inside the
+    daily window and after now) come from a cumulative count of the forbidden samples: no loop over the starts.
+
+    - pv_power: Series of predicted PV power (W) with a DatetimeIndex (e.g. the forecast weather curve)
+    - house_load: house load (W) kept constant over the horizon (see get_house_load)
+    - appliances: DataFrame as parse_appliances (window_end before window_start = across midnight)
+    - now: first allowed start (default: now in the timezone of pv_power)
+    - step: resolution of the schedule
+
+    Returns: DataFrame with 'name', 'start', 'end', 'energy' and 'self_consumed_energy' (kWh), 'self_consumption' (%),
+             in the order of appliances; start is NaT when no allowed start exists in the horizon
+    """
+
+    pv_power = pv_power.dropna()
+    columns = ['name', 'start', 'end', 'energy', 'self_consumed_energy', 'self_consumption']
+    if pv_power.empty or appliances.empty:
+        return pd.DataFrame(columns=columns)
+
+    now = pd.Timestamp.now(tz=pv_power.index.tz) if now is None else pd.Timestamp(now)
+    step_minutes = pd.Timedelta(step).total_seconds() / 60
+
+    # Serie a passo fisso (la curva di previsione è a 15 minuti)
+    times = pd.date_range(start=pv_power.index[0], end=pv_power.index[-1], freq=step)
+    surplus = np.maximum(np.interp(times.as_unit('ns').asi8, pv_power.index.as_unit('ns').asi8, pv_power.to_numpy(dtype=float))
+                         - house_load, 0.0)
+
+    local_times = times.tz_localize(None) if times.tz is not None else times
+    minute_of_day = local_times.hour.to_numpy() * 60 + local_times.minute.to_numpy()
+    not_before_now = times >= now.ceil(step)
+
+    results = {}
+    order = np.argsort(-(appliances['duration'].to_numpy() * appliances['power'].to_numpy()), kind='stable')
+    for position in order:
+        appliance = appliances.iloc[position]
+        samples = max(1, int(np.ceil(appliance['duration'] / step_minutes)))
+        power = float(appliance['power'])
+        energy = power * samples * step_minutes / 60 / 1000  # kWh
+
+        window_start, window_end = _minutes_of_day(appliance['window_start']), _minutes_of_day(appliance['window_end'])
+        if window_start <= window_end:
+            in_window = (minute_of_day >= window_start) & (minute_of_day < window_end)
+        else:
+            in_window = (minute_of_day >= window_start) | (minute_of_day < window_end)
+
+        starts = len(times) - samples + 1
+        if starts <= 0:
+            results[position] = (appliance['name'], pd.NaT, pd.NaT, energy, 0.0)
+            continue
+
+        # Energia autoconsumata per ogni avvio: somme mobili tramite cumsum
+        usable = np.concatenate([[0.0], np.cumsum(np.minimum(surplus, power))])
+        self_consumed = usable[samples:] - usable[:-samples]
+
+        # Avvii ammessi: nessun campione fuori finestra nella durata, e non nel passato
+        forbidden = np.concatenate([[0], np.cumsum(~in_window)])
+        allowed = (forbidden[samples:] - forbidden[:-samples] == 0) & not_before_now[:starts]
+        if not allowed.any():
+            results[position] = (appliance['name'], pd.NaT, pd.NaT, energy, 0.0)
+            continue
+
+        best = int(np.argmax(np.where(allowed, self_consumed, -1.0)))
+        # Il surplus usato non è più disponibile per gli elettrodomestici successivi
+        surplus[best:best + samples] -= np.minimum(surplus[best:best + samples], power)
+
+        results[position] = (appliance['name'], times[best], times[best] + pd.Timedelta(step) * samples, energy,
+                             self_consumed[best] * step_minutes / 60 / 1000)
+
+    schedule = pd.DataFrame([results[position] for position in range(len(appliances))], columns=columns[:-1])
+    schedule['self_consumption'] = (100 * schedule['self_consumed_energy'] / schedule['energy']).round(0)
+    schedule[['energy', 'self_consumed_energy']] = schedule[['energy', 'self_consumed_energy']].round(2)
+    return schedule
@@ -0,0 +1,66 @@
+from collections import OrderedDict
+import threading
+
+from perf_trace import annotate_stage
+
+#### --- Thread-safe LRU cache of computed results ---
+
+class LRUCache:
+    """
+    Least recently used cache shared by the threads of the process (Streamlit sessions, fetch pool, API server).
+    The values are shared between callers and must be treated as read-only.
+    Each lookup is recorded as cache_hits/cache_misses on the perf_trace stage of the caller; hits and misses
+    are the totals of the process (shared by all the sessions, not a per-run measure).
+
+    - maxsize: number of entries kept
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        """Value of key (counted as a hit), default when missing (counted as a miss)."""
+        with self._lock:
+            hit = key in self._entries
+            if hit:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                value = self._entries[key]
+            else:
+                self.misses += 1
+                value = default
+        # Hit/miss sulla fase della chiamata: i contatori sono condivisi tra sessioni concorrenti
+        annotate_stage(**{'cache_hits' if hit else 'cache_misses': 1})
+        return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def get_or_compute(self, key, compute):
+        """
+        Value of key, calling compute() on a miss. compute runs outside the lock (it may use the cache itself);
+        concurrent misses of the same key compute it more than once. Exceptions are not cached.
+        """
+        sentinel = object()
+        value = self.get(key, sentinel)
+        if value is sentinel:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
@@ -1,15 +1,21 @@
 # import streamlit as st
 
 from ui import get_selected_datetime, get_selected_location, get_shadow_profile, get_solar_panel, render_ui_modern_with_tabs
-from weather_checker import get_weather_data
+from ui import render_performance_panel, get_appliances
+from data_fetcher import start_external_data_fetch, collect_external_data
 from solar_calculation import get_sun_position, calculate_if_times_are_shadowed_with_shadow_profile
-from solar_calculation import calculate_clearsky_power_output, calculate_weather_power_output, calculate_energy_for_times
-from home_power_usage_checker import get_actual_home_power
+from solar_calculation import solar_geometry_cache, get_daylight_mask
+from production_engine import calculate_monthly_production
+from stage_graph import daily_stages
+from load_scheduler import schedule_appliances, get_house_load
+from home_power_usage_checker import start_telemetry_collector
+from perf_trace import start_trace, finish_trace, trace_stage
 
-import pandas as pd
-import datetime
+import os
+import threading
+import time
 
-from config import STANDARD_STEP
+from config import STANDARD_STEP, TELEMETRY_COLLECTOR_ENABLED, PERF_PROMETHEUS_FILE, DAYLIGHT_ONLY, MONTHLY_DASHBOARD_STEP
 
 # from src.calculations import compute_solar_power
 
@@ -18,29 +24,46 @@ from config import STANDARD_STEP
 def main():
     #st.set_page_config(page_title="Solar Panel Monitoring", layout="wide")
     
+    # Each stage of the run records wall time, cache hits and payload (see perf_trace)
+    trace = start_trace('main')
+
     # --- Streamlit UI Input ---
 
-    selected_datetime = get_selected_datetime()
-    selected_date = selected_datetime.date()
-    
-    selected_location = get_selected_location()
+    with trace_stage('ui_input'):
+        selected_datetime = get_selected_datetime()
+        selected_date = selected_datetime.date()
+        
+        selected_location = get_selected_location()
+
+        shadow_profile = get_shadow_profile(location=selected_location)
 
-    shadow_profile = get_shadow_profile()
+        selected_panel = get_solar_panel()
 
-    selected_panel = get_solar_panel()
+        appliances = get_appliances()
 
     
-    # Define the daily time series with a frequency equal to step
+    # Daily stages are cached on their inputs (see stage_graph): a new time of day alone is a lookup
 
     step = STANDARD_STEP
-    times = pd.date_range(start=selected_date, end=selected_date + datetime.timedelta(days=1), freq=step, tz=selected_location.tz)
+    stage_inputs = {'date': selected_date, 'location': selected_location, 'step': step,
+                    'panel': selected_panel, 'shadow_profile': shadow_profile}
+
+    # Define the daily time series with a frequency equal to step
+    times = daily_stages.run('times', stage_inputs)
     
-    # --- Fetch real-time weather data ---
+    # --- Fetch real-time weather and home usage data (concurrently) ---
+
+    # Shelly samples come from the background collector when it has a recent one
+    telemetry_store = start_telemetry_collector() if TELEMETRY_COLLECTOR_ENABLED else None
+
+    pending_fetch = start_external_data_fetch(selected_location, telemetry_store=telemetry_store)
+
+    # Overlap the network wait with the solar geometry (stored in the geometry cache)
+    with trace_stage('solar_position', samples=len(times)):
+        solar_geometry_cache.get_clearsky(selected_location, times[get_daylight_mask(times, selected_location)] if DAYLIGHT_ONLY else times)
 
-    weather_data = get_weather_data(times,
-                                    lat = selected_location.latitude, lon = selected_location.longitude,
-                                    freq= step,                  # Added interpolation parameter
-                                    std_timezone = selected_location.tz)
+    with trace_stage('fetch_wait'):
+        weather_data, (home_pv_power, network_pv_power) = collect_external_data(pending_fetch, times, selected_location, freq=step)
     
     # --- Compute solar data ---
 
@@ -52,16 +75,41 @@ def main():
         shadow_profile=shadow_profile
     )['shadowed'].loc[selected_datetime]
 
-    clearsky_power_data = calculate_clearsky_power_output(times, selected_location, selected_panel, shadow_profile, weather_data)
-    weather_power_data = calculate_weather_power_output(times, selected_location, selected_panel, shadow_profile, weather_data)
+    # Clearsky and weather power of every array, recomputed only when date, location, panel, shadow profile or weather change
+    stage_inputs['weather'] = weather_data
+    with trace_stage('plant_power'):
+        plant_power_data = daily_stages.run('plant_power', stage_inputs)
 
-    times_clearsky_energy = calculate_energy_for_times(times, step, clearsky_power_data)
-    times_weather_energy = calculate_energy_for_times(times, step, weather_power_data)
+    clearsky_power_data = plant_power_data[('clearsky', 'total')]
+    weather_power_data = plant_power_data[('weather', 'total')]
+    arrays_power_data = plant_power_data['weather'].drop(columns='total')
 
-    # --- Fetch real-time home usage data ---
+    with trace_stage('energy_integration', samples=2 * len(times)):
+        times_clearsky_energy, times_weather_energy = daily_stages.run('daily_energy', stage_inputs)
+
+    # --- Home usage history (last 24 hours) ---
+
+    home_power_history = None
+    if telemetry_store is not None:
+        home_power_history = telemetry_store.history(since=time.time() - 24*3600, tz=selected_location.tz)
+
+    # --- Multi-day forecast from the same weather response ---
+
+    with trace_stage('forecast'):
+        forecast_data, daily_forecast_data = daily_stages.run('forecast', stage_inputs)
+
+    # --- Appliance load shifting on the forecast curve ---
+
+    with trace_stage('load_scheduling'):
+        house_load = get_house_load(home_pv_power, network_pv_power)
+        appliance_schedule = schedule_appliances(forecast_data.set_index('datetime')['weather_production'], house_load, appliances)
+
+    # --- 12 months simulation (cached on its inputs, coarse step: monthly totals only) ---
+
+    with trace_stage('monthly'):
+        monthly_data = calculate_monthly_production(selected_date.year, selected_location, selected_panel, shadow_profile,
+                                                    step=MONTHLY_DASHBOARD_STEP)
 
-    home_pv_power, network_pv_power = get_actual_home_power()
-    
     # Render UI
     #render_ui(selected_datetime, weather_data, 
     #         sun_position, selected_datetime_shadowed,
@@ -70,16 +118,32 @@ def main():
     #      home_pv_power, network_pv_power) 
     
 
-    render_ui_modern_with_tabs(selected_datetime, 
-                     weather_data, 
-                     sun_position, 
-                     selected_datetime_shadowed, 
-                     clearsky_power_data, weather_power_data,
-                     times_clearsky_energy, 
-                     times_weather_energy,
-                     home_pv_power, 
-                     network_pv_power,
-                     pd.DataFrame(), pd.DataFrame())
+    with trace_stage('render'):
+        render_ui_modern_with_tabs(selected_datetime, 
+                         weather_data, 
+                         sun_position, 
+                         selected_datetime_shadowed, 
+                         clearsky_power_data, weather_power_data,
+                         times_clearsky_energy, 
+                         times_weather_energy,
+                         home_pv_power, 
+                         network_pv_power,
+                         forecast_data, monthly_data,
+                         daily_forecast_data=daily_forecast_data,
+                         arrays_power_data=arrays_power_data,
+                         home_power_history=home_power_history,
+                         appliance_schedule=appliance_schedule,
+                         house_load=house_load)
+
+    finish_trace(trace)
+    render_performance_panel(trace)
+    if PERF_PROMETHEUS_FILE:
+        # Scrittura su file temporaneo e rename: il textfile collector non legge mai un file a metà
+        # (un file temporaneo per thread, le sessioni Streamlit possono finire insieme)
+        temporary_file = f"{PERF_PROMETHEUS_FILE}.{threading.get_ident()}.tmp"
+        with open(temporary_file, 'w') as prometheus_file:
+            prometheus_file.write(trace.to_prometheus())
+        os.replace(temporary_file, PERF_PROMETHEUS_FILE)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
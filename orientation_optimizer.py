@@ -0,0 +1,184 @@
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+import argparse
+
+import pandas as pd
+import numpy as np
+
+from pvlib.location import Location
+
+from solar_calculation import SolarGeometryCache, calculate_if_times_are_shadowed_with_shadow_profile, get_daylight_mask
+from solar_calculation import SOLAR_POSITION_METHODS
+from solar_calculation import get_plant_transposition_factors, adjust_irradiance_for_cloud_scenarios, read_horizon_file
+from solar_calculation import parse_shadow_profile
+from production_engine import parse_monthly_cloud_cover
+
+from config import ITALY_TIMEZONE, STANDARD_LOCATION_LATITUDE, STANDARD_LOCATION_LONGITUDE, STANDARD_LOCATION_ALTITUDE
+from config import STANDARD_SHADOW_AZIMUTHS, STANDARD_SHADOWS_ELEVATIONS
+from config import STANDARD_PANEL_AREA, STANDARD_PANEL_EFFICIENCY
+from config import STANDARD_MONTHLY_CLOUD_COVER
+from config import OPTIMIZER_STEP, OPTIMIZER_TILT_STEP, OPTIMIZER_AZIMUTH_STEP
+from config import ANNUAL_SOLAR_POSITION_METHOD
+
+ORIENTATION_CHUNK_SIZE = 1024
+
+SEASONS = {
+    'anno': range(1, 13),
+    'inverno': (12, 1, 2),
+    'primavera': (3, 4, 5),
+    'estate': (6, 7, 8),
+    'autunno': (9, 10, 11)
+}
+
+#### --- Energy of a chunk of orientations (runs in the worker processes) ---
+
+def _orientation_chunk_energy(orientations, solar_pos, dni, ghi, dhi):
+    """
+    Irradiation (kWh/m² per step hour) on each (tilt, azimuth) of the chunk.
+    dni is already zero when the sun is behind the shadow profile.
+    """
+
+    panels = [{'tilt': tilt, 'azimuth': azimuth} for tilt, azimuth in orientations]
+    factors = get_plant_transposition_factors(panels, solar_pos)
+
+    # Prodotti sui campioni: nessun accesso alla prima riga, una finestra senza luce dà zero
+    return (dni @ factors['direct']
+            + dhi @ factors['sky_diffuse']
+            + ghi @ factors['ground_diffuse']) / 1000
+
+#### --- Grid search over tilt and azimuth ---
+
+def calculate_orientation_energy(year, location, shadow_profile,
+                                 months=SEASONS['anno'],
+                                 panel_area=STANDARD_PANEL_AREA,
+                                 panel_efficiency=STANDARD_PANEL_EFFICIENCY / 100.0,
+                                 monthly_cloud_cover=STANDARD_MONTHLY_CLOUD_COVER,
+                                 tilt_step=OPTIMIZER_TILT_STEP,
+                                 azimuth_step=OPTIMIZER_AZIMUTH_STEP,
+                                 step=OPTIMIZER_STEP,
+                                 max_workers=0,
+                                 solar_position_method=ANNUAL_SOLAR_POSITION_METHOD):
+    """
+    Energy produced in the selected months of year for every (tilt, azimuth) of the grid.
+
+    Solar position, clear sky, shadow mask and cloud adjustment (monthly average cloud cover) are computed once
+    on the daylight samples; the transposition is broadcast over chunks of orientations, optionally in a process pool.
+
+    - year: year to simulate
+    - location, shadow_profile: as for calculate_power_output
+    - months: months to include (e.g. SEASONS['estate'])
+    - panel_area, panel_efficiency: used to convert the irradiation to energy
+    - monthly_cloud_cover: comma separated average cloud cover (%) for each month, "" for clearsky
+    - tilt_step, azimuth_step: grid resolution (degrees), tilt 0-90 and azimuth 0-360
+    - step: simulation frequency
+    - max_workers: number of processes (0 = computed in the current process)
+    - solar_position_method: one of solar_calculation.SOLAR_POSITION_METHODS
+
+    Returns: DataFrame of energy (kWh) with tilt as index and azimuth as columns
+    """
+
+    start = pd.Timestamp(year=year, month=1, day=1, tz=location.tz)
+    times = pd.date_range(start=start, end=start + pd.DateOffset(years=1), freq=step, inclusive='left')
+    times = times[times.month.isin(list(months))]
+
+    # SPA solo sulle finestre diurne (passata grossolana), la notte non contribuisce
+    geometry_cache = SolarGeometryCache(maxsize=3, method=solar_position_method)
+    times = times[get_daylight_mask(times, location, geometry_cache=geometry_cache)]
+    solar_pos = geometry_cache.get_solarposition(location, times)
+    clearsky = geometry_cache.get_clearsky(location, times)
+    shadowed = calculate_if_times_are_shadowed_with_shadow_profile(times, location, shadow_profile,
+                                                                   geometry_cache=geometry_cache)['shadowed'].to_numpy()
+
+    if monthly_cloud_cover:
+        cloud_fraction = np.asarray(parse_monthly_cloud_cover(monthly_cloud_cover))[times.month - 1][:, None] / 100.0
+    else:
+        cloud_fraction = np.zeros((len(times), 1))
+    dni, ghi, dhi = adjust_irradiance_for_cloud_scenarios(clearsky, cloud_fraction, solar_pos['apparent_zenith'])
+    dni = np.where(shadowed, 0.0, dni[:, 0])
+
+    # Solo i campioni diurni contribuiscono all'energia
+    daylight = solar_pos['apparent_zenith'].to_numpy() < 90
+    solar_pos = solar_pos[daylight]
+    dni, ghi, dhi = dni[daylight], ghi[daylight, 0], dhi[daylight, 0]
+
+    tilts = np.arange(0, 90 + tilt_step / 2, tilt_step)
+    azimuths = np.arange(0, 360 + azimuth_step / 2, azimuth_step)
+    orientations = [(tilt, azimuth) for tilt in tilts for azimuth in azimuths]
+    chunks = [orientations[index:index + ORIENTATION_CHUNK_SIZE] for index in range(0, len(orientations), ORIENTATION_CHUNK_SIZE)]
+
+    if max_workers:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            irradiation = list(executor.map(_orientation_chunk_energy, chunks,
+                                            repeat(solar_pos), repeat(dni), repeat(ghi), repeat(dhi)))
+    else:
+        irradiation = [_orientation_chunk_energy(chunk, solar_pos, dni, ghi, dhi) for chunk in chunks]
+
+    step_hours = pd.Timedelta(step).total_seconds() / 3600
+    energy = np.concatenate(irradiation) * step_hours * panel_area * panel_efficiency  # kWh
+
+    return pd.DataFrame(energy.reshape(len(tilts), len(azimuths)),
+                        index=pd.Index(tilts, name='tilt'),
+                        columns=pd.Index(azimuths, name='azimuth'))
+
+def get_best_orientation(orientation_energy):
+    tilt, azimuth = orientation_energy.stack().idxmax()
+    return {'tilt': float(tilt), 'azimuth': float(azimuth), 'energy': round(float(orientation_energy.loc[tilt, azimuth]), 1)}
+
+def plot_orientation_heatmap(orientation_energy):
+    import plotly.express as px
+
+    best = get_best_orientation(orientation_energy)
+    fig = px.imshow(orientation_energy,
+                    origin='lower',
+                    aspect='auto',
+                    labels={'x': 'Azimut (°)', 'y': 'Inclinazione (°)', 'color': 'Energia (kWh)'},
+                    title=f"Orientamento ottimale: inclinazione {best['tilt']:g}°, azimut {best['azimuth']:g}° ({best['energy']} kWh)")
+    fig.add_scatter(x=[best['azimuth']], y=[best['tilt']], mode='markers', marker=dict(color='white', size=10), showlegend=False)
+    return fig
+
+#### Main function to run the optimizer from command line ############
+
+def main():
+    parser = argparse.ArgumentParser(description="Ricerca dell'orientamento (inclinazione/azimut) con la massima produzione")
+    parser.add_argument('--year', type=int, default=pd.Timestamp.now().year)
+    parser.add_argument('--season', choices=list(SEASONS), default='anno')
+    parser.add_argument('--lat', type=float, default=STANDARD_LOCATION_LATITUDE)
+    parser.add_argument('--lon', type=float, default=STANDARD_LOCATION_LONGITUDE)
+    parser.add_argument('--alt', type=float, default=STANDARD_LOCATION_ALTITUDE)
+    parser.add_argument('--tz', default=ITALY_TIMEZONE)
+    parser.add_argument('--shadow-azimuths', default=STANDARD_SHADOW_AZIMUTHS)
+    parser.add_argument('--shadow-elevations', default=STANDARD_SHADOWS_ELEVATIONS)
+    parser.add_argument('--horizon-file', help="profilo orizzonte (azimut, elevazione), sostituisce --shadow-*")
+    parser.add_argument('--clearsky', action='store_true', help="ignora la nuvolosità media mensile")
+    parser.add_argument('--tilt-step', type=float, default=OPTIMIZER_TILT_STEP)
+    parser.add_argument('--azimuth-step', type=float, default=OPTIMIZER_AZIMUTH_STEP)
+    parser.add_argument('--step', default=OPTIMIZER_STEP)
+    parser.add_argument('--workers', type=int, default=0)
+    parser.add_argument('--solar-position', choices=SOLAR_POSITION_METHODS, default=ANNUAL_SOLAR_POSITION_METHOD)
+    parser.add_argument('--output', help="file HTML per la heatmap")
+    args = parser.parse_args()
+
+    location = Location(args.lat, args.lon, altitude=args.alt, tz=args.tz)
+    if args.horizon_file:
+        shadow_profile = read_horizon_file(args.horizon_file)
+    else:
+        shadow_profile = parse_shadow_profile(args.shadow_azimuths, args.shadow_elevations)
+
+    orientation_energy = calculate_orientation_energy(args.year, location, shadow_profile,
+                                                      months=SEASONS[args.season],
+                                                      monthly_cloud_cover="" if args.clearsky else STANDARD_MONTHLY_CLOUD_COVER,
+                                                      tilt_step=args.tilt_step,
+                                                      azimuth_step=args.azimuth_step,
+                                                      step=args.step,
+                                                      max_workers=args.workers,
+                                                      solar_position_method=args.solar_position)
+
+    best = get_best_orientation(orientation_energy)
+    print(f"Orientamento ottimale ({args.season} {args.year}): inclinazione {best['tilt']:g}°, azimut {best['azimuth']:g}°, {best['energy']} kWh")
+
+    if args.output:
+        plot_orientation_heatmap(orientation_energy).write_html(args.output)
+        print(f"Heatmap salvata in {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+from contextlib import contextmanager
+import contextvars
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger('solarpanels.perf')
+
+_current_trace = contextvars.ContextVar('current_trace', default=None)
+_current_stage = contextvars.ContextVar('current_stage', default=None)
+
+#### --- Trace of one run of main() ---
+
+class PerformanceTrace:
+    """
+    Stage records (wall time, cache hits, payload size, ...) collected during one run.
+    Stages may be recorded from worker threads started with contextvars.copy_context().run.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.started_at = time.time()
+        self.stages = []
+        self._lock = threading.Lock()
+
+    def add(self, record):
+        with self._lock:
+            self.stages.append(record)
+
+    def totals(self):
+        """Sums the numeric fields of the records with the same stage name, in order of first appearance."""
+        totals = {}
+        with self._lock:
+            stages = list(self.stages)
+        for record in stages:
+            total = totals.setdefault(record['stage'], {'calls': 0})
+            total['calls'] += 1
+            for field, value in record.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    total[field] = total.get(field, 0) + value
+        return totals
+
+    def to_dict(self):
+        with self._lock:
+            stages = list(self.stages)
+        return {'trace': self.name, 'started_at': self.started_at, 'stages': stages}
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), default=str)
+
+    def to_prometheus(self, prefix='solarpanels'):
+        """Prometheus text exposition format, one gauge per numeric field and stage."""
+        metrics = {}
+        for stage, total in self.totals().items():
+            for field, value in total.items():
+                metric_name = f"{prefix}_stage_duration_seconds" if field == 'wall_ms' else f"{prefix}_stage_{field}"
+                metric_value = value / 1000 if field == 'wall_ms' else value
+                metrics.setdefault(metric_name, []).append(f'{metric_name}{{stage="{stage}"}} {metric_value:g}')
+
+        lines = []
+        for metric_name, samples in metrics.items():
+            lines.append(f"# TYPE {metric_name} gauge")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+def start_trace(name):
+    trace = PerformanceTrace(name)
+    _current_trace.set(trace)
+    return trace
+
+def finish_trace(trace):
+    """Logs the trace as one JSON line (logger 'solarpanels.perf', level INFO) and detaches it."""
+    if _current_trace.get() is trace:
+        _current_trace.set(None)
+    logger.info(trace.to_json())
+    return trace
+
+#### --- Stages ---
+
+@contextmanager
+def trace_stage(name, **fields):
+    """
+    Records the wall time of the block as a stage of the current trace (no-op without a trace).
+    Nested stages are named after their parent, e.g. 'forecast/solar_position'.
+    Yields the record, so the block can add fields; nested code can use annotate_stage.
+    """
+
+    trace = _current_trace.get()
+    parent = _current_stage.get()
+    if parent is not None:
+        name = f"{parent['stage']}/{name}"
+    record = {'stage': name, 'thread': threading.current_thread().name, **fields}
+    if trace is None:
+        yield record
+        return
+
+    stage_token = _current_stage.set(record)
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record['wall_ms'] = (time.perf_counter() - start) * 1000
+        _current_stage.reset(stage_token)
+        trace.add(record)
+
+def annotate_stage(**fields):
+    """Adds numeric fields (e.g. payload_bytes) to the current stage, summing with previous values."""
+    record = _current_stage.get()
+    if record is None:
+        return
+    for field, value in fields.items():
+        record[field] = record.get(field, 0) + value
+
+def traced(name, function, *args):
+    """Runs function(*args) inside a stage, for callables submitted to thread pools."""
+    with trace_stage(name):
+        return function(*args)
@@ -0,0 +1,153 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+import numpy as np
+
+from solar_calculation import SolarGeometryCache, calculate_power_output_for_scenarios, calculate_if_times_are_shadowed_with_shadow_profile
+from solar_calculation import get_daylight_mask
+
+from weather_checker import resample_weather_points
+from lru_cache import LRUCache
+
+from config import ANNUAL_STEP, ANNUAL_PROCESS_WORKERS, ANNUAL_SOLAR_POSITION_METHOD, STANDARD_MONTHLY_CLOUD_COVER
+from config import FORECAST_STEP, FORECAST_DAYS
+
+MONTH_NAMES = ['Gen', 'Feb', 'Mar', 'Apr', 'Mag', 'Giu', 'Lug', 'Ago', 'Set', 'Ott', 'Nov', 'Dic']
+
+RESULTS_CACHE_SIZE = 8
+
+# Piccola cache LRU dei risultati: i rerun con gli stessi input non ripetono la simulazione
+_results_cache = LRUCache(RESULTS_CACHE_SIZE)
+
+#### --- 12 months simulation ---
+
+def parse_monthly_cloud_cover(monthly_cloud_cover=STANDARD_MONTHLY_CLOUD_COVER):
+    return [float(value) for value in monthly_cloud_cover.split(",")]
+
+def calculate_month_production(year, month, location, panel, shadow_profile, cloud_cover, step=ANNUAL_STEP,
+                               solar_position_method=ANNUAL_SOLAR_POSITION_METHOD):
+    """
+    Simulates one month: sunshine hours, clearsky energy and energy with the month average cloud cover.
+    Only one month of samples is held in memory at a time.
+
+    Returns: Dictionary with 'Ore di Sole' (h), 'Produzione Clearsky' and 'Produzione Climatologica' (kWh)
+    """
+
+    start = pd.Timestamp(year=year, month=month, day=1, tz=location.tz)
+    times = pd.date_range(start=start, end=start + pd.offsets.MonthBegin(1), freq=step, inclusive='left')
+    step_hours = pd.Timedelta(step).total_seconds() / 3600
+
+    # Cache locale: la simulazione annuale non deve svuotare la cache del dashboard
+    geometry_cache = SolarGeometryCache(maxsize=3, method=solar_position_method)
+
+    cloud_cover_scenarios = pd.DataFrame({'clearsky': 0.0, 'historical': cloud_cover}, index=times)
+    power = calculate_power_output_for_scenarios(times, location, panel, shadow_profile, cloud_cover_scenarios,
+                                                 geometry_cache=geometry_cache)
+
+    # Le ore di sole cadono tutte nella finestra diurna, già in cache dopo il calcolo della potenza
+    daylight_times = times[get_daylight_mask(times, location, geometry_cache=geometry_cache)]
+    solar_position = geometry_cache.get_solarposition(location, daylight_times)
+    shadowed = calculate_if_times_are_shadowed_with_shadow_profile(daylight_times, location, shadow_profile,
+                                                                   geometry_cache=geometry_cache)['shadowed'].to_numpy()
+    sunny = (solar_position['elevation'].to_numpy() > 0) & ~shadowed
+
+    energy = power.sum().to_numpy() * step_hours / 1000  # kWh
+
+    return {
+        'Ore di Sole': round(np.count_nonzero(sunny) * step_hours, 1),
+        'Produzione Clearsky': round(energy[0], 1),
+        'Produzione Climatologica': round(energy[1], 1)
+    }
+
+def calculate_monthly_production(year, location, panel, shadow_profile,
+                                 monthly_cloud_cover=STANDARD_MONTHLY_CLOUD_COVER,
+                                 step=ANNUAL_STEP,
+                                 max_workers=ANNUAL_PROCESS_WORKERS,
+                                 solar_position_method=ANNUAL_SOLAR_POSITION_METHOD):
+    """
+    Simulates the 12 months of year for the "Dati 12 Mesi" tab.
+
+    - year: year to simulate
+    - location, panel, shadow_profile: as for calculate_power_output
+    - monthly_cloud_cover: comma separated average cloud cover (%) for each month, used for 'Produzione Climatologica'
+                           (default: approximate climatology of Milan, not of the selected site)
+    - step: simulation frequency
+    - max_workers: number of processes, one month per task (0 = computed in the current process)
+    - solar_position_method: one of solar_calculation.SOLAR_POSITION_METHODS
+
+    Returns: DataFrame with columns 'Mese', 'Ore di Sole', 'Produzione Clearsky', 'Produzione Climatologica'
+    """
+
+    cloud_covers = parse_monthly_cloud_cover(monthly_cloud_cover)
+    # Stessa impronta degli input degli stage del dashboard (import locale: stage_graph importa questo modulo)
+    from stage_graph import input_key
+    key = ('monthly', year, tuple(cloud_covers), solar_position_method, step, input_key(location), input_key(panel), input_key(shadow_profile))
+
+    def compute():
+        months = range(1, 13)
+        arguments = [(year, month, location, panel, shadow_profile, cloud_covers[month - 1], step, solar_position_method)
+                     for month in months]
+
+        if max_workers:
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                results = list(executor.map(calculate_month_production, *zip(*arguments)))
+        else:
+            results = [calculate_month_production(*month_arguments) for month_arguments in arguments]
+
+        monthly_data = pd.DataFrame(results)
+        monthly_data.insert(0, 'Mese', MONTH_NAMES)
+        return monthly_data
+
+    return _results_cache.get_or_compute(key, compute)
+
+#### --- Multi-day forecast ---
+
+def calculate_forecast_production(weather_data, location, panel, shadow_profile,
+                                  step=FORECAST_STEP,
+                                  days=FORECAST_DAYS):
+    """
+    Computes the production for the next days from the weather points already downloaded
+    by get_weather_data (actual weather + full OpenWeather forecast), in a single pass over a multi-day index.
+
+    - weather_data: output of get_weather_data / build_weather_data
+    - location, panel, shadow_profile: as for calculate_power_output
+    - step: frequency of the multi-day index
+    - days: number of days, starting from the day of the current weather point (today)
+
+    Returns: (forecast_data, daily_forecast_data)
+    - forecast_data: DataFrame with 'datetime', 'clearsky_production', 'weather_production' (W)
+    - daily_forecast_data: DataFrame with 'data', 'clearsky_energy', 'weather_energy' (kWh)
+    """
+
+    # Riferimento temporale dal dato meteo attuale: il risultato dipende solo da weather_data (cache in stage_graph)
+    now = pd.Timestamp.now(tz=location.tz)
+    if weather_data and weather_data['actual_weather']:
+        now = max(pd.Timestamp(point['datetime']) for point in weather_data['actual_weather']).tz_convert(location.tz)
+    start = now.normalize()
+    times = pd.date_range(start=start, end=start + pd.Timedelta(days=days), freq=step, inclusive='left')
+
+    weather_points = []
+    if weather_data:
+        weather_points = [point for point in weather_data['actual_weather'] if point['cloud_cover'] is not None]
+        weather_points += weather_data.get('forecast_weather', [])
+
+    cloud_cover = resample_weather_points(times, weather_points, now)['cloud_cover']
+    cloud_cover_scenarios = pd.DataFrame({'clearsky': 0.0, 'weather': cloud_cover.reindex(times)}, index=times)
+
+    power = calculate_power_output_for_scenarios(times, location, panel, shadow_profile, cloud_cover_scenarios)
+
+    forecast_data = pd.DataFrame({
+        'datetime': times,
+        'clearsky_production': power['clearsky'].to_numpy(),
+        'weather_production': power['weather'].to_numpy()
+    })
+
+    step_hours = pd.Timedelta(step).total_seconds() / 3600
+    daily_energy = power.groupby(times.date).sum(min_count=1) * step_hours / 1000  # kWh
+    daily_forecast_data = pd.DataFrame({
+        'data': daily_energy.index,
+        'clearsky_energy': daily_energy['clearsky'].round(1).to_numpy(),
+        'weather_energy': daily_energy['weather'].round(1).to_numpy()
+    })
+
+    return forecast_data, daily_forecast_data
@@ -1,12 +1,228 @@
-from pvlib.location import Location
-from pvlib import irradiance
+import importlib.util
 
 import pandas as pd
 import numpy as np
 
-def get_sun_position(selected_datetime, selected_location):
-    
-    solar_position = selected_location.get_solarposition(selected_datetime)
+from perf_trace import trace_stage
+from lru_cache import LRUCache
+
+from config import DAYLIGHT_ONLY, DAYLIGHT_COARSE_STEP, SOLAR_POSITION_METHOD
+from config import STANDARD_SHADOW_AZIMUTHS, STANDARD_SHADOWS_ELEVATIONS
+
+#####  --- Solar geometry cache ---
+
+SOLAR_GEOMETRY_CACHE_SIZE = 32
+
+# Algoritmi di posizione solare di pvlib: SPA NumPy, SPA compilato con numba (richiede numba), effemeridi (più leggero)
+SOLAR_POSITION_METHODS = ('nrel_numpy', 'nrel_numba', 'ephemeris')
+
+# numba non è tra i requisiti: senza numba pvlib ripiegherebbe su NumPy con un solo warning
+NUMBA_AVAILABLE = importlib.util.find_spec('numba') is not None
+AVAILABLE_SOLAR_POSITION_METHODS = tuple(method for method in SOLAR_POSITION_METHODS if method != 'nrel_numba' or NUMBA_AVAILABLE)
+
+def _as_datetime_index(times):
+    if isinstance(times, pd.DatetimeIndex):
+        return times
+    return pd.DatetimeIndex([times]) if np.ndim(times) == 0 else pd.DatetimeIndex(times)
+
+def localize_timestamp(timestamp, tz):
+    """Timestamp of a date, datetime or string in tz (naive values are taken as local time of tz)."""
+    timestamp = pd.Timestamp(timestamp)
+    return timestamp.tz_localize(tz) if timestamp.tz is None else timestamp.tz_convert(tz)
+
+class SolarGeometryCache(LRUCache):
+    """
+    LRU cache for solar position and clear-sky irradiance.
+
+    Entries are keyed by location (latitude, longitude, altitude, tz) and by the time index,
+    so every stage of a rerun that works on the same daily index shares one SPA computation.
+    The returned DataFrames are shared between callers and must be treated as read-only.
+
+    - method: solar position algorithm, one of SOLAR_POSITION_METHODS (see solar_position_report for accuracy).
+      'nrel_numba' requires numba. pvlib switches its SPA module between numba and NumPy globally: only one of
+      the two modes is active per process, so caches with different nrel_* methods affect each other.
+    """
+
+    def __init__(self, maxsize=SOLAR_GEOMETRY_CACHE_SIZE, method=SOLAR_POSITION_METHOD):
+        if method not in SOLAR_POSITION_METHODS:
+            raise ValueError(f"Unknown solar position method '{method}', expected one of {SOLAR_POSITION_METHODS}")
+        if method not in AVAILABLE_SOLAR_POSITION_METHODS:
+            raise ValueError(f"Solar position method '{method}' requires numba, which is not installed")
+        super().__init__(maxsize)
+        self.method = method
+
+    @staticmethod
+    def _location_key(location):
+        return (location.latitude, location.longitude, location.altitude, str(location.tz))
+
+    @staticmethod
+    def _times_key(times):
+        # Gli indici regolari sono identificati da inizio, lunghezza e frequenza, gli altri dal contenuto
+        if times.freq is not None:
+            return (str(times.tz), len(times), times.asi8[0] if len(times) else None, times.freqstr)
+        return (str(times.tz), len(times), hash(times.asi8.tobytes()))
+
+    def _get(self, kind, location, times, compute):
+        return self.get_or_compute((kind, self._location_key(location), self._times_key(times)), compute)
+
+    def get_solarposition(self, location, times):
+        times = _as_datetime_index(times)
+        return self._get('solarposition', location, times,
+                         lambda: location.get_solarposition(times, method=self.method))
+
+    def get_clearsky(self, location, times):
+        times = _as_datetime_index(times)
+        # Riusa la posizione solare in cache: get_clearsky altrimenti ricalcola SPA
+        return self._get('clearsky', location, times,
+                         lambda: location.get_clearsky(times, solar_position=self.get_solarposition(location, times)))
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self), 'maxsize': self.maxsize, 'method': self.method}
+
+solar_geometry_cache = SolarGeometryCache()
+
+#####  --- Daylight windows ---
+
+DAYLIGHT_ZENITH_MARGIN = 0.5  # degrees below the horizon still treated as daylight by the coarse pass
+
+def get_daylight_mask(times, location, coarse_step=DAYLIGHT_COARSE_STEP, geometry_cache=None):
+    """
+    Boolean mask of the samples of times that can have the sun above the horizon.
+
+    Solar position is computed only on a coarse grid (coarse_step); a sample is kept when either end
+    of its coarse interval has apparent zenith below 90° + DAYLIGHT_ZENITH_MARGIN. The mask is conservative:
+    every sample with the sun up is kept, a few samples around sunrise and sunset are kept too.
+
+    - times: Pandas DatetimeIndex
+    - location: pvlib Location
+    - coarse_step: resolution of the coarse pass
+    - geometry_cache: SolarGeometryCache for the coarse solar position (default: solar_geometry_cache)
+    """
+
+    times = _as_datetime_index(times)
+    if len(times) == 0:
+        return np.zeros(0, dtype=bool)
+
+    # Griglia grossolana allineata in UTC che copre tutti i campioni
+    coarse_ns = pd.Timedelta(coarse_step).value
+    samples_ns = times.as_unit('ns').asi8
+    start_ns = samples_ns.min() // coarse_ns * coarse_ns
+    periods = int((samples_ns.max() - start_ns) // coarse_ns) + 2
+    if 2 * periods > len(times):
+        # Campioni già radi: la passata grossolana costerebbe quanto quella completa
+        return np.ones(len(times), dtype=bool)
+    coarse_times = pd.date_range(start=pd.Timestamp(start_ns, tz='UTC' if times.tz is not None else None),
+                                 periods=periods, freq=coarse_step)
+    if times.tz is not None:
+        coarse_times = coarse_times.tz_convert(times.tz)
+
+    geometry_cache = solar_geometry_cache if geometry_cache is None else geometry_cache
+    coarse_zenith = geometry_cache.get_solarposition(location, coarse_times)['apparent_zenith'].to_numpy()
+    coarse_daylight = coarse_zenith < 90 + DAYLIGHT_ZENITH_MARGIN
+
+    interval = (samples_ns - start_ns) // coarse_ns
+    return coarse_daylight[interval] | coarse_daylight[interval + 1]
+
+#####  --- Compiled horizon profile ---
+
+HORIZON_RESOLUTION = 0.1  # degrees of azimuth per table entry
+HORIZON_CACHE_SIZE = 16
+
+class HorizonProfile:
+    """
+    Horizon (shadow) profile compiled into a dense azimuth -> elevation table.
+
+    The table has a fixed azimuth step, so the lookup costs the same for a profile of
+    eight hand-typed points or of thousands of surveyed/PVGIS points. Azimuths wrap around 0/360°:
+    the segment between the last and the first point of the profile crosses north.
+    """
+
+    def __init__(self, azimuths, elevations, resolution=HORIZON_RESOLUTION):
+        azimuths = np.asarray(azimuths, dtype=float)
+        elevations = np.asarray(elevations, dtype=float)
+
+        # Normalizza in [0, 360], mantenendo 360 come estremo esplicito del profilo
+        azimuths = np.where(azimuths == 360, 360.0, np.mod(azimuths, 360))
+        order = np.argsort(azimuths, kind='stable')
+        azimuths, elevations = azimuths[order], elevations[order]
+
+        # Collega l'ultimo e il primo punto attraverso il nord (se il profilo non definisce già 0° e 360°)
+        wrapped_azimuths, wrapped_elevations = azimuths, elevations
+        if azimuths[-1] - 360 < azimuths[0]:
+            wrapped_azimuths = np.concatenate([azimuths[-1:] - 360, wrapped_azimuths])
+            wrapped_elevations = np.concatenate([elevations[-1:], wrapped_elevations])
+        if azimuths[0] + 360 > azimuths[-1]:
+            wrapped_azimuths = np.concatenate([wrapped_azimuths, azimuths[:1] + 360])
+            wrapped_elevations = np.concatenate([wrapped_elevations, elevations[:1]])
+
+        self.resolution = resolution
+        self.size = int(round(360 / resolution))
+        self.table = np.interp(np.arange(self.size + 1) * resolution, wrapped_azimuths, wrapped_elevations)
+
+    @classmethod
+    def from_shadow_profile(cls, shadow_profile, resolution=HORIZON_RESOLUTION):
+        return cls(shadow_profile['Azimuth'], shadow_profile['Elevation'], resolution=resolution)
+
+    def elevation_at(self, azimuth):
+        """Horizon elevation (degrees) for the given solar azimuths, linearly interpolated between table entries."""
+        position = np.mod(np.asarray(azimuth, dtype=float), 360) / self.resolution
+        index = np.minimum(position.astype(np.int64), self.size - 1)
+        fraction = position - index
+        return self.table[index] * (1 - fraction) + self.table[index + 1] * fraction
+
+_horizon_cache = LRUCache(HORIZON_CACHE_SIZE)
+
+def get_horizon_profile(shadow_profile, resolution=HORIZON_RESOLUTION):
+    """
+    Returns the compiled HorizonProfile for a shadow profile DataFrame (['Azimuth', 'Elevation']).
+    Compiled profiles are cached on the profile points, so reruns with the same profile reuse the table.
+    """
+
+    if isinstance(shadow_profile, HorizonProfile):
+        return shadow_profile
+
+    azimuths = shadow_profile['Azimuth'].to_numpy(dtype=float)
+    elevations = shadow_profile['Elevation'].to_numpy(dtype=float)
+    key = (resolution, azimuths.tobytes(), elevations.tobytes())
+    return _horizon_cache.get_or_compute(key, lambda: HorizonProfile(azimuths, elevations, resolution=resolution))
+
+def parse_shadow_profile(shadow_azimuths=STANDARD_SHADOW_AZIMUTHS, shadow_elevations=STANDARD_SHADOWS_ELEVATIONS):
+    """
+    Shadow profile from comma separated azimuths and elevations (sidebar fields, config, CLI options).
+    Raises ValueError on non numeric values or lists of different length.
+
+    Returns: DataFrame with columns ['Azimuth', 'Elevation'] sorted by azimuth
+    """
+    return pd.DataFrame({"Azimuth": list(map(float, shadow_azimuths.split(","))),
+                         "Elevation": list(map(float, shadow_elevations.split(",")))}).sort_values(by="Azimuth")
+
+def read_horizon_file(horizon_file, south_zero=False):
+    """
+    Reads a horizon profile with two numeric columns (azimuth, elevation) separated by comma,
+    semicolon, tab or spaces. Header and '#' comment lines are skipped.
+
+    - horizon_file: path or file-like object
+    - south_zero: True for files with 0° = South (e.g. PVGIS exports), converted to 0° = North
+
+    Returns: DataFrame with columns ['Azimuth', 'Elevation'] sorted by azimuth
+    """
+
+    raw_profile = pd.read_csv(horizon_file, sep=r'[,;\s]+', engine='python', comment='#', header=None, usecols=[0, 1])
+    raw_profile = raw_profile.apply(pd.to_numeric, errors='coerce').dropna()
+
+    azimuths = raw_profile[0].to_numpy(dtype=float)
+    if south_zero:
+        azimuths = np.mod(azimuths + 180, 360)
+
+    # Nei file PVGIS -180° e 180° diventano entrambi 0°: un solo punto per azimut
+    return (pd.DataFrame({"Azimuth": azimuths, "Elevation": raw_profile[1].to_numpy(dtype=float)})
+            .sort_values(by="Azimuth", kind="stable").drop_duplicates(subset="Azimuth"))
+
+def get_sun_position(selected_datetime, selected_location, geometry_cache=None):
+    """Sun azimuth and apparent elevation at selected_datetime, with the algorithm of geometry_cache (default: solar_geometry_cache)."""
+
+    geometry_cache = solar_geometry_cache if geometry_cache is None else geometry_cache
+    solar_position = geometry_cache.get_solarposition(selected_location, selected_datetime)
     sun_azimuth = round(solar_position["azimuth"].iloc[0], 1)
     sun_elevation = round(solar_position["apparent_elevation"].iloc[0], 1)
 
@@ -15,40 +231,41 @@ def get_sun_position(selected_datetime, selected_location):
 
     return sun_position
 
-def calculate_if_times_are_shadowed_with_shadow_profile(times, location, shadow_profile):
+def calculate_if_times_are_shadowed_with_shadow_profile(times, location, shadow_profile, geometry_cache=None):
     """
     Calcola i momenti di irraggiamento solare in base a un profilo d'ombra definito da una serie di punti (azimuth, elevation).
 
     Args:
         times (datetime): momenti per la quale calcolare i tempi.
         location (object): Oggetto con metodi per ottenere posizione solare.
-        shadow_profile (pd.DataFrame): DataFrame con colonne ['azimuth', 'elevation'].
+        shadow_profile (pd.DataFrame | HorizonProfile): DataFrame con colonne ['Azimuth', 'Elevation'] o profilo già compilato.
+        geometry_cache (SolarGeometryCache): cache della posizione solare (default: solar_geometry_cache).
 
     Returns:
         pd.DataFrame: 
             - 'shadowed' (pd.Series): Maschera booleana che indica quando il sole è bloccato.
     """
 
-    # Funzione per interpolare l'elevazione in base all'azimuth
-    def interpolate_elevation(azimuth_values):
-        return np.interp(azimuth_values, shadow_profile['Azimuth'], shadow_profile['Elevation'], left=0, right=0)
+    # Profilo d'ombra compilato in tabella (lookup O(1), continuo attraverso 0/360°)
+    horizon = get_horizon_profile(shadow_profile)
 
     # Crea una serie temporale per il giorno specifico
     # times = pd.date_range(start=date, end=date + datetime.timedelta(days=1), freq=step, tz=location.tz)
     
-    # Calcola la posizione solare
-    solar_position = location.get_solarposition(times)
+    # Calcola la posizione solare (condivisa tramite cache, da non modificare)
+    geometry_cache = solar_geometry_cache if geometry_cache is None else geometry_cache
+    solar_position = geometry_cache.get_solarposition(location, times)
 
     # Interpola l'elevazione d'ombra corrispondente all'azimuth del sole
-    solar_position['shadow_elevation'] = interpolate_elevation(solar_position['azimuth'])
+    shadow_elevation = horizon.elevation_at(solar_position['azimuth'].to_numpy())
 
     # Condizione per cui il sole è sopra l'orizzonte e non coperto dall'ombra
-    shadow_mask = solar_position['elevation'] < solar_position['shadow_elevation']
+    shadow_mask = solar_position['elevation'].to_numpy() < shadow_elevation
 
     # Crea il DataFrame di output
     shadowed_df = pd.DataFrame({
         'datetime': times,
-        'shadowed': shadow_mask.values  # Converti in array per evitare problemi con l'indice
+        'shadowed': shadow_mask  # Array, per evitare problemi con l'indice
     })
     shadowed_df = shadowed_df.set_index('datetime')
 
@@ -104,6 +321,224 @@ def adjust_irradiance_for_clouds_and_shadow(times, location, clearsky, cloud_cov
 
     return dni_adjusted, ghi_adjusted, dhi_adjusted
 
+# --- Plant arrays ---
+
+def get_plant_arrays(selected_panel):
+    """
+    Normalizes the panel input to a list of arrays.
+
+    - selected_panel: Dictionary with 'tilt', 'azimuth', 'area', 'efficiency' (single plane)
+      or list of such dictionaries, each optionally with 'name' and its own 'shadow_profile'
+
+    Returns: list of panel dictionaries, each with a 'name'
+    """
+
+    panels = [selected_panel] if isinstance(selected_panel, dict) else list(selected_panel)
+    return [dict(panel, name=panel.get('name') or f'array_{number}') for number, panel in enumerate(panels, start=1)]
+
+# --- Transposition factors shared by all cloud scenarios ---
+
+def get_plant_transposition_factors(panels, solar_pos):
+    """
+    Computes the plane-of-array response to unit DNI, DHI and GHI for all the arrays in one broadcast pass.
+
+    The isotropic transposition is linear in the irradiance components, so the POA irradiance of any
+    scenario is dni * direct + dhi * sky_diffuse + ghi * ground_diffuse.
+
+    - panels: list of dictionaries with 'tilt', 'azimuth'
+    - solar_pos: DataFrame with 'apparent_zenith' and 'azimuth'
+
+    Returns: Dictionary with 'direct', 'sky_diffuse', 'ground_diffuse' numpy arrays (times x arrays)
+    """
+
+    from pvlib import irradiance  # import differito: pvlib è lento da importare
+
+    unit_irradiance = irradiance.get_total_irradiance(
+        surface_tilt = np.array([[panel['tilt'] for panel in panels]], dtype=float),
+        surface_azimuth = np.array([[panel['azimuth'] for panel in panels]], dtype=float),
+        dni=1.0,
+        ghi=1.0,
+        dhi=1.0,
+        solar_zenith=solar_pos['apparent_zenith'].to_numpy()[:, None],
+        solar_azimuth=solar_pos['azimuth'].to_numpy()[:, None]
+    )
+
+    shape = (len(solar_pos), len(panels))
+    return {
+        'direct': np.broadcast_to(np.asarray(unit_irradiance['poa_direct'], dtype=float), shape),
+        'sky_diffuse': np.broadcast_to(np.asarray(unit_irradiance['poa_sky_diffuse'], dtype=float), shape),
+        'ground_diffuse': np.broadcast_to(np.asarray(unit_irradiance['poa_ground_diffuse'], dtype=float), shape)
+    }
+
+def get_transposition_factors(selected_panel, solar_pos):
+    """
+    Single plane version of get_plant_transposition_factors.
+
+    - selected_panel: Dictionary with 'tilt', 'azimuth'
+    - solar_pos: DataFrame with 'apparent_zenith' and 'azimuth'
+
+    Returns: Dictionary with 'direct', 'sky_diffuse', 'ground_diffuse' numpy arrays
+    """
+
+    factors = get_plant_transposition_factors([selected_panel], solar_pos)
+    return {component: values[:, 0] for component, values in factors.items()}
+
+# --- Cloud cover scenarios (times x scenarios) ---
+
+def get_cloud_cover_scenarios(times, weather_data, what_if_cloud_covers=()):
+    """
+    Builds the cloud cover matrix used by calculate_power_output_for_scenarios.
+
+    - times: Pandas DatetimeIndex
+    - weather_data: output of get_weather_data
+    - what_if_cloud_covers: additional constant cloud cover levels (0-100)
+
+    Returns: DataFrame with columns 'clearsky', 'weather' and one 'cloud_<level>' column per what-if level
+    """
+
+    scenarios = {
+        'clearsky': 0.0,
+        'weather': weather_data['times_cloud_cover']['cloud_cover'].reindex(times).astype(float)
+    }
+    for cloud_cover in what_if_cloud_covers:
+        scenarios[f'cloud_{cloud_cover:g}'] = float(cloud_cover)
+
+    return pd.DataFrame(scenarios, index=times)
+
+# --- Cloud adjustment for several scenarios ---
+
+def adjust_irradiance_for_cloud_scenarios(clearsky, cloud_fraction, solar_zenith):
+    """
+    Same empirical cloud model of adjust_irradiance_for_clouds_and_shadow, on numpy arrays and without shadow.
+
+    - clearsky: DataFrame with 'dni', 'ghi', 'dhi'
+    - cloud_fraction: cloud fraction (0-1), array (times x scenarios)
+    - solar_zenith: Solar zenith angle (degrees)
+
+    Returns adjusted DNI, GHI, and DHI arrays (times x scenarios).
+    """
+
+    cos_zenith = np.cos(np.radians(np.asarray(solar_zenith, dtype=float)))[:, None]
+
+    dni_adjusted = np.clip(np.asarray(clearsky['dni'], dtype=float)[:, None] * (1 - 1.1 * cloud_fraction), 0, None)
+    ghi_adjusted = np.asarray(clearsky['ghi'], dtype=float)[:, None] * (1.0 - 0.75 * cloud_fraction)
+    dhi_adjusted = np.clip(ghi_adjusted - dni_adjusted * cos_zenith, 0, None)
+
+    return dni_adjusted, ghi_adjusted, dhi_adjusted
+
+# --- Single pass power calculation for several cloud scenarios and arrays ---
+
+def calculate_plant_power_output(times, selected_location, selected_panel, shadow_profile, cloud_cover_scenarios,
+                                 geometry_cache=None, daylight_only=DAYLIGHT_ONLY):
+    """
+    Calculates the power output of every array of the plant for several cloud cover scenarios in a single pass.
+    Solar position, clear-sky irradiance and cloud adjustment are computed once; shadow masks and
+    transposition are broadcast over the arrays, the cloud model over the scenario columns.
+    With daylight_only the chain runs only on the daylight samples (see get_daylight_mask), night samples are
+    zero (NaN where the scenario has no cloud cover, as the full computation gives).
+
+    - times: Pandas DatetimeIndex
+    - selected_location: 
+    - selected_panel: panel dictionary or list of arrays (see get_plant_arrays)
+    - shadow_profile: site shadow profile, used by the arrays without their own 'shadow_profile'
+    - cloud_cover_scenarios: DataFrame (times x scenarios) or 2-D array with cloud cover percentage (0-100)
+    - geometry_cache: SolarGeometryCache to use (default: solar_geometry_cache)
+    - daylight_only: skip the samples with the sun below the horizon
+
+    Returns: DataFrame with (scenario, array) columns, array names plus 'total' for each scenario
+    """
+
+    panels = get_plant_arrays(selected_panel)
+
+    if not isinstance(cloud_cover_scenarios, pd.DataFrame):
+        cloud_cover_scenarios = pd.DataFrame(np.asarray(cloud_cover_scenarios, dtype=float).reshape(len(times), -1), index=times)
+    cloud_fraction = cloud_cover_scenarios.reindex(times).to_numpy(dtype=float) / 100.0
+
+    # Only the daylight samples go through the irradiance chain
+    geometry_cache = solar_geometry_cache if geometry_cache is None else geometry_cache
+    all_times, all_cloud_fraction = times, cloud_fraction
+    if daylight_only:
+        daylight = get_daylight_mask(times, selected_location, geometry_cache=geometry_cache)
+        times, cloud_fraction = times[daylight], cloud_fraction[daylight]
+
+    # Get solar position and clear-sky irradiance
+    with trace_stage('solar_position', samples=len(times)):
+        solar_pos = geometry_cache.get_solarposition(selected_location, times)
+        clearsky = geometry_cache.get_clearsky(selected_location, times)
+
+    with trace_stage('irradiance_adjustment', samples=len(times) * cloud_fraction.shape[1]):
+        # Shadow mask per array (times x arrays), the site profile is evaluated only once
+        site_shadowed = None
+        shadowed = np.empty((len(times), len(panels)), dtype=bool)
+        for number, panel in enumerate(panels):
+            panel_shadow_profile = panel.get('shadow_profile')
+            if panel_shadow_profile is None:
+                if site_shadowed is None:
+                    site_shadowed = calculate_if_times_are_shadowed_with_shadow_profile(
+                        times=times, 
+                        location=selected_location,
+                        shadow_profile=shadow_profile,
+                        geometry_cache=geometry_cache
+                    )['shadowed'].to_numpy()
+                shadowed[:, number] = site_shadowed
+            else:
+                shadowed[:, number] = calculate_if_times_are_shadowed_with_shadow_profile(
+                    times=times, 
+                    location=selected_location,
+                    shadow_profile=panel_shadow_profile,
+                    geometry_cache=geometry_cache
+                )['shadowed'].to_numpy()
+
+        # Adjust irradiance, one column per scenario
+        dni_adj, ghi_adj, dhi_adj = adjust_irradiance_for_cloud_scenarios(clearsky, cloud_fraction, solar_pos['apparent_zenith'])
+
+    with trace_stage('poa_transposition', samples=len(times) * cloud_fraction.shape[1] * len(panels)):
+        # Compute POA irradiance (times x scenarios x arrays), DNI is zero on shadowed arrays
+        factors = get_plant_transposition_factors(panels, solar_pos)
+        direct = np.where(shadowed, 0.0, factors['direct'])
+        poa_irradiance = (dni_adj[:, :, None] * direct[:, None, :]
+                          + dhi_adj[:, :, None] * factors['sky_diffuse'][:, None, :]
+                          + ghi_adj[:, :, None] * factors['ground_diffuse'][:, None, :])
+
+    # Compute power output
+    area_efficiency = np.array([panel['area'] * panel['efficiency'] for panel in panels])
+    power_output = poa_irradiance * area_efficiency  # Watts
+    total_power_output = power_output.sum(axis=2, keepdims=True) if len(panels) > 1 else power_output
+
+    power_output = np.concatenate([power_output, total_power_output], axis=2)
+    columns = pd.MultiIndex.from_product([cloud_cover_scenarios.columns, [panel['name'] for panel in panels] + ['total']])
+
+    if daylight_only:
+        # Di notte la potenza è zero, NaN dove manca la nuvolosità (come nel calcolo completo)
+        night_power_output = np.where(np.isnan(all_cloud_fraction), np.nan, 0.0)[:, :, None]
+        full_power_output = np.repeat(night_power_output, power_output.shape[2], axis=2)
+        full_power_output[daylight] = power_output
+        power_output, times = full_power_output, all_times
+
+    return pd.DataFrame(power_output.reshape(len(times), -1), index=times, columns=columns)
+
+def calculate_power_output_for_scenarios(times, selected_location, selected_panel, shadow_profile, cloud_cover_scenarios,
+                                         geometry_cache=None):
+    """
+    Calculates solar panel power output for several cloud cover scenarios in a single pass.
+    Solar position, clear-sky irradiance, shadow mask and transposition are computed once and
+    broadcast over the scenario columns.
+
+    - times: Pandas DatetimeIndex
+    - selected_location: 
+    - selected_panel: Dictionary with 'tilt', 'azimuth', 'area', 'efficiency', or list of arrays
+    - shadow_profile
+    - cloud_cover_scenarios: DataFrame (times x scenarios) or 2-D array with cloud cover percentage (0-100)
+    - geometry_cache: SolarGeometryCache to use (default: solar_geometry_cache)
+
+    Returns: DataFrame with one power output column per scenario (total of the arrays)
+    """
+
+    plant_power_output = calculate_plant_power_output(times, selected_location, selected_panel, shadow_profile,
+                                                      cloud_cover_scenarios, geometry_cache=geometry_cache)
+
+    return plant_power_output.xs('total', axis=1, level=1)
+
 # --- Single function to calculate power for times sequence in all condition of cloud and shadow ---
 
 def calculate_power_output(times, selected_location, selected_panel, shadow_profile, weather_data):
@@ -119,46 +554,16 @@ def calculate_power_output(times, selected_location, selected_panel, shadow_prof
     Returns: Power output series
     """
 
-    # Get solar position
-    solar_pos = selected_location.get_solarposition(times)
-
-    # Get clear-sky irradiance
-    clearsky = selected_location.get_clearsky(times)
-
     # check cloud cover data 
     cloud_cover = weather_data['times_cloud_cover']['cloud_cover']
     if cloud_cover is None:
-        cloud_cover = nan  # Default to clear sky if API fails ########### mettere un NA e non mostrare il grafico
-
-    # Adjust irradiance
-    dni_adj, ghi_adj, dhi_adj = adjust_irradiance_for_clouds_and_shadow(
-        times,
-        selected_location,
-        clearsky, cloud_cover, solar_pos['apparent_zenith'],
-        shadow_profile
-    )
-
-    # shall we manage cases where no 8xx weather is available and calculation cannot be done?
-
-    
-    # Compute POA irradiance
-    total_irradiance = irradiance.get_total_irradiance(
-        surface_tilt = selected_panel['tilt'],
-        surface_azimuth = selected_panel['azimuth'],
-        dni=dni_adj,
-        ghi=ghi_adj,
-        dhi=dhi_adj,
-        solar_zenith=solar_pos['apparent_zenith'],
-        solar_azimuth=solar_pos['azimuth']
-    )
-    
+        cloud_cover = np.nan  # Default to clear sky if API fails ########### mettere un NA e non mostrare il grafico
 
-    poa_irradiance = total_irradiance['poa_global']
+    cloud_cover_scenarios = pd.DataFrame({'cloud_cover': cloud_cover}, index=times)
 
-    # Compute power output
-    power_output = poa_irradiance * selected_panel['area'] * selected_panel['efficiency']  # Watts
+    power_output = calculate_power_output_for_scenarios(times, selected_location, selected_panel, shadow_profile, cloud_cover_scenarios)
 
-    return power_output
+    return power_output['cloud_cover']
 
 # ---  prepare data to be fed
 
@@ -0,0 +1,110 @@
+"""
+Accuracy and throughput of the solar position methods compared with SPA (nrel_numpy):
+
+    python solar_position_report.py [--year 2025] [--step 1min] [--methods ephemeris nrel_numba]
+
+nrel_numba is compared only when numba is installed. For each method: samples per second, max/mean error of elevation and azimuth (sun above the horizon)
+and the error of the clearsky daily energy of the standard panel.
+"""
+import argparse
+import time
+
+import pandas as pd
+import numpy as np
+
+from pvlib.location import Location
+
+from solar_calculation import SolarGeometryCache, SOLAR_POSITION_METHODS, AVAILABLE_SOLAR_POSITION_METHODS
+from solar_calculation import calculate_plant_power_output, parse_shadow_profile
+
+from config import ITALY_TIMEZONE, STANDARD_LOCATION_LATITUDE, STANDARD_LOCATION_LONGITUDE, STANDARD_LOCATION_ALTITUDE
+from config import STANDARD_PANEL_TILT, STANDARD_PANEL_AZIMUTH, STANDARD_PANEL_AREA, STANDARD_PANEL_EFFICIENCY
+from config import ANNUAL_STEP
+
+REFERENCE_METHOD = 'nrel_numpy'
+
+def _daily_clearsky_energy(times, location, panel, shadow_profile, geometry_cache, step):
+    cloud_cover_scenarios = pd.DataFrame({'clearsky': 0.0}, index=times)
+    power = calculate_plant_power_output(times, location, panel, shadow_profile, cloud_cover_scenarios,
+                                         geometry_cache=geometry_cache, daylight_only=False)[('clearsky', 'total')]
+    return power.groupby(times.date).sum() * pd.Timedelta(step).total_seconds() / 3600 / 1000  # kWh
+
+def compare_solar_position_methods(location, year, panel, shadow_profile, step=ANNUAL_STEP, methods=AVAILABLE_SOLAR_POSITION_METHODS):
+    """
+    Compares each method with SPA over one year.
+
+    - location, panel, shadow_profile: as for calculate_power_output
+    - year: year to simulate
+    - step: frequency of the time index
+    - methods: methods to compare (SPA is always computed as reference; 'nrel_numba' only with numba installed,
+      it switches pvlib's SPA module for the whole process while it runs)
+
+    Returns: DataFrame indexed by method with 'samples_per_s', 'speedup', elevation and azimuth errors (degrees),
+             'max_daily_energy_error_pct' and 'annual_energy_error_pct'
+    """
+
+    start = pd.Timestamp(year=year, month=1, day=1, tz=location.tz)
+    times = pd.date_range(start=start, end=start + pd.DateOffset(years=1), freq=step, inclusive='left')
+
+    results = {}
+    for method in dict.fromkeys((REFERENCE_METHOD,) + tuple(methods)):
+        # Una prima chiamata breve esclude dalla misura import e compilazione (numba)
+        SolarGeometryCache(maxsize=1, method=method).get_solarposition(location, times[:60])
+
+        geometry_cache = SolarGeometryCache(maxsize=3, method=method)
+        started_at = time.perf_counter()
+        solar_position = geometry_cache.get_solarposition(location, times)
+        elapsed = time.perf_counter() - started_at
+
+        results[method] = {
+            'solar_position': solar_position,
+            'elapsed': elapsed,
+            'daily_energy': _daily_clearsky_energy(times, location, panel, shadow_profile, geometry_cache, step)
+        }
+
+    reference = results[REFERENCE_METHOD]
+    above_horizon = reference['solar_position']['elevation'].to_numpy() > 0
+    report = {}
+    for method, result in results.items():
+        elevation_error = np.abs(result['solar_position']['apparent_elevation'].to_numpy()
+                                 - reference['solar_position']['apparent_elevation'].to_numpy())[above_horizon]
+        azimuth_error = np.abs(np.mod(result['solar_position']['azimuth'].to_numpy()
+                                      - reference['solar_position']['azimuth'].to_numpy() + 180, 360) - 180)[above_horizon]
+        daily_error = (result['daily_energy'] - reference['daily_energy']) / reference['daily_energy'].where(reference['daily_energy'] > 0)
+
+        report[method] = {
+            'samples_per_s': round(len(times) / result['elapsed']),
+            'speedup': round(reference['elapsed'] / result['elapsed'], 1),
+            'max_elevation_error': elevation_error.max(),
+            'mean_elevation_error': elevation_error.mean(),
+            'max_azimuth_error': azimuth_error.max(),
+            'mean_azimuth_error': azimuth_error.mean(),
+            'max_daily_energy_error_pct': 100 * daily_error.abs().max(),
+            'annual_energy_error_pct': 100 * (result['daily_energy'].sum() / reference['daily_energy'].sum() - 1)
+        }
+
+    return pd.DataFrame.from_dict(report, orient='index')
+
+#### Main function to run the report from command line ############
+
+def main():
+    parser = argparse.ArgumentParser(description="Accuratezza e velocità degli algoritmi di posizione solare rispetto a SPA")
+    parser.add_argument('--year', type=int, default=pd.Timestamp.now().year)
+    parser.add_argument('--step', default=ANNUAL_STEP)
+    parser.add_argument('--methods', nargs='*', choices=SOLAR_POSITION_METHODS, default=list(AVAILABLE_SOLAR_POSITION_METHODS))
+    parser.add_argument('--lat', type=float, default=STANDARD_LOCATION_LATITUDE)
+    parser.add_argument('--lon', type=float, default=STANDARD_LOCATION_LONGITUDE)
+    parser.add_argument('--alt', type=float, default=STANDARD_LOCATION_ALTITUDE)
+    parser.add_argument('--tz', default=ITALY_TIMEZONE)
+    args = parser.parse_args()
+
+    location = Location(args.lat, args.lon, altitude=args.alt, tz=args.tz)
+    shadow_profile = parse_shadow_profile()
+    panel = {'tilt': STANDARD_PANEL_TILT, 'azimuth': STANDARD_PANEL_AZIMUTH,
+             'area': STANDARD_PANEL_AREA, 'efficiency': STANDARD_PANEL_EFFICIENCY / 100.0}
+
+    report = compare_solar_position_methods(location, args.year, panel, shadow_profile, step=args.step, methods=args.methods)
+    print(report.to_string(float_format='{:.4f}'.format))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""
+Headless entry point (no Streamlit):
+
+    python solarpanels.py compute --date 2025-06-21 --step 1min [--weather] [--csv power.csv]
+    python solarpanels.py forecast [--days 4] [--step 15min]
+    python solarpanels.py fleet --sites sites.csv [--start 2025-06-21] [--days 4] [--workers 4] [--csv power.csv] [--dem dtm.flt]
+    python solarpanels.py energy --start 2025-01-01 --end 2026-01-01 [--step 1s] [--aggregate M] [--csv energy.csv]
+
+Secrets are read from the environment, a TOML file or Streamlit secrets (see config.get_secret),
+and only when a command needs them. pandas/pvlib are imported by the commands, so the CLI starts immediately.
+"""
+import argparse
+import datetime
+import json
+import sys
+
+from config import ITALY_TIMEZONE, STANDARD_LOCATION_LATITUDE, STANDARD_LOCATION_LONGITUDE, STANDARD_LOCATION_ALTITUDE
+from config import STANDARD_PANEL_TILT, STANDARD_PANEL_AZIMUTH, STANDARD_PANEL_AREA, STANDARD_PANEL_EFFICIENCY
+from config import STANDARD_STEP, FORECAST_STEP, FORECAST_DAYS
+from config import FLEET_STEP, FLEET_PROCESS_WORKERS
+from config import STREAM_STEP, STREAM_CHUNK_SIZE
+from config import MissingSecretError
+
+#### --- Shared inputs ---
+
+def _get_inputs(args):
+    from pvlib.location import Location
+
+    location = Location(args.lat, args.lon, altitude=args.alt, tz=args.tz, name='LocationPerCalcolo')
+
+    if args.horizon_file:
+        from solar_calculation import read_horizon_file
+        shadow_profile = read_horizon_file(args.horizon_file)
+    elif args.dem:
+        from horizon_dem import get_dem_horizon_profile
+        shadow_profile = get_dem_horizon_profile(args.dem, args.lat, args.lon)
+    else:
+        from solar_calculation import parse_shadow_profile
+        shadow_profile = parse_shadow_profile()
+
+    panel = {'tilt': args.tilt, 'azimuth': args.azimuth, 'area': args.area, 'efficiency': args.efficiency / 100.0}
+
+    return location, shadow_profile, panel
+
+def _get_weather_data(times, location):
+    from weather_checker import get_weather_data
+
+    # Past days come from the weather archive, without API calls
+    return get_weather_data(times, location.latitude, location.longitude, std_timezone=location.tz)
+
+#### --- Commands ---
+
+def compute(args):
+    import pandas as pd
+    from solar_calculation import calculate_plant_power_output, get_cloud_cover_scenarios, calculate_energy_for_times
+
+    location, shadow_profile, panel = _get_inputs(args)
+    selected_date = datetime.date.fromisoformat(args.date) if args.date else pd.Timestamp.now(tz=location.tz).date()
+    times = pd.date_range(start=selected_date, end=selected_date + datetime.timedelta(days=1), freq=args.step, tz=location.tz)
+
+    if args.weather:
+        weather_data = _get_weather_data(times, location)
+    else:
+        weather_data = {'times_cloud_cover': pd.DataFrame({'cloud_cover': []}, index=times[:0])}
+
+    cloud_cover_scenarios = get_cloud_cover_scenarios(times, weather_data)
+    power_data = calculate_plant_power_output(times, location, panel, shadow_profile, cloud_cover_scenarios)
+    clearsky_power_data = power_data[('clearsky', 'total')]
+    weather_power_data = power_data[('weather', 'total')]
+
+    result = {
+        'date': selected_date.isoformat(),
+        'step': args.step,
+        'clearsky_energy_kwh': calculate_energy_for_times(times, args.step, clearsky_power_data),
+        'clearsky_peak_w': round(float(clearsky_power_data.max()), 1)
+    }
+    if args.weather:
+        result['weather_energy_kwh'] = calculate_energy_for_times(times, args.step, weather_power_data)
+    print(json.dumps(result))
+
+    if args.csv:
+        pd.DataFrame({'clearsky_power': clearsky_power_data, 'weather_power': weather_power_data}).to_csv(args.csv, index_label='datetime')
+
+def forecast(args):
+    import pandas as pd
+    from production_engine import calculate_forecast_production
+
+    location, shadow_profile, panel = _get_inputs(args)
+    today = pd.Timestamp.now(tz=location.tz).normalize()
+    weather_data = _get_weather_data(pd.date_range(start=today, periods=2, freq=args.step), location)
+
+    forecast_data, daily_forecast_data = calculate_forecast_production(weather_data, location, panel, shadow_profile,
+                                                                       step=args.step, days=args.days)
+    if args.csv:
+        forecast_data.to_csv(args.csv, index=False)
+    print(daily_forecast_data.to_json(orient='records', date_format='iso'))
+
+def fleet(args):
+    import pandas as pd
+    from fleet_production import calculate_sites_production, calculate_sites_daily_energy
+
+    sites = pd.read_csv(args.sites)
+    if 'horizon_file' in sites.columns:
+        from solar_calculation import read_horizon_file
+        sites['shadow_profile'] = [read_horizon_file(path) if isinstance(path, str) else None for path in sites['horizon_file']]
+    if args.dem:
+        # Siti senza profilo: orizzonte calcolato dal DEM (in cache per sito)
+        from horizon_dem import get_dem_horizon_profile
+        shadow_profiles = sites['shadow_profile'] if 'shadow_profile' in sites.columns else [None] * len(sites)
+        sites['shadow_profile'] = [shadow_profile if shadow_profile is not None else get_dem_horizon_profile(args.dem, latitude, longitude)
+                                   for shadow_profile, latitude, longitude in zip(shadow_profiles, sites['latitude'], sites['longitude'])]
+
+    start = pd.Timestamp(args.start) if args.start else pd.Timestamp.now().normalize()
+    sites_production = calculate_sites_production(sites, start, start + pd.Timedelta(days=args.days),
+                                                  step=args.step, max_workers=args.workers)
+    if args.csv:
+        sites_production.to_csv(args.csv, index=False)
+    print(calculate_sites_daily_energy(sites_production, step=args.step).to_json(orient='records', date_format='iso'))
+
+def energy(args):
+    from energy_stream import integrate_energy
+
+    location, shadow_profile, panel = _get_inputs(args)
+    cloud_cover_scenarios = {'clearsky': 0.0}
+    if args.cloud_cover is not None:
+        cloud_cover_scenarios['weather'] = args.cloud_cover
+
+    totals, aggregates = integrate_energy(args.start, args.end, location, panel, shadow_profile, cloud_cover_scenarios,
+                                          step=args.step, aggregate=args.aggregate, chunk_size=args.chunk_size)
+    if args.csv and aggregates is not None:
+        aggregates.round(3).to_csv(args.csv, index_label='period')
+    print(json.dumps({'start': args.start, 'end': args.end, 'step': args.step,
+                      **{f'{scenario}_energy_kwh': round(float(value), 1) for scenario, value in totals.items()}}))
+
+#### Main function to run from command line ############
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='solarpanels', description="Calcolo produzione fotovoltaico senza interfaccia Streamlit")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--lat', type=float, default=STANDARD_LOCATION_LATITUDE)
+    common.add_argument('--lon', type=float, default=STANDARD_LOCATION_LONGITUDE)
+    common.add_argument('--alt', type=float, default=STANDARD_LOCATION_ALTITUDE)
+    common.add_argument('--tz', default=ITALY_TIMEZONE)
+    common.add_argument('--tilt', type=float, default=STANDARD_PANEL_TILT)
+    common.add_argument('--azimuth', type=float, default=STANDARD_PANEL_AZIMUTH)
+    common.add_argument('--area', type=float, default=STANDARD_PANEL_AREA)
+    common.add_argument('--efficiency', type=float, default=STANDARD_PANEL_EFFICIENCY, help="%%")
+    common.add_argument('--horizon-file', help="profilo orizzonte (azimut, elevazione)")
+    common.add_argument('--dem', help="DEM locale (.flt con .hdr) da cui calcolare il profilo orizzonte")
+    common.add_argument('--csv', help="file CSV per la serie di potenza")
+
+    compute_parser = commands.add_parser('compute', parents=[common], help="potenza ed energia di un giorno")
+    compute_parser.add_argument('--date', help="YYYY-MM-DD (default: oggi)")
+    compute_parser.add_argument('--step', default=STANDARD_STEP)
+    compute_parser.add_argument('--weather', action='store_true', help="usa meteo OpenWeather (richiede om_api_key)")
+    compute_parser.set_defaults(handler=compute)
+
+    forecast_parser = commands.add_parser('forecast', parents=[common], help="produzione prevista per i prossimi giorni")
+    forecast_parser.add_argument('--days', type=int, default=FORECAST_DAYS)
+    forecast_parser.add_argument('--step', default=FORECAST_STEP)
+    forecast_parser.set_defaults(handler=forecast)
+
+    # I siti hanno posizione e impianto propri: solo le opzioni di calcolo
+    fleet_parser = commands.add_parser('fleet', help="produzione di molti siti (tabella CSV)")
+    fleet_parser.add_argument('--sites', required=True,
+                              help="CSV con site_id, latitude, longitude, altitude, tz, tilt, azimuth, area, efficiency "
+                                   "[, cloud_cover, horizon_file]")
+    fleet_parser.add_argument('--start', help="YYYY-MM-DD (default: oggi), nel fuso orario di ogni sito")
+    fleet_parser.add_argument('--days', type=int, default=FORECAST_DAYS)
+    fleet_parser.add_argument('--step', default=FLEET_STEP)
+    fleet_parser.add_argument('--workers', type=int, default=FLEET_PROCESS_WORKERS)
+    fleet_parser.add_argument('--csv', help="file CSV per la serie di potenza (formato lungo)")
+    fleet_parser.add_argument('--dem', help="DEM locale (.flt con .hdr) per i siti senza horizon_file")
+    fleet_parser.set_defaults(handler=fleet)
+
+    energy_parser = commands.add_parser('energy', parents=[common], help="energia su un intervallo lungo, calcolata a blocchi")
+    energy_parser.add_argument('--start', required=True, help="YYYY-MM-DD")
+    energy_parser.add_argument('--end', required=True, help="YYYY-MM-DD (escluso)")
+    energy_parser.add_argument('--step', default=STREAM_STEP)
+    energy_parser.add_argument('--cloud-cover', type=float, help="nuvolosità costante (%%) per lo scenario 'weather'")
+    energy_parser.add_argument('--aggregate', choices=['D', 'M'], help="energia per giorno o per mese (per --csv)")
+    energy_parser.add_argument('--chunk-size', type=int, default=STREAM_CHUNK_SIZE, help="campioni per blocco")
+    energy_parser.set_defaults(handler=energy)
+
+    args = parser.parse_args(argv)
+    try:
+        args.handler(args)
+    except MissingSecretError as error:
+        print(error.args[0] if error.args else error, file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
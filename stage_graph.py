@@ -0,0 +1,121 @@
+import datetime
+
+import pandas as pd
+import numpy as np
+
+from solar_calculation import get_cloud_cover_scenarios, calculate_plant_power_output, calculate_energy_for_times
+from production_engine import calculate_forecast_production
+from lru_cache import LRUCache
+
+STAGE_CACHE_SIZE = 32
+
+#### --- Fingerprint of the stage inputs ---
+
+def input_key(value):
+    """Hashable fingerprint of a stage input (DataFrame/Series content, HorizonProfile, pvlib Location, nested dict/list, scalars)."""
+
+    if isinstance(value, pd.DatetimeIndex):
+        return ('DatetimeIndex', str(value.tz), hash(value.as_unit('ns').asi8.tobytes()))
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        columns = tuple(value.columns) if isinstance(value, pd.DataFrame) else value.name
+        return (type(value).__name__, columns, hash(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes()))
+    if isinstance(value, dict):
+        return tuple(sorted((name, input_key(item)) for name, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(input_key(item) for item in value)
+    if isinstance(value, np.ndarray):
+        return (value.shape, str(value.dtype), hash(value.tobytes()))
+    if hasattr(value, 'table') and hasattr(value, 'resolution'):
+        # solar_calculation.HorizonProfile: la tabella compilata identifica il profilo
+        return ('horizon', value.resolution, hash(value.table.tobytes()))
+    if hasattr(value, 'latitude') and hasattr(value, 'longitude'):
+        return ('location', value.latitude, value.longitude, value.altitude, str(value.tz))
+    return value
+
+#### --- Dependency graph of memoized stages ---
+
+class StageGraph:
+    """
+    Stages of the daily computation with their dependencies.
+
+    A stage declares the inputs it reads and the upstream stages it uses; its result is cached on the
+    fingerprint of those inputs plus the keys of the upstream stages. Changing an input invalidates only
+    the stages downstream of it: with the same date, location, panel, shadow profile and weather snapshot,
+    a rerun (e.g. a new time of day) is a lookup of the cached daily series.
+    """
+
+    def __init__(self, maxsize=STAGE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._stages = {}
+        self._results = LRUCache(maxsize)
+
+    # Totali della cache dei risultati (ogni lookup è registrato anche sulla fase perf_trace del chiamante)
+    @property
+    def hits(self):
+        return self._results.hits
+
+    @property
+    def misses(self):
+        return self._results.misses
+
+    def add_stage(self, name, function, inputs=(), upstream=()):
+        """function is called with the declared inputs and upstream results as keyword arguments."""
+        self._stages[name] = (function, tuple(inputs), tuple(upstream))
+
+    def run(self, name, inputs):
+        """
+        Result of stage name, computing it (and its upstream stages) only if not already cached.
+
+        - inputs: dictionary with at least the inputs declared by the stage and its upstream stages
+        """
+
+        fingerprints = {}
+        keys = {}
+
+        def stage_key(stage_name):
+            if stage_name not in keys:
+                _, stage_inputs, upstream = self._stages[stage_name]
+                for input_name in stage_inputs:
+                    if input_name not in fingerprints:
+                        fingerprints[input_name] = input_key(inputs[input_name])
+                keys[stage_name] = (stage_name,
+                                    tuple(fingerprints[input_name] for input_name in stage_inputs),
+                                    tuple(stage_key(upstream_name) for upstream_name in upstream))
+            return keys[stage_name]
+
+        def compute(stage_name):
+            def compute_stage():
+                function, stage_inputs, upstream = self._stages[stage_name]
+                arguments = {input_name: inputs[input_name] for input_name in stage_inputs}
+                arguments.update({upstream_name: compute(upstream_name) for upstream_name in upstream})
+                return function(**arguments)
+
+            return self._results.get_or_compute(stage_key(stage_name), compute_stage)
+
+        return compute(name)
+
+    def clear(self):
+        self._results.clear()
+
+#### --- Stages of main.main() ---
+
+def _times_stage(date, location, step):
+    return pd.date_range(start=date, end=date + datetime.timedelta(days=1), freq=step, tz=location.tz)
+
+def _plant_power_stage(times, location, panel, shadow_profile, weather):
+    # Clearsky and weather scenarios of all the arrays share solar position, shadow mask and transposition in a single pass
+    cloud_cover_scenarios = get_cloud_cover_scenarios(times, weather)
+    return calculate_plant_power_output(times, location, panel, shadow_profile, cloud_cover_scenarios)
+
+def _daily_energy_stage(times, step, plant_power):
+    return (calculate_energy_for_times(times, step, plant_power[('clearsky', 'total')]),
+            calculate_energy_for_times(times, step, plant_power[('weather', 'total')]))
+
+def _forecast_stage(location, panel, shadow_profile, weather):
+    return calculate_forecast_production(weather, location, panel, shadow_profile)
+
+daily_stages = StageGraph()
+daily_stages.add_stage('times', _times_stage, inputs=('date', 'location', 'step'))
+daily_stages.add_stage('plant_power', _plant_power_stage, inputs=('location', 'panel', 'shadow_profile', 'weather'), upstream=('times',))
+daily_stages.add_stage('daily_energy', _daily_energy_stage, inputs=('step',), upstream=('times', 'plant_power'))
+daily_stages.add_stage('forecast', _forecast_stage, inputs=('location', 'panel', 'shadow_profile', 'weather'))
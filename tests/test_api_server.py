@@ -0,0 +1,115 @@
+"""
+SolarApi against local stand-ins (no OpenWeather, Shelly or weather archive):
+
+    python -m unittest discover tests
+"""
+import json
+import os
+import sys
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import api_server
+from api_server import SolarApi
+
+class StandInWeather:
+    """OpenWeather responses built around the current time, counting the calls."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def get_current_weather(self, lat, lon, api_key=None):
+        self.calls += 1
+        return {'dt': int(time.time()) // 600 * 600, 'clouds': {'all': 40},
+                'weather': [{'id': 802, 'description': 'nubi sparse', 'icon': '03d'}]}
+
+    def get_forecast(self, lat, lon, api_key=None):
+        self.calls += 1
+        first = int(time.time()) // 10800 * 10800 + 10800
+        return {'list': [{'dt': first + index * 10800, 'clouds': {'all': (index * 17) % 100},
+                          'weather': [{'id': 803, 'description': 'nubi', 'icon': '04d'}]} for index in range(40)]}
+
+class SolarApiTest(unittest.TestCase):
+
+    def setUp(self):
+        self.weather = StandInWeather()
+        self.api = SolarApi(weather_client=self.weather, home_power=lambda: (1200.0, 300.0), archive=False,
+                            power_bucket=60, weather_bucket=600)
+
+    def get(self, path, query='', if_none_match=None):
+        status, headers, body = self.api.handle(path, query, if_none_match=if_none_match)
+        return status, headers, json.loads(body) if body else None
+
+    def test_health(self):
+        self.assertEqual(self.get('/health')[0], 200)
+
+    def test_energy_document(self):
+        status, headers, document = self.get('/energy')
+        self.assertEqual(status, 200)
+        self.assertEqual(headers['Content-Type'], 'application/json')
+        self.assertIn('ETag', headers)
+        self.assertGreater(document['clearsky_energy_kwh'], 0)
+
+    def test_power_uses_home_power_stand_in(self):
+        status, _, document = self.get('/power')
+        self.assertEqual(status, 200)
+        self.assertEqual(document['home_pv_power'], 1200.0)
+        self.assertEqual(document['network_power'], 300.0)
+
+    def test_same_bucket_is_cached(self):
+        _, first_headers, first = self.get('/energy', 'date=2025-06-21')
+        calls = self.weather.calls
+        _, second_headers, second = self.get('/energy', 'date=2025-06-21')
+        self.assertEqual(first, second)
+        self.assertEqual(first_headers['ETag'], second_headers['ETag'])
+        self.assertEqual(self.weather.calls, calls)
+        self.assertEqual((self.api.hits, self.api.misses), (1, 1))
+
+    def test_query_order_does_not_matter(self):
+        self.get('/energy', 'date=2025-06-21&tilt=30')
+        self.get('/energy', 'tilt=30&date=2025-06-21')
+        self.assertEqual((self.api.hits, self.api.misses), (1, 1))
+
+    def test_if_none_match_returns_304(self):
+        _, headers, _ = self.get('/energy')
+        status, not_modified_headers, body = self.get('/energy', if_none_match=headers['ETag'])
+        self.assertEqual(status, 304)
+        self.assertIsNone(body)
+        self.assertEqual(not_modified_headers['ETag'], headers['ETag'])
+        self.assertEqual(self.get('/energy', if_none_match='"other"')[0], 200)
+
+    def test_bucket_expiry_recomputes(self):
+        now = 1_750_000_000.0 // 600 * 600
+        with mock.patch.object(api_server.time, 'time', return_value=now):
+            _, headers, _ = self.get('/energy', 'date=2025-06-21')
+        self.assertEqual(headers['Cache-Control'], 'max-age=600')
+
+        with mock.patch.object(api_server.time, 'time', return_value=now + 599):
+            self.get('/energy', 'date=2025-06-21')
+        self.assertEqual((self.api.hits, self.api.misses), (1, 1))
+
+        with mock.patch.object(api_server.time, 'time', return_value=now + 600):
+            _, expired_headers, _ = self.get('/energy', 'date=2025-06-21')
+        self.assertEqual((self.api.hits, self.api.misses), (1, 2))
+        # Stesso risultato nel nuovo intervallo: stesso ETag, il poller continua a ricevere 304
+        self.assertEqual(expired_headers['ETag'], headers['ETag'])
+
+    def test_bad_requests(self):
+        for path, query in [('/energy', 'lat=abc'), ('/daily', 'step=1s'), ('/daily', 'step=abc'),
+                            ('/energy', 'date=21-06-2025')]:
+            with self.subTest(path=path, query=query):
+                status, _, document = self.get(path, query)
+                self.assertEqual(status, 400)
+                self.assertIn('error', document)
+        self.assertEqual(self.get('/unknown')[0], 404)
+
+    def test_errors_are_not_cached(self):
+        self.get('/energy', 'lat=abc')
+        self.get('/energy', 'lat=abc')
+        self.assertEqual((self.api.hits, self.api.misses), (0, 2))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,172 @@
+"""
+FetchCoordinator single-flight, token bucket and stale serving, with stand-in fetch functions:
+
+    python -m unittest discover tests
+"""
+import os
+import sys
+import threading
+import time
+import unittest
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fetch_coordinator import FetchCoordinator, RateLimitedError, TokenBucket
+
+class BlockingFetch:
+    """Fetch function that blocks until released, counting the calls."""
+
+    def __init__(self, result='fresh'):
+        self.result = result
+        self.calls = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self):
+        self.calls += 1
+        self.started.set()
+        self.release.wait(5)
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+def call_in_thread(coordinator, key, function, allow_stale=True):
+    outcome = {}
+
+    def run():
+        try:
+            outcome['result'] = coordinator.call(key, function, allow_stale=allow_stale)
+        except Exception as error:
+            outcome['error'] = error
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread, outcome
+
+def let_followers_join():
+    # I chiamanti successivi si fermano su future.result() del volo in corso
+    time.sleep(0.1)
+
+class TokenBucketTest(unittest.TestCase):
+
+    def test_burst_then_timeout(self):
+        bucket = TokenBucket(rate=1.0, capacity=2)
+        self.assertTrue(bucket.acquire(timeout=0))
+        self.assertTrue(bucket.acquire(timeout=0))
+        self.assertFalse(bucket.acquire(timeout=0.1))
+
+    def test_waits_for_the_next_token(self):
+        bucket = TokenBucket(rate=20.0, capacity=1)
+        bucket.acquire()
+        started_at = time.monotonic()
+        self.assertTrue(bucket.acquire(timeout=1))
+        self.assertGreaterEqual(time.monotonic() - started_at, 0.03)
+
+class FetchCoordinatorTest(unittest.TestCase):
+
+    def test_concurrent_calls_are_coalesced(self):
+        coordinator = FetchCoordinator('test', rate=100.0)
+        fetch = BlockingFetch()
+        leader, leader_outcome = call_in_thread(coordinator, 'device', fetch)
+        fetch.started.wait(2)
+        followers = [call_in_thread(coordinator, 'device', fetch) for _ in range(3)]
+        let_followers_join()
+        fetch.release.set()
+        for thread, _ in [(leader, leader_outcome)] + followers:
+            thread.join(2)
+
+        self.assertEqual(fetch.calls, 1)
+        self.assertEqual([outcome['result'] for _, outcome in followers], ['fresh'] * 3)
+        self.assertEqual((coordinator.fetches, coordinator.coalesced), (1, 3))
+
+    def test_stale_callers_join_a_fresh_only_flight(self):
+        coordinator = FetchCoordinator('test', rate=100.0)
+        fetch = BlockingFetch()
+        collector, collector_outcome = call_in_thread(coordinator, 'device', fetch, allow_stale=False)
+        fetch.started.wait(2)
+        dashboard, dashboard_outcome = call_in_thread(coordinator, 'device', fetch, allow_stale=True)
+        let_followers_join()
+        fetch.release.set()
+        collector.join(2)
+        dashboard.join(2)
+
+        self.assertEqual(fetch.calls, 1)
+        self.assertEqual(collector_outcome['result'], 'fresh')
+        self.assertEqual(dashboard_outcome['result'], 'fresh')
+
+    def test_fresh_only_caller_rejects_a_stale_flight(self):
+        coordinator = FetchCoordinator('test', rate=100.0, max_stale=60.0)
+        coordinator.call('device', lambda: 'old')
+        fetch = BlockingFetch(result=requests.ConnectionError('down'))
+        dashboard, dashboard_outcome = call_in_thread(coordinator, 'device', fetch, allow_stale=True)
+        fetch.started.wait(2)
+        collector, collector_outcome = call_in_thread(coordinator, 'device', lambda: 'new', allow_stale=False)
+        let_followers_join()
+        fetch.release.set()
+        dashboard.join(2)
+        collector.join(2)
+
+        self.assertEqual(dashboard_outcome['result'], 'old')
+        self.assertEqual(collector_outcome['result'], 'new')
+
+    def test_stale_caller_uses_last_good_when_shared_call_fails(self):
+        coordinator = FetchCoordinator('test', rate=100.0, max_stale=60.0)
+        coordinator.call('device', lambda: 'old')
+        fetch = BlockingFetch(result=requests.ConnectionError('down'))
+        collector, collector_outcome = call_in_thread(coordinator, 'device', fetch, allow_stale=False)
+        fetch.started.wait(2)
+        dashboard, dashboard_outcome = call_in_thread(coordinator, 'device', fetch, allow_stale=True)
+        let_followers_join()
+        fetch.release.set()
+        collector.join(2)
+        dashboard.join(2)
+
+        self.assertIsInstance(collector_outcome['error'], requests.ConnectionError)
+        self.assertEqual(dashboard_outcome['result'], 'old')
+
+    def test_rate_limited_serves_last_good_within_max_wait(self):
+        coordinator = FetchCoordinator('test', rate=0.01, max_wait=0.05, timeout=0.1, max_stale=60.0)
+        self.assertEqual(coordinator.call('device', lambda: 'first'), 'first')
+
+        started_at = time.monotonic()
+        self.assertEqual(coordinator.call('device', lambda: 'second'), 'first')
+        self.assertLess(time.monotonic() - started_at, 0.5)
+        self.assertEqual((coordinator.fetches, coordinator.stale_served), (1, 1))
+
+        with self.assertRaises(RateLimitedError):
+            coordinator.call('device', lambda: 'second', allow_stale=False)
+
+    def test_rate_limited_without_last_good_raises(self):
+        coordinator = FetchCoordinator('test', rate=0.01, max_wait=0.05, timeout=0.1)
+        coordinator.call('device', lambda: 'first')
+        with self.assertRaises(RateLimitedError):
+            coordinator.call('other', lambda: 'second')
+
+    def test_failure_and_invalid_response_serve_last_good(self):
+        coordinator = FetchCoordinator('test', rate=100.0, max_stale=60.0, is_valid=lambda result: result is not False)
+        coordinator.call('device', lambda: 'good')
+
+        def failing():
+            raise requests.Timeout('slow')
+
+        self.assertEqual(coordinator.call('device', failing), 'good')
+        self.assertEqual(coordinator.call('device', lambda: False), 'good')
+        self.assertFalse(coordinator.call('device', lambda: False, allow_stale=False))
+        with self.assertRaises(requests.Timeout):
+            coordinator.call('device', failing, allow_stale=False)
+
+    def test_last_good_expires_after_max_stale(self):
+        coordinator = FetchCoordinator('test', rate=100.0, max_stale=0.05)
+        coordinator.call('device', lambda: 'good')
+        time.sleep(0.1)
+
+        def failing():
+            raise requests.ConnectionError('down')
+
+        with self.assertRaises(requests.ConnectionError):
+            coordinator.call('device', failing)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,51 @@
+"""
+HorizonProfile lookup across north (0/360°) and PVGIS horizon files (0° = South):
+
+    python -m unittest discover tests
+"""
+import io
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from solar_calculation import HorizonProfile, parse_shadow_profile, read_horizon_file
+
+# Export orizzonte PVGIS: azimut da -180° a 180° ogni 7.5°, 0° = Sud, nord ripetuto ai due estremi
+PVGIS_NORTH_ELEVATIONS = {-180.0: 20.0, -172.5: 16.0, 172.5: 12.0, 180.0: 20.0}
+PVGIS_HORIZON = ("Latitude (decimal degrees):\t45.000\nLongitude (decimal degrees):\t9.000\n\nA\tH_hor\n"
+                 + "".join(f"{azimuth:.1f}\t{PVGIS_NORTH_ELEVATIONS.get(azimuth, 5.0):.1f}\n"
+                           for azimuth in np.arange(-180, 180.1, 7.5))
+                 + "\nA: Azimuth (0 = S, 90 = W, -90 = E) (degree)\nH_hor: Horizon height (degree)\n")
+
+class HorizonProfileTest(unittest.TestCase):
+
+    def test_inline_profile_wraps_around_north(self):
+        # Il segmento tra 350° (4°) e 10° (8°) attraversa il nord
+        horizon = HorizonProfile.from_shadow_profile(parse_shadow_profile("10,90,180,270,350", "8,0,0,0,4"))
+        np.testing.assert_allclose(horizon.elevation_at([359.95, 0.05, 0.0, 360.0]),
+                                   [4 + 4 * 9.95 / 20, 4 + 4 * 10.05 / 20, 6.0, 6.0])
+
+    def test_profile_with_explicit_north_points(self):
+        horizon = HorizonProfile([0, 180, 360], [10, 0, 30])
+        np.testing.assert_allclose(horizon.elevation_at([359.95, 0.05]), [30 - 30 * 0.05 / 180, 10 - 10 * 0.05 / 180])
+
+    def test_pvgis_file_is_converted_to_north_zero(self):
+        shadow_profile = read_horizon_file(io.StringIO(PVGIS_HORIZON), south_zero=True)
+
+        self.assertEqual(len(shadow_profile), 48)
+        self.assertFalse(shadow_profile['Azimuth'].duplicated().any())
+        self.assertEqual(shadow_profile['Azimuth'].iloc[0], 0.0)
+        self.assertEqual(shadow_profile['Azimuth'].iloc[-1], 352.5)
+        self.assertEqual(shadow_profile['Elevation'].iloc[0], 20.0)
+
+        # 352.5° (PVGIS 172.5°) = 12°, 0° (PVGIS ±180°) = 20°, 7.5° (PVGIS -172.5°) = 16°
+        horizon = HorizonProfile.from_shadow_profile(shadow_profile)
+        np.testing.assert_allclose(horizon.elevation_at([359.95, 0.05, 180.0]),
+                                   [12 + 8 * 7.45 / 7.5, 20 - 4 * 0.05 / 7.5, 5.0])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -9,6 +9,14 @@ from config import ITALY_TIMEZONE, STANDARD_LOCATION_LATITUDE, STANDARD_LOCATION
 from config import STANDARD_SHADOW_AZIMUTHS, STANDARD_SHADOWS_ELEVATIONS
 from config import STANDARD_PANEL_TILT, STANDARD_PANEL_AZIMUTH, STANDARD_PANEL_AREA, STANDARD_PANEL_EFFICIENCY
 
+from config import PERF_PANEL_ENABLED
+from config import DEM_FILE, STANDARD_APPLIANCES
+from solar_calculation import read_horizon_file, parse_shadow_profile
+from horizon_dem import get_dem_horizon_profile
+from load_scheduler import parse_appliances
+from perf_trace import annotate_stage
+from chart_downsampling import downsample_frame
+
 ### ---- Default Values ----------------------------------------------------
 tz = timezone(ITALY_TIMEZONE)  
 current_datetime = datetime.datetime.now(tz)
@@ -54,7 +62,9 @@ def get_selected_location(std_latitude=STANDARD_LOCATION_LATITUDE,
 
 #### ---- Get Shadow Profile ----------------------------------------------------
 def get_shadow_profile(std_shadow_azimuths=STANDARD_SHADOW_AZIMUTHS,
-                       std_shadow_elevations=STANDARD_SHADOWS_ELEVATIONS):
+                       std_shadow_elevations=STANDARD_SHADOWS_ELEVATIONS,
+                       location=None,
+                       std_dem_file=DEM_FILE):
     st.sidebar.header("🌑 Profilo Ombra")
     shadow_azimuths = st.sidebar.text_area(
         "Inserisci valori di azimut (separati da virgola):", std_shadow_azimuths
@@ -63,14 +73,31 @@ def get_shadow_profile(std_shadow_azimuths=STANDARD_SHADOW_AZIMUTHS,
         "Inserisci valori di elevazione (separati da virgola):", std_shadow_elevations
     )
 
+    # Profilo dettagliato (rilievo o export PVGIS) con migliaia di punti, in alternativa ai valori manuali
+    horizon_file = st.sidebar.file_uploader("Oppure carica un profilo (azimut, elevazione):", type=["csv", "txt"])
+    south_zero = st.sidebar.checkbox("Azimut con 0° = Sud (export PVGIS)", value=False)
+
+    # Profilo calcolato dal modello del terreno (o degli edifici) locale, per la posizione selezionata
+    dem_file = st.sidebar.text_input("Oppure un DEM locale (.flt con .hdr):", std_dem_file or "") if location is not None else ""
+
     try:
-        shadow_azimuths = list(map(float, shadow_azimuths.split(",")))
-        shadow_elevations = list(map(float, shadow_elevations.split(",")))
-        shadow_profile = pd.DataFrame({"Azimuth": shadow_azimuths, "Elevation": shadow_elevations}).sort_values(by="Azimuth")
+        if horizon_file is not None:
+            shadow_profile = read_horizon_file(horizon_file, south_zero=south_zero)
+            if shadow_profile.empty:
+                raise ValueError("empty horizon profile")
+        elif dem_file:
+            try:
+                shadow_profile = get_dem_horizon_profile(dem_file, location.latitude, location.longitude)
+            except (OSError, KeyError, ValueError) as error:
+                st.error(f"Errore: profilo dal DEM non disponibile ({error}).")
+                st.stop()
+        else:
+            shadow_profile = parse_shadow_profile(shadow_azimuths, shadow_elevations)
     except ValueError:
         st.error("Errore: inserire valori numerici validi per il profilo ombra.")
         st.stop()
 
+
     st.sidebar.line_chart(shadow_profile.set_index("Azimuth")[["Elevation"]])
     return shadow_profile
 
@@ -78,15 +105,64 @@ def get_shadow_profile(std_shadow_azimuths=STANDARD_SHADOW_AZIMUTHS,
 def get_solar_panel(std_panel_tilt=STANDARD_PANEL_TILT,
                     std_panel_azimuth=STANDARD_PANEL_AZIMUTH,
                     std_panel_area=STANDARD_PANEL_AREA,
-                    std_panel_efficiency=STANDARD_PANEL_EFFICIENCY):
+                    std_panel_efficiency=STANDARD_PANEL_EFFICIENCY,
+                    std_array_count=1):
     st.sidebar.header("🔋 Configurazione PV")
-    panel = {
-        'tilt': st.sidebar.slider("Inclinazione del pannello (°)", 0, 90, std_panel_tilt),
-        'azimuth': st.sidebar.slider("Azimut del pannello (°)", 0, 360, std_panel_azimuth),
-        'area': st.sidebar.number_input("Area del pannello (m²)", value = std_panel_area),
-        'efficiency': st.sidebar.slider("Efficienza del pannello (%)", 0.0, 100.0, std_panel_efficiency) / 100.0
-    }
-    return panel
+    array_count = int(st.sidebar.number_input("Numero di falde", min_value=1, max_value=8, value=std_array_count, step=1))
+
+    # Una falda per orientamento (es. est/ovest, più tetti), ognuna con il proprio profilo ombra opzionale
+    panels = []
+    for number in range(1, array_count + 1):
+        container = st.sidebar if array_count == 1 else st.sidebar.expander(f"Falda {number}", expanded=(number == 1))
+        panel = {
+            'name': f'Falda {number}',
+            'tilt': container.slider("Inclinazione del pannello (°)", 0, 90, std_panel_tilt, key=f"panel_tilt_{number}"),
+            'azimuth': container.slider("Azimut del pannello (°)", 0, 360, std_panel_azimuth, key=f"panel_azimuth_{number}"),
+            'area': container.number_input("Area del pannello (m²)", value = std_panel_area, key=f"panel_area_{number}"),
+            'efficiency': container.slider("Efficienza del pannello (%)", 0.0, 100.0, std_panel_efficiency, key=f"panel_efficiency_{number}") / 100.0
+        }
+
+        if array_count > 1 and container.checkbox("Profilo ombra specifico", key=f"panel_shadow_{number}"):
+            shadow_azimuths = container.text_input("Azimut (separati da virgola):", STANDARD_SHADOW_AZIMUTHS, key=f"panel_shadow_azimuths_{number}")
+            shadow_elevations = container.text_input("Elevazione (separati da virgola):", STANDARD_SHADOWS_ELEVATIONS, key=f"panel_shadow_elevations_{number}")
+            try:
+                panel['shadow_profile'] = parse_shadow_profile(shadow_azimuths, shadow_elevations)
+            except ValueError:
+                st.error(f"Errore: inserire valori numerici validi per il profilo ombra della falda {number}.")
+                st.stop()
+
+        panels.append(panel)
+
+    return panels
+
+#### ---- Get Deferrable Appliances ----------------------------------------------------
+def get_appliances(std_appliances=STANDARD_APPLIANCES):
+    st.sidebar.header("🧺 Elettrodomestici programmabili")
+    appliances = st.sidebar.text_area(
+        "Nome, durata (min), potenza (W), dalle, alle (separati da punto e virgola):", std_appliances
+    )
+
+    try:
+        return parse_appliances(appliances)
+    except ValueError:
+        st.error("Errore: ogni elettrodomestico richiede nome, durata, potenza e finestra oraria (HH:MM).")
+        st.stop()
+
+def _plotly_chart(fig):
+    # Il numero di punti inviati al browser è il payload della fase di rendering
+    annotate_stage(chart_points=sum(len(trace.x) for trace in fig.data if trace.x is not None))
+    st.plotly_chart(fig, use_container_width=True)
+
+def _daily_chart_window(selected_date):
+    # Finestra visibile dei grafici giornalieri: i dati al suo interno sono ricampionati al budget di punti
+    start_time, end_time = st.slider("Finestra oraria", value=(datetime.time(6, 0), datetime.time(22, 0)),
+                                     step=datetime.timedelta(minutes=15), key="daily_chart_window")
+    return pd.Timestamp(f"{selected_date} {start_time}"), pd.Timestamp(f"{selected_date} {end_time}")
+
+def _window_rows(data, window_start, window_end, x=None):
+    # Confronto sull'ora locale (naive), come il range dell'asse x
+    x_values = (data.index if x is None else pd.DatetimeIndex(data[x])).tz_localize(None)
+    return data[(x_values >= window_start) & (x_values <= window_end)]
 
 #### ---- Render Output Data con 4 Tabs ----------------------------------------------------
 def render_ui_modern_with_tabs(selected_datetime, 
@@ -100,7 +176,12 @@ def render_ui_modern_with_tabs(selected_datetime,
                                home_pv_power, 
                                network_power,
                                forecast_data,      # DataFrame con previsioni per i prossimi 4 giorni
-                               monthly_data):      # DataFrame con dati aggregati dei 12 mesi
+                               monthly_data,       # DataFrame con dati aggregati dei 12 mesi
+                               daily_forecast_data=None, # DataFrame con energia giornaliera prevista
+                               arrays_power_data=None,   # DataFrame con potenza (meteo) per falda
+                               home_power_history=None,  # DataFrame con i campioni Shelly delle ultime 24 ore
+                               appliance_schedule=None,  # DataFrame con gli avvii consigliati degli elettrodomestici
+                               house_load=None):         # Carico della casa (W) usato per la programmazione
 
     # Titolo principale della dashboard
     st.title("☀️ Solar & Weather Dashboard")
@@ -147,14 +228,24 @@ def render_ui_modern_with_tabs(selected_datetime,
                 st.error(f"❌ Dati di forecast disponibili solo fino al {max_forecast_datetime.date()} alle {max_forecast_datetime.time()}")
             else:
                 selected_time_weather = weather_data['times_cloud_cover'].loc[selected_datetime]
-                icon_url = f"https://openweathermap.org/img/wn/{selected_time_weather['weather_icon']}@2x.png"
                 #col_icon, col_desc = st.columns([1, 3])
-                with col2:
-                    st.image(icon_url, width=60)
-                with col3:
-                    st.metric(label="Condizione", value=selected_time_weather['weather_description'])
-                    if int(selected_time_weather['weather_code'] / 100) == 8:
-                        st.info(f"☁️ Copertura Nuvolosa: {int(selected_time_weather['cloud_cover'])}%")
+                # Senza il meteo attuale (richiesta fallita) i campioni prima del primo forecast non hanno codice né icona
+                if pd.isna(selected_time_weather['weather_code']):
+                    with col2:
+                        st.metric(label="Condizione", value="n.d.")
+                    with col3:
+                        if pd.isna(selected_time_weather['cloud_cover']):
+                            st.warning("💡 Dati meteo non disponibili")
+                        else:
+                            st.info(f"☁️ Copertura Nuvolosa: {int(selected_time_weather['cloud_cover'])}%")
+                else:
+                    icon_url = f"https://openweathermap.org/img/wn/{selected_time_weather['weather_icon']}@2x.png"
+                    with col2:
+                        st.image(icon_url, width=60)
+                    with col3:
+                        st.metric(label="Condizione", value=selected_time_weather['weather_description'])
+                        if int(selected_time_weather['weather_code'] / 100) == 8:
+                            st.info(f"☁️ Copertura Nuvolosa: {int(selected_time_weather['cloud_cover'])}%")
 
         st.divider()
         
@@ -184,6 +275,10 @@ def render_ui_modern_with_tabs(selected_datetime,
                 col1.metric(label="Totale", value=f"{home_usage} W")
                 col2.metric(label="Network Input", value=f"{int(network_power)} W")
                 col3.metric(label="PV Input", value=f"{int(home_pv_power)} W")
+
+            if home_power_history is not None and not home_power_history.empty:
+                st.markdown("#### Ultime 24 ore")
+                st.line_chart(home_power_history.rename(columns={'pv_power': 'PV Input', 'network_power': 'Network Input'}))
     
     # ==========================
     # Tab 2: Dati Giornalieri
@@ -210,6 +305,9 @@ def render_ui_modern_with_tabs(selected_datetime,
         st.markdown("### Andamento dell’Output di Potenza Durante la Giornata")
         date_power_output = pd.concat([clearsky_power_energy_data, weather_power_energy_data], axis=1)
         date_power_output.columns = ['ClearSky Power', 'Weather Power']
+        window_start, window_end = _daily_chart_window(selected_datetime.date())
+        date_power_output = downsample_frame(_window_rows(date_power_output, window_start, window_end),
+                                             columns=['ClearSky Power', 'Weather Power'])
         fig = px.line(
             date_power_output,
             x=date_power_output.index,
@@ -223,52 +321,110 @@ def render_ui_modern_with_tabs(selected_datetime,
             margin=dict(l=20, r=20, t=30, b=30)
         )
         fig.update_xaxes(
-            range=[
-                pd.Timestamp(f"{selected_datetime.date()} 06:00"),
-                pd.Timestamp(f"{selected_datetime.date()} 22:00")
-            ],
+            range=[window_start, window_end],
             tickformat='%H:%M'
         )
-        st.plotly_chart(fig, use_container_width=True)
+        _plotly_chart(fig)
+
+        # Grafico della Produzione per Falda (solo impianti con più falde)
+        if arrays_power_data is not None and arrays_power_data.shape[1] > 1:
+            st.markdown("### Potenza per Falda")
+            arrays_power_data = downsample_frame(_window_rows(arrays_power_data, window_start, window_end),
+                                                 columns=list(arrays_power_data.columns))
+            fig_arrays = px.line(
+                arrays_power_data,
+                x=arrays_power_data.index,
+                y=list(arrays_power_data.columns),
+                labels={'x': 'Orario', 'value': 'Potenza (W)', 'variable': 'Falda'}
+            )
+            fig_arrays.update_layout(
+                legend=dict(orientation="h", y=-0.2),
+                margin=dict(l=20, r=20, t=30, b=30)
+            )
+            fig_arrays.update_xaxes(
+                range=[window_start, window_end],
+                tickformat='%H:%M'
+            )
+            _plotly_chart(fig_arrays)
     
     # ==========================
     # Tab 3: Previsioni a 4 Giorni
     # ==========================
     with tabs[2]:
         st.markdown("## Previsioni a 4 Giorni")
+        if daily_forecast_data is not None and not daily_forecast_data.empty:
+            daily_columns = st.columns(len(daily_forecast_data))
+            for daily_column, day in zip(daily_columns, daily_forecast_data.itertuples()):
+                weather_energy = "n.d." if pd.isna(day.weather_energy) else f"{day.weather_energy} kWh"
+                daily_column.metric(label=str(day.data), value=weather_energy, delta=f"ClearSky {day.clearsky_energy} kWh", delta_color="off")
         st.dataframe(forecast_data)
         if (not forecast_data.empty) and {"datetime", "clearsky_production", "weather_production"}.issubset(forecast_data.columns):
+            forecast_times = pd.DatetimeIndex(forecast_data["datetime"]).tz_localize(None)
+            forecast_window = st.slider("Finestra", min_value=forecast_times.min().to_pydatetime(),
+                                        max_value=forecast_times.max().to_pydatetime(),
+                                        value=(forecast_times.min().to_pydatetime(), forecast_times.max().to_pydatetime()),
+                                        step=datetime.timedelta(hours=1), format="DD/MM HH:mm", key="forecast_chart_window")
+            forecast_chart_data = downsample_frame(_window_rows(forecast_data, *map(pd.Timestamp, forecast_window), x="datetime"),
+                                                   columns=["clearsky_production", "weather_production"], x="datetime")
             fig_forecast = px.line(
-                forecast_data,
+                forecast_chart_data,
                 x="datetime",
                 y=["clearsky_production", "weather_production"],
                 labels={"datetime": "Data e Ora", "value": "Produzione (W)"},
                 title="Produzione Fotovoltaico - Previsioni"
             )
             fig_forecast.update_traces(line=dict(width=3))
-            st.plotly_chart(fig_forecast, use_container_width=True)
+            fig_forecast.update_xaxes(range=list(forecast_window))
+            _plotly_chart(fig_forecast)
         else:
             st.info("Dati di previsione non sufficienti per la visualizzazione grafica.")
+
+        # Avvii degli elettrodomestici che massimizzano l'autoconsumo sulla curva prevista
+        if appliance_schedule is not None:
+            st.markdown("### Programmazione Elettrodomestici")
+            if appliance_schedule.empty:
+                st.info("Nessuna previsione meteo disponibile per programmare gli elettrodomestici.")
+            else:
+                st.caption(f"Avvii che massimizzano l'autoconsumo con un carico della casa di {int(house_load)} W")
+                st.dataframe(appliance_schedule.rename(columns={
+                    'name': 'Elettrodomestico', 'start': 'Avvio', 'end': 'Fine', 'energy': 'Energia (kWh)',
+                    'self_consumed_energy': 'Autoconsumo (kWh)', 'self_consumption': 'Autoconsumo (%)'
+                }), hide_index=True)
     
     # ==========================
     # Tab 4: Dati 12 Mesi
     # ==========================
     with tabs[3]:
         st.markdown("## Dati 12 Mesi")
+        st.caption("Produzione Climatologica: nuvolosità media mensile di una climatologia approssimata (Milano), "
+                   "non dello storico meteo del sito selezionato.")
         st.dataframe(monthly_data)
-        required_columns = {"Mese", "Ore di Sole", "Produzione Clearsky", "Produzione Storica"}
+        required_columns = {"Mese", "Ore di Sole", "Produzione Clearsky", "Produzione Climatologica"}
         if (not monthly_data.empty) and required_columns.issubset(monthly_data.columns):
             fig_monthly = px.bar(
                 monthly_data,
                 x="Mese",
-                y=["Ore di Sole", "Produzione Clearsky", "Produzione Storica"],
+                y=["Ore di Sole", "Produzione Clearsky", "Produzione Climatologica"],
                 barmode="group",
                 title="Statistiche Mensili"
             )
-            st.plotly_chart(fig_monthly, use_container_width=True)
+            _plotly_chart(fig_monthly)
         else:
             st.info("Dati mensili non sufficienti per la visualizzazione grafica.")
 
+#### ---- Pannello Performance (sidebar) ----------------------------------------------------
+def render_performance_panel(trace):
+    """Sidebar table with wall time, cache hits and payload of each stage of the last run, plus Prometheus export."""
+
+    if not st.sidebar.checkbox("⏱️ Mostra performance", value=PERF_PANEL_ENABLED):
+        return
+
+    totals = pd.DataFrame.from_dict(trace.totals(), orient='index')
+    with st.sidebar.expander("⏱️ Performance", expanded=True):
+        st.dataframe(totals.round(1), use_container_width=True)
+        st.download_button("Esporta metriche (Prometheus)", trace.to_prometheus(),
+                           file_name="solarpanels.prom", mime="text/plain")
+
 #### ---- Main Function ----------------------------------------------------
 def main():
     # --- Sidebar: Input Generali ---
@@ -0,0 +1,178 @@
+import bisect
+from contextlib import contextmanager
+import datetime
+import logging
+import os
+import sqlite3
+import threading
+
+from pytz import timezone
+
+from config import WEATHER_ARCHIVE_PATH, WEATHER_CACHE_COORD_DECIMALS, OPENWEATHER_FORECAST_CADENCE
+
+logger = logging.getLogger(__name__)
+
+WEATHER_ARCHIVE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS observations (
+    site TEXT NOT NULL,
+    time INTEGER NOT NULL,
+    cloud_cover REAL,
+    weather_code INTEGER,
+    weather_description TEXT,
+    weather_icon TEXT,
+    fetched_at INTEGER NOT NULL,
+    PRIMARY KEY (site, time)
+);
+CREATE TABLE IF NOT EXISTS forecasts (
+    site TEXT NOT NULL,
+    issued_at INTEGER NOT NULL,
+    time INTEGER NOT NULL,
+    cloud_cover REAL,
+    weather_code INTEGER,
+    weather_description TEXT,
+    weather_icon TEXT,
+    PRIMARY KEY (site, issued_at, time)
+);
+CREATE INDEX IF NOT EXISTS forecasts_site_time ON forecasts (site, time);
+"""
+
+#### --- Local archive of every OpenWeather observation and forecast issue ---
+
+class WeatherArchive:
+    """
+    SQLite archive of the OpenWeather responses, keyed by site (rounded lat/lon) and timestamp (UTC epoch seconds).
+
+    - observations: one row per observed time (the 'dt' of the current weather response)
+    - forecasts: every fetched forecast issue, one row per forecast time
+    Range queries return weather points in the format of parse_actual_weather/parse_forecast_weather.
+    """
+
+    def __init__(self, path=WEATHER_ARCHIVE_PATH, coord_decimals=WEATHER_CACHE_COORD_DECIMALS,
+                 forecast_cadence=OPENWEATHER_FORECAST_CADENCE):
+        self.path = path
+        self.coord_decimals = coord_decimals
+        self.forecast_cadence = forecast_cadence
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    def site_key(self, lat, lon):
+        return f"{round(lat, self.coord_decimals)},{round(lon, self.coord_decimals)}"
+
+    @contextmanager
+    def _connect(self):
+        # Una connessione per operazione: l'archivio è usato dai thread del fetch e dai rerun
+        if not self._initialized:
+            with self._lock:
+                if not self._initialized:
+                    directory = os.path.dirname(self.path)
+                    if directory:
+                        os.makedirs(directory, exist_ok=True)
+                    connection = sqlite3.connect(self.path)
+                    try:
+                        connection.execute("PRAGMA journal_mode=WAL")
+                        connection.executescript(WEATHER_ARCHIVE_SCHEMA)
+                    finally:
+                        connection.close()
+                    self._initialized = True
+
+        connection = sqlite3.connect(self.path, timeout=10)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    # --- Recording ---
+
+    def record_observation(self, lat, lon, actual_response, fetched_at):
+        """Stores the current weather response (observation time = its 'dt', or fetched_at without it)."""
+
+        row = (self.site_key(lat, lon), int(actual_response.get('dt', fetched_at)),
+               actual_response['clouds']['all'],
+               actual_response['weather'][0]['id'],
+               actual_response['weather'][0]['description'],
+               actual_response['weather'][0]['icon'],
+               int(fetched_at))
+        with self._connect() as connection:
+            connection.execute("INSERT OR REPLACE INTO observations VALUES (?, ?, ?, ?, ?, ?, ?)", row)
+
+    def record_forecast(self, lat, lon, forecast_response, fetched_at):
+        """Stores all the points of a forecast response as the issue fetched at fetched_at."""
+
+        site = self.site_key(lat, lon)
+        rows = [(site, int(fetched_at), int(entry['dt']),
+                 entry['clouds']['all'],
+                 entry['weather'][0]['id'],
+                 entry['weather'][0]['description'],
+                 entry['weather'][0]['icon'])
+                for entry in forecast_response['list']]
+        with self._connect() as connection:
+            connection.executemany("INSERT OR REPLACE INTO forecasts VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def record(self, endpoint, lat, lon, response, fetched_at):
+        """Stores a response of the OpenWeather 'weather' or 'forecast' endpoint; errors are only logged."""
+
+        try:
+            if endpoint == 'weather':
+                self.record_observation(lat, lon, response, fetched_at)
+            elif endpoint == 'forecast':
+                self.record_forecast(lat, lon, response, fetched_at)
+        except (sqlite3.Error, OSError, KeyError, IndexError, TypeError) as error:
+            logger.warning("Cannot archive weather %s for %s: %s", endpoint, self.site_key(lat, lon), error)
+
+    # --- Range queries ---
+
+    def get_points(self, lat, lon, start, end, std_timezone):
+        """
+        Archived weather points between start and end (widened by one forecast cadence for the interpolation).
+
+        Observations have precedence: for each forecast time only the latest issue is kept, and forecast
+        points closer than half a cadence to an observation are dropped (up to the last observation).
+
+        Returns: (observation points, forecast points), both sorted by time, datetimes in std_timezone
+        """
+
+        if type(std_timezone) == str:
+            std_timezone = timezone(std_timezone)
+
+        site = self.site_key(lat, lon)
+        start = int(start.timestamp()) - self.forecast_cadence
+        end = int(end.timestamp()) + self.forecast_cadence
+
+        try:
+            with self._connect() as connection:
+                observations = connection.execute(
+                    "SELECT time, cloud_cover, weather_code, weather_description, weather_icon FROM observations "
+                    "WHERE site = ? AND time BETWEEN ? AND ? ORDER BY time", (site, start, end)).fetchall()
+                forecasts = connection.execute(
+                    "SELECT f.time, f.cloud_cover, f.weather_code, f.weather_description, f.weather_icon FROM forecasts f "
+                    "JOIN (SELECT time, MAX(issued_at) AS issued_at FROM forecasts WHERE site = ? AND time BETWEEN ? AND ? GROUP BY time) latest "
+                    "ON f.time = latest.time AND f.issued_at = latest.issued_at WHERE f.site = ? ORDER BY f.time",
+                    (site, start, end, site)).fetchall()
+        except sqlite3.Error as error:
+            logger.warning("Cannot read weather archive for %s: %s", site, error)
+            return [], []
+
+        if observations:
+            observed_times = [row[0] for row in observations]
+            half_cadence = self.forecast_cadence / 2
+
+            def far_from_observations(forecast_time):
+                if forecast_time > observed_times[-1]:
+                    return True
+                position = bisect.bisect_left(observed_times, forecast_time)
+                neighbours = observed_times[max(position - 1, 0):position + 1]
+                return min(abs(forecast_time - observed) for observed in neighbours) >= half_cadence
+
+            forecasts = [row for row in forecasts if far_from_observations(row[0])]
+
+        def to_point(row):
+            return {'datetime': datetime.datetime.fromtimestamp(row[0], datetime.timezone.utc).astimezone(std_timezone),
+                    'cloud_cover': row[1],
+                    'weather_code': row[2],
+                    'weather_description': row[3],
+                    'weather_icon': row[4]}
+
+        return [to_point(row) for row in observations], [to_point(row) for row in forecasts]
+
+weather_archive = WeatherArchive() if WEATHER_ARCHIVE_PATH else None
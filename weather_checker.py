@@ -1,23 +1,262 @@
 import datetime
 from pytz import timezone
 import pandas as pd
-#import numpy as np
+import numpy as np
+
+import json
+import logging
+import os
+import threading
+import time
 
 import requests
+from requests.adapters import HTTPAdapter
 
-from config import OPENWEATHER_API_KEY
+import config
 from config import ITALY_TIMEZONE, STANDARD_LOCATION_LATITUDE, STANDARD_LOCATION_LONGITUDE, STANDARD_LOCATION_ALTITUDE
+from config import OPENWEATHER_TIMEOUT, OPENWEATHER_CURRENT_TTL, OPENWEATHER_FORECAST_CADENCE, OPENWEATHER_MAX_STALE
+from config import WEATHER_CACHE_COORD_DECIMALS, WEATHER_CACHE_DIR
+from config import OPENWEATHER_RATE_LIMIT, OPENWEATHER_BURST, FETCH_MAX_WAIT
+from perf_trace import annotate_stage
+from weather_archive import weather_archive
+from fetch_coordinator import FetchCoordinator
+
+logger = logging.getLogger(__name__)
+
+OPENWEATHER_BASE_URL = "https://api.openweathermap.org/data/2.5"
+
+# Unico per processo: richieste identiche in volo condivise tra le sessioni, limite di richieste al secondo
+openweather_coordinator = FetchCoordinator('OpenWeather', OPENWEATHER_RATE_LIMIT, burst=OPENWEATHER_BURST,
+                                           max_wait=FETCH_MAX_WAIT, timeout=OPENWEATHER_TIMEOUT, max_stale=OPENWEATHER_MAX_STALE)
+
+#### --- OpenWeather client: pooled session, TTL cache, on-disk cache, stale-while-revalidate ---
+
+class OpenWeatherClient:
+    """
+    Client for the OpenWeather 'weather' and 'forecast' endpoints.
+
+    - Responses are cached per endpoint and rounded lat/lon.
+    - Current weather expires after OPENWEATHER_CURRENT_TTL, the forecast at the next 3-hour issue boundary.
+    - Expired entries younger than max_stale are returned immediately while a background thread refreshes them.
+    - With cache_dir set, responses are also written to disk and reloaded after a restart.
+    - With an archive (WeatherArchive), every fetched response is also recorded there.
+    - Requests go through a FetchCoordinator: identical in-flight requests are made once, within the provider rate limit.
+    """
+
+    def __init__(self,
+                 timeout=OPENWEATHER_TIMEOUT,
+                 current_ttl=OPENWEATHER_CURRENT_TTL,
+                 forecast_cadence=OPENWEATHER_FORECAST_CADENCE,
+                 max_stale=OPENWEATHER_MAX_STALE,
+                 coord_decimals=WEATHER_CACHE_COORD_DECIMALS,
+                 cache_dir=WEATHER_CACHE_DIR,
+                 archive=weather_archive,
+                 coordinator=openweather_coordinator):
+        self.timeout = timeout
+        self.current_ttl = current_ttl
+        self.forecast_cadence = forecast_cadence
+        self.max_stale = max_stale
+        self.coord_decimals = coord_decimals
+        self.cache_dir = cache_dir
+        self.archive = archive
+        self.coordinator = coordinator
+
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_connections=2, pool_maxsize=8))
+
+        self._cache = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_current_weather(self, lat, lon, api_key=None):
+        return self._get('weather', lat, lon, api_key)
+
+    def get_forecast(self, lat, lon, api_key=None):
+        return self._get('forecast', lat, lon, api_key)
+
+    def _expires_at(self, endpoint, fetched_at):
+        if endpoint == 'forecast':
+            # Allineato alla cadenza di emissione del forecast (ogni 3 ore)
+            return (fetched_at // self.forecast_cadence + 1) * self.forecast_cadence
+        return fetched_at + self.current_ttl
+
+    def _get(self, endpoint, lat, lon, api_key):
+        key = (endpoint, round(lat, self.coord_decimals), round(lon, self.coord_decimals))
+
+        with self._lock:
+            entry = self._cache.get(key)
+        if entry is None:
+            entry = self._load_from_disk(key)
+
+        # Hit/miss registrati sulla fase della singola chiamata: più fasi usano il client in parallelo
+        now = time.time()
+        if entry is not None:
+            if now < entry['expires_at']:
+                self._count_hit()
+                return entry['data']
+            if now - entry['expires_at'] < self.max_stale:
+                self._count_hit()
+                self._refresh_in_background(key, api_key)
+                return entry['data']
+
+        with self._lock:
+            self.misses += 1
+        # Il coordinatore registra sulla fase se la richiesta è condivisa, servita dall'ultimo valore o fatta
+        return self.coordinator.call(key, self._fetch, key, api_key)['data']
+
+    def _count_hit(self):
+        with self._lock:
+            self.hits += 1
+        annotate_stage(cache_hits=1)
+
+    def _fetch(self, key, api_key):
+        endpoint, lat, lon = key
+        if api_key is None:
+            api_key = config.OPENWEATHER_API_KEY
+        response = self.session.get(f"{OPENWEATHER_BASE_URL}/{endpoint}",
+                                    params={'lat': lat, 'lon': lon, 'appid': api_key, 'units': 'metric'},
+                                    timeout=self.timeout)
+        response.raise_for_status()
+        annotate_stage(payload_bytes=len(response.content))
+
+        fetched_at = time.time()
+        entry = {'data': response.json(),
+                 'fetched_at': fetched_at,
+                 'expires_at': self._expires_at(endpoint, fetched_at)}
+
+        with self._lock:
+            self._cache[key] = entry
+        self._save_to_disk(key, entry)
+        if self.archive:
+            self.archive.record(endpoint, lat, lon, entry['data'], fetched_at)
+        return entry
+
+    def _refresh_in_background(self, key, api_key):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                self.coordinator.call(key, self._fetch, key, api_key, allow_stale=False)
+            except (requests.RequestException, ValueError) as error:
+                logger.warning("Weather refresh failed for %s: %s", key, type(error).__name__)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+    def _cache_path(self, key):
+        endpoint, lat, lon = key
+        return os.path.join(self.cache_dir, f"{endpoint}_{lat}_{lon}.json")
+
+    def _load_from_disk(self, key):
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._cache_path(key)) as cache_file:
+                entry = json.load(cache_file)
+        except (OSError, ValueError):
+            return None
+
+        with self._lock:
+            self._cache.setdefault(key, entry)
+        return entry
+
+    def _save_to_disk(self, key, entry):
+        if not self.cache_dir:
+            return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            path = self._cache_path(key)
+            with open(path + '.tmp', 'w') as cache_file:
+                json.dump(entry, cache_file)
+            os.replace(path + '.tmp', path)
+        except OSError as error:
+            logger.warning("Cannot write weather cache %s: %s", key, error)
+
+openweather_client = OpenWeatherClient()
+
+WEATHER_COLUMNS = ['cloud_cover', 'weather_code', 'weather_description', 'weather_icon']
 
 def get_weather_data(times,
                      lat = STANDARD_LOCATION_LATITUDE, lon = STANDARD_LOCATION_LONGITUDE,
-                     openweather_api_key = OPENWEATHER_API_KEY,
+                     openweather_api_key = None,   # default: config.OPENWEATHER_API_KEY
                      freq="1min",                  # Added interpolation parameter
-                     std_timezone = ITALY_TIMEZONE): 
+                     std_timezone = ITALY_TIMEZONE,
+                     weather_client = None,        # default: openweather_client
+                     archive = None):              # default: weather_archive, False: no archive
     """
     Fetches cloud cover for today with specified frequency:
-    - 100% cloudiness for all times before now
+    - archived observations and forecasts for the times before now (see weather_archive)
     - Forecast data from OpenWeather until end of day (handling 3-hour intervals)
     times = series of one day times
+    weather_client = object with get_current_weather/get_forecast (e.g. a local stand-in for tests)
+    A range entirely in the past found in the archive is served without calling OpenWeather.
+    archive = WeatherArchive to read (default: weather_archive), False to neither read nor query one (e.g. with a stand-in client)
+    """
+
+    if times.empty:
+        return False
+
+    weather_client = openweather_client if weather_client is None else weather_client
+    archive = weather_archive if archive is None else archive
+
+    if type(std_timezone) == str:
+        std_timezone = timezone(std_timezone)
+
+    # Past range: only the archive, no API call
+    if archive and times[-1] < datetime.datetime.now(std_timezone):
+        observations, forecasts = archive.get_points(lat, lon, times[0], times[-1], std_timezone)
+        if observations or forecasts:
+            return build_archived_weather_data(times, observations, forecasts, std_timezone=std_timezone)
+
+    # Get Actual Weather and forecast
+    actual_response = weather_client.get_current_weather(lat, lon, openweather_api_key)
+    forecast_response = weather_client.get_forecast(lat, lon, openweather_api_key)
+
+    return build_weather_data(times, actual_response, forecast_response, freq=freq, std_timezone=std_timezone,
+                              history_points=get_weather_history(times, lat, lon, std_timezone, archive))
+
+def get_weather_history(times, lat, lon, std_timezone = ITALY_TIMEZONE, archive = None):
+    """
+    Archived weather points (observations first) for the part of times before now, [] without archive.
+    archive = WeatherArchive to read (default: weather_archive), False for no archive
+    """
+
+    archive = weather_archive if archive is None else archive
+    if type(std_timezone) == str:
+        std_timezone = timezone(std_timezone)
+
+    now = datetime.datetime.now(std_timezone)
+    if not archive or times.empty or times[0] >= now:
+        return []
+
+    observations, forecasts = archive.get_points(lat, lon, times[0], min(times[-1], now), std_timezone)
+    return observations + forecasts
+
+def build_weather_data(times, actual_response, forecast_response,
+                       freq="1min",
+                       std_timezone = ITALY_TIMEZONE,
+                       history_points = ()):
+    """
+    Builds the weather data for times from the OpenWeather 'weather' and 'forecast' responses.
+    A missing response (None) is skipped, so a failed request degrades to the data that is available.
+    history_points (see get_weather_history) extend the weather data back to the first archived point.
+
+    The current weather point is placed at its observation time ('dt' of the response), not at now:
+    the result depends only on the responses and the archived points, so it stays the same (and the
+    stages cached on it stay valid, see stage_graph) as long as the responses come from the cache.
+
+    Returns a dictionary with:
+    - 'times_cloud_cover': weather resampled on times (only between the current weather point, or the first archived point,
+                           and 5 days after the current weather point)
+    - 'actual_weather': list with the current weather point
+    - 'forecast_weather': list with all the forecast points, reusable for other time ranges
     """
 
     # Verify if the time zone input is not in the timezone format
@@ -29,36 +268,69 @@ def get_weather_data(times,
     if times.empty:
         return False
 
-    # limit times to the cloud available data: now + 5 days
-    weather_data_times = times[(times >= now.replace(second=0, microsecond=0)) & (times<= now + datetime.timedelta(days=5)) ]
-    
-    #   full_day_times = times        
-    full_day_df = pd.DataFrame(index=weather_data_times)
-
-    # Get Actual Weather
-    openweather_url = f"https://api.openweathermap.org/data/2.5/weather?lat={lat}&lon={lon}&appid={openweather_api_key}&units=metric"
-    response = requests.get(openweather_url).json()
-
-    actual_data = []
-    actual_time = now.replace(second=0, microsecond=0)
-    actual_data.append({'datetime': actual_time,
-                        'cloud_cover': response['clouds']['all'],
-                        'weather_code' : response['weather'][0]['id'],
-                        'weather_description': response['weather'][0]['description'],
-                        'weather_icon' : response['weather'][0]['icon']
-                       })
-
-    actual_df = pd.DataFrame(actual_data)
-    actual_df.set_index('datetime', inplace=True)
-    full_day_df = full_day_df.combine_first(actual_df)
-    
-    # --------  Get forecast
-    
-    openweather_url = f"https://api.openweathermap.org/data/2.5/forecast?lat={lat}&lon={lon}&appid={openweather_api_key}&units=metric"
-    response = requests.get(openweather_url).json()
+    actual_data = parse_actual_weather(actual_response, now.replace(second=0, microsecond=0))
+    forecast_data = parse_forecast_weather(forecast_response, std_timezone)
+
+    # Actual weather is used only if available
+    weather_points = forecast_data if actual_response is None else actual_data + forecast_data
+
+    # I punti archiviati vengono dopo quelli attuali: a parità di orario vale il dato appena scaricato
+    history_points = list(history_points)
+    start = min(point['datetime'] for point in history_points) if history_points else None
+
+    # Finestra ancorata all'osservazione attuale, non all'orologio: uguale finché la risposta è in cache
+    return {
+        'times_cloud_cover': resample_weather_points(times, weather_points + history_points, actual_data[0]['datetime'], start=start),
+        'actual_weather': actual_data,
+        'forecast_weather': forecast_data
+    }
+
+def build_archived_weather_data(times, observations, forecasts, std_timezone = ITALY_TIMEZONE):
+    """
+    Weather data of a past range from the archived points (see WeatherArchive.get_points),
+    in the format of build_weather_data: 'actual_weather' holds the archived observations.
+    """
+
+    weather_points = observations + forecasts
+    start = min(point['datetime'] for point in weather_points)
+    if not observations:
+        observations = parse_actual_weather(None, start)
+
+    return {
+        'times_cloud_cover': resample_weather_points(times, weather_points, datetime.datetime.now(std_timezone), start=start),
+        'actual_weather': observations,
+        'forecast_weather': forecasts
+    }
+
+def parse_actual_weather(actual_response, actual_time):
+    if actual_response is None:
+        return [{'datetime': actual_time,
+                 'cloud_cover': None,
+                 'weather_code' : None,
+                 'weather_description': None,
+                 'weather_icon' : None
+                }]
+
+    # Orario dell'osservazione, se presente nella risposta
+    if 'dt' in actual_response:
+        actual_time = datetime.datetime.fromtimestamp(actual_response['dt'], datetime.timezone.utc).astimezone(actual_time.tzinfo)
+
+    return [{'datetime': actual_time,
+             'cloud_cover': actual_response['clouds']['all'],
+             'weather_code' : actual_response['weather'][0]['id'],
+             'weather_description': actual_response['weather'][0]['description'],
+             'weather_icon' : actual_response['weather'][0]['icon']
+            }]
+
+def parse_forecast_weather(forecast_response, std_timezone = ITALY_TIMEZONE):
+    if forecast_response is None:
+        return []
+
+    if type(std_timezone) == str:
+        std_timezone = timezone(std_timezone)
 
     forecast_data = []
-    for entry in response['list']:
+    for entry in forecast_response['list']:
         forecast_time = datetime.datetime.utcfromtimestamp(entry['dt']).replace(tzinfo=datetime.timezone.utc)
         forecast_time = forecast_time.astimezone(std_timezone)
         forecast_data.append({'datetime': forecast_time, 
@@ -67,23 +339,47 @@ def get_weather_data(times,
                               'weather_description': entry['weather'][0]['description'], 
                               'weather_icon' : entry['weather'][0]['icon']
                              })
+    return forecast_data
 
-    forecast_df = pd.DataFrame(forecast_data)
-    forecast_df.set_index('datetime', inplace=True)
-    
-    full_day_df = full_day_df.combine_first(forecast_df)
-    
-    full_day_df['cloud_cover'] = full_day_df['cloud_cover'].interpolate(method='linear', limit_direction='both')
-    full_day_df['weather_code'] = full_day_df['weather_code'].ffill()  # Forward fill strings
-    full_day_df['weather_description'] = full_day_df['weather_description'].ffill()  # Forward fill strings
-    full_day_df['weather_icon'] = full_day_df['weather_icon'].ffill()  # Forward fill strings
-    
-    full_day_df = full_day_df.reindex(weather_data_times)
+def resample_weather_points(times, weather_points, now, start=None):
+    """
+    Spreads the weather points (actual + forecast) over times:
+    cloud cover is linearly interpolated in time (constant before the first and after the last point),
+    weather code/description/icon take the value of the last point at or before each time (categorical columns).
+    Only times between now (or start, when earlier: first archived point) and now + 5 days (forecast availability) are returned;
+    now is the time of the current weather point (see build_weather_data).
+    """
 
-    return {
-        'times_cloud_cover': full_day_df,
-        'actual_weather': actual_data
-    }
+    # limit times to the cloud available data: now + 5 days
+    first_time = now.replace(second=0, microsecond=0)
+    if start is not None:
+        first_time = min(first_time, start)
+    weather_data_times = times[(times >= first_time) & (times<= now + datetime.timedelta(days=5)) ]
+    target_epochs = weather_data_times.as_unit('ns').asi8
+
+    # Punti ordinati per orario; il dato attuale (primo) ha la precedenza su un forecast con lo stesso orario
+    point_epochs = pd.DatetimeIndex([point['datetime'] for point in weather_points]).as_unit('ns').asi8
+    order = np.argsort(point_epochs, kind='stable')
+    point_epochs = point_epochs[order]
+    first = np.r_[True, np.diff(point_epochs) != 0] if len(point_epochs) else np.zeros(0, dtype=bool)
+    order, point_epochs = order[first], point_epochs[first]
+
+    resampled = {}
+
+    cloud_cover = np.array([weather_points[index]['cloud_cover'] for index in order], dtype=float)
+    valid = ~np.isnan(cloud_cover)
+    resampled['cloud_cover'] = (np.interp(target_epochs, point_epochs[valid], cloud_cover[valid]) if valid.any()
+                                else np.full(len(target_epochs), np.nan))
+
+    for column in WEATHER_COLUMNS[1:]:
+        values = pd.Categorical([weather_points[index][column] for index in order])
+        valid = values.codes >= 0
+        # Ultimo punto valido non successivo a ogni orario (-1 prima del primo punto)
+        last_point = np.searchsorted(point_epochs[valid], target_epochs, side='right') - 1
+        codes = np.where(last_point >= 0, values.codes[valid][np.maximum(last_point, 0)], -1) if valid.any() else np.full(len(target_epochs), -1)
+        resampled[column] = pd.Categorical.from_codes(codes, dtype=values.dtype)
+
+    return pd.DataFrame(resampled, index=weather_data_times, columns=WEATHER_COLUMNS)
 
 
 